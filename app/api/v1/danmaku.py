@@ -1,58 +1,206 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from app.config import settings
 from app.services.proxy import DanmakuProxy
-from app.models.danmaku import MatchResponse
-from app.models.requests import FileMatchRequest, DanmakuWithDetailRequest, TmdbSearchRequest
-from app.database import get_db
+from app.services.storage import CachedPayload, serialize
+from app.services.streaming import PayloadStream
+from app.services.time_index import TimeWindow
+from app.utils.http_cache import cache_headers, has_conditional_headers, is_not_modified, not_modified_response
+from app.models.danmaku import MatchResponse, BatchMatchResponse
+from app.models.requests import (
+    FileMatchRequest, BatchFileMatchRequest, BatchDanmakuRequest, DanmakuWithDetailRequest, TmdbSearchRequest
+)
+from app.database import get_db, AsyncSessionLocal
 from sqlalchemy.ext.asyncio import AsyncSession
 import os
 from dotenv import load_dotenv
-from typing import Dict, Any, List, Optional
-from app.models.search import AnimeType, AnimeSearchResponse
+from typing import Dict, Any, List, Optional, Union
+from app.models.search import AnimeType, AnimeSearchResponse, AnimeSuggestResponse
 
 # 加载环境变量
 load_dotenv()
 
 router = APIRouter()
 
+def _payload_response(
+    payload: Union[CachedPayload, PayloadStream],
+    headers: Optional[Dict[str, str]] = None
+) -> Response:
+    """直通模式下将缓存的字节串直接作为响应体返回，否则解码后重新序列化；分块数据以流式响应返回"""
+    if isinstance(payload, PayloadStream):
+        return StreamingResponse(payload.chunks, media_type="application/json", headers=headers)
+    if settings.DANMAKU_RAW_PASSTHROUGH:
+        return Response(content=payload.body, media_type="application/json", headers=headers)
+    return JSONResponse(content=payload.decode(), headers=headers)
+
 @router.post("/match", response_model=MatchResponse)
 async def match_file(
     request: FileMatchRequest,
     db: AsyncSession = Depends(get_db)
 ) -> MatchResponse:
     proxy = DanmakuProxy(db)
-    try:
-        result = await proxy.match_file(
-            file_name=request.file_name,
-            file_hash=request.file_hash,
-            file_size=request.file_size,
-            video_duration=request.video_duration,
-            match_mode=request.match_mode
-        )
-        return result
-    finally:
-        await proxy.close()
+    result = await proxy.match_file(
+        file_name=request.file_name,
+        file_hash=request.file_hash,
+        file_size=request.file_size,
+        video_duration=request.video_duration,
+        match_mode=request.match_mode
+    )
+    return result
+
+@router.post("/match/batch", response_model=BatchMatchResponse)
+async def match_files(
+    request: BatchFileMatchRequest,
+    db: AsyncSession = Depends(get_db)
+) -> BatchMatchResponse:
+    """
+    批量匹配文件，结果顺序与请求中的文件顺序一致
+    
+    Args:
+        request: 文件信息列表
+        db: 数据库会话
+    """
+    proxy = DanmakuProxy(db)
+    results = await proxy.match_files(request.files)
+    return BatchMatchResponse(results=results)
+
+def _batch_item(episode_id: int, payload: Optional[CachedPayload], error: Optional[str]) -> bytes:
+    """批量获取弹幕中单个节目的结果，直接拼接缓存的字节串，不解码弹幕数据"""
+    if payload is None:
+        return serialize({'episodeId': episode_id, 'error': error})
+    return b'{"episodeId":%d,"danmaku":' % episode_id + payload.body + b'}'
+
+@router.post("/danmaku/batch")
+async def get_danmaku_batch(
+    request: BatchDanmakuRequest,
+    cache_ttl: Optional[int] = None,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    批量获取多个节目的弹幕数据
+    
+    默认返回 {"results": [...]}，顺序与请求一致（重复的编号只返回一次）；stream 为 true 时以NDJSON返回，
+    每获取完一个节目输出一行。每项为 {"episodeId": 编号, "danmaku": 弹幕数据}，
+    获取失败时为 {"episodeId": 编号, "error": 错误信息}。
+    
+    Args:
+        request: 节目编号列表和弹幕获取参数
+        cache_ttl: 缓存过期时间（分钟），如果为None则使用默认配置；指定时不返回过期的旧数据
+        db: 数据库会话
+    """
+    options = dict(
+        episode_ids=request.episode_ids,
+        with_related=request.with_related,
+        ch_convert=request.ch_convert,
+        cache_ttl=cache_ttl
+    )
+    if request.stream:
+        async def lines():
+            # 依赖注入的会话在响应开始发送前关闭，流式输出使用独立会话
+            async with AsyncSessionLocal() as session:
+                async for item in DanmakuProxy(session).get_danmaku_batch(**options):
+                    yield _batch_item(*item) + b'\n'
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+    results = {}
+    async for episode_id, payload, error in DanmakuProxy(db).get_danmaku_batch(**options):
+        results[episode_id] = _batch_item(episode_id, payload, error)
+    body = b'{"results":[' + b','.join(results[i] for i in dict.fromkeys(request.episode_ids)) + b']}'
+    return Response(content=body, media_type="application/json")
 
 @router.get("/{episode_id}")
 async def get_danmaku(
     episode_id: int,
+    request: Request,
     from_id: int = 0,
     with_related: bool = False,
     ch_convert: int = 0,
     cache_ttl: Optional[int] = None,
+    start: Optional[float] = Query(None, ge=0, description="起始播放时间（秒）"),
+    end: Optional[float] = Query(None, ge=0, description="结束播放时间（秒），不包含"),
+    cursor: Optional[str] = Query(None, description="上一页返回的 nextCursor"),
+    limit: Optional[int] = Query(None, ge=1, le=10000, description="每页最多返回的弹幕数"),
     db: AsyncSession = Depends(get_db)
 ):
+    # 按播放时间截取或分页时，响应中有下一页时附加 nextCursor 字段
+    window = None
+    if start is not None or end is not None or cursor is not None or limit is not None:
+        try:
+            window = TimeWindow(start, end, cursor, limit)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="无效的分页游标")
+
     proxy = DanmakuProxy(db)
-    try:
-        result = await proxy.get_danmaku(
+    # 条件请求：只查询缓存的校验和与更新时间，客户端缓存有效时直接返回304
+    if has_conditional_headers(request):
+        meta = await proxy.get_danmaku_meta(
             episode_id=episode_id,
             from_id=from_id,
             with_related=with_related,
             ch_convert=ch_convert,
+            cache_ttl=cache_ttl,
+            window=window
+        )
+        if meta is not None and is_not_modified(request, *meta):
+            return not_modified_response(cache_headers(*meta, settings.HTTP_CACHE_MAX_AGE))
+
+    if settings.DANMAKU_STREAMING and from_id == 0 and window is None:
+        # 流式模式：完整弹幕分块返回，从上游边读取边返回时还没有校验和，不返回缓存相关响应头
+        payload = await proxy.stream_danmaku(
+            episode_id=episode_id,
+            with_related=with_related,
+            ch_convert=ch_convert,
             cache_ttl=cache_ttl
         )
-        return result
-    finally:
-        await proxy.close()
+    else:
+        payload = await proxy.get_danmaku(
+            episode_id=episode_id,
+            from_id=from_id,
+            with_related=with_related,
+            ch_convert=ch_convert,
+            cache_ttl=cache_ttl,
+            raw=True,
+            window=window
+        )
+    headers = None
+    if payload.checksum is not None:
+        headers = cache_headers(payload.checksum, payload.updated_at, settings.HTTP_CACHE_MAX_AGE)
+    return _payload_response(payload, headers)
+
+@router.get("/{episode_id}/density")
+async def get_danmaku_density(
+    episode_id: int,
+    bucket: int = Query(30, ge=1, le=3600, description="区间长度（秒）"),
+    by_mode: bool = False,
+    by_color: bool = False,
+    with_related: bool = False,
+    ch_convert: int = 0,
+    cache_ttl: Optional[int] = None,
+    db: AsyncSession = Depends(get_db)
+) -> Dict[str, Any]:
+    """
+    获取弹幕密度：按播放时间区间统计的弹幕数量，可同时按模式和颜色分别统计
+    
+    Args:
+        episode_id: 节目编号
+        bucket: 区间长度（秒），counts[i] 为 [i * bucket, (i + 1) * bucket) 内的弹幕数
+        by_mode: 是否返回按弹幕模式分别统计的 byMode
+        by_color: 是否返回按弹幕颜色分别统计的 byColor
+        with_related: 是否包含关联的第三方弹幕
+        ch_convert: 中文简繁转换方式
+        cache_ttl: 缓存过期时间（分钟），如果为None则使用默认配置；指定时不返回过期的旧数据
+        db: 数据库会话
+    """
+    proxy = DanmakuProxy(db)
+    return await proxy.get_danmaku_density(
+        episode_id=episode_id,
+        bucket=bucket,
+        by_mode=by_mode,
+        by_color=by_color,
+        with_related=with_related,
+        ch_convert=ch_convert,
+        cache_ttl=cache_ttl
+    )
 
 @router.post("/match_with_danmaku")
 async def get_danmaku_with_detail(
@@ -65,28 +213,28 @@ async def get_danmaku_with_detail(
     
     Args:
         request: 包含文件信息和弹幕获取参数的请求
-        cache_ttl: 缓存过期时间（分钟），如果为None则使用默认配置
+        cache_ttl: 缓存过期时间（分钟），如果为None则使用默认配置；指定时不返回过期的旧数据
         db: 数据库会话
         
     Returns:
         Dict[str, Any]: 弹幕数据，如果匹配失败则返回空字典
     """
     proxy = DanmakuProxy(db)
-    try:
-        result = await proxy.get_danmaku_with_detail(
-            file_name=request.file_name,
-            file_hash=request.file_hash,
-            file_size=request.file_size,
-            video_duration=request.video_duration,
-            match_mode=request.match_mode,
-            from_id=request.from_id,
-            with_related=request.with_related,
-            ch_convert=request.ch_convert,
-            cache_ttl=cache_ttl
-        )
-        return result or {}
-    finally:
-        await proxy.close()
+    result = await proxy.get_danmaku_with_detail(
+        file_name=request.file_name,
+        file_hash=request.file_hash,
+        file_size=request.file_size,
+        video_duration=request.video_duration,
+        match_mode=request.match_mode,
+        from_id=request.from_id,
+        with_related=request.with_related,
+        ch_convert=request.ch_convert,
+        cache_ttl=cache_ttl,
+        raw=True
+    )
+    if result is None:
+        return {}
+    return _payload_response(result)
 
 @router.post("/search/tmdb")
 async def search_by_tmdb(
@@ -104,14 +252,60 @@ async def search_by_tmdb(
         Dict[str, Any]: 搜索结果，包含匹配的动画信息和剧集信息
     """
     proxy = DanmakuProxy(db)
-    try:
-        result = await proxy.search_by_tmdb(
-            tmdb_id=request.tmdb_id,
-            episode=request.episode
-        )
-        return result
-    finally:
-        await proxy.close()
+    payload = await proxy.search_by_tmdb(
+        tmdb_id=request.tmdb_id,
+        episode=request.episode,
+        raw=True
+    )
+    return _payload_response(payload, cache_headers(payload.checksum, payload.updated_at))
+
+@router.get("/search/tmdb")
+async def search_by_tmdb_get(
+    request: Request,
+    tmdb_id: int,
+    episode: int,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    通过TMDB ID搜索动画剧集（GET版本，支持条件请求和反向代理缓存）
+    
+    Args:
+        request: 请求
+        tmdb_id: TMDB ID
+        episode: 集数
+        db: 数据库会话
+        
+    Returns:
+        搜索结果，客户端缓存有效时返回304
+    """
+    proxy = DanmakuProxy(db)
+    if has_conditional_headers(request):
+        meta = await proxy.get_tmdb_meta(tmdb_id=tmdb_id, episode=episode)
+        if meta is not None and is_not_modified(request, *meta):
+            return not_modified_response(cache_headers(*meta, settings.HTTP_CACHE_MAX_AGE))
+
+    payload = await proxy.search_by_tmdb(tmdb_id=tmdb_id, episode=episode, raw=True)
+    return _payload_response(
+        payload, cache_headers(payload.checksum, payload.updated_at, settings.HTTP_CACHE_MAX_AGE)
+    )
+
+@router.get("/search/anime/suggest", response_model=AnimeSuggestResponse)
+async def suggest_anime(
+    keyword: str = Query(..., min_length=1, description="输入中的关键词"),
+    anime_type: Optional[AnimeType] = Query(None, alias="type"),
+    limit: int = Query(10, ge=1, le=50, description="最多返回的作品数"),
+    db: AsyncSession = Depends(get_db)
+) -> AnimeSuggestResponse:
+    """
+    根据关键词从本地作品目录联想作品，用于输入时的自动补全，不请求上游
+    """
+    proxy = DanmakuProxy(db)
+    animes = await proxy.suggest_anime(
+        keyword=keyword,
+        limit=limit,
+        anime_type=anime_type.value if anime_type else None
+    )
+    return AnimeSuggestResponse(animes=animes)
 
 @router.get("/search/anime", response_model=AnimeSearchResponse)
 async def search_anime(
@@ -123,11 +317,8 @@ async def search_anime(
     根据关键词搜索作品
     """
     proxy = DanmakuProxy(db)
-    try:
-        result = await proxy.search_anime(
-            keyword=keyword,
-            anime_type=anime_type.value if anime_type else None
-        )
-        return AnimeSearchResponse(**result)
-    finally:
-        await proxy.close()
+    result = await proxy.search_anime(
+        keyword=keyword,
+        anime_type=anime_type.value if anime_type else None
+    )
+    return AnimeSearchResponse(**result)
@@ -1,13 +1,15 @@
-from fastapi import APIRouter, Depends
-from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func
-from app.database import get_db
-from app.models.api_stats import ApiStats
-from datetime import datetime, timedelta
-import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
+from fastapi import APIRouter, Query
+from app.database import AsyncSessionLocal
+from app.services.memory_cache import danmaku_memory_cache, danmaku_index_cache, tmdb_memory_cache, search_memory_cache, stats_memory_cache
+from app.services.singleflight import danmaku_flight, index_flight, match_flight, tmdb_flight, search_flight, stats_flight
+from app.services.search_cache import search_metrics
+from app.services.local_match import local_matcher
+from app.services.negative_cache import negative_cache
+from app.services.stats_writer import stats_writer
+from app.services.prefetch import prefetcher
+from app.services.cache_warmer import cache_warmer
+from app.services.upstream import comment_upstream, match_upstream, search_upstream
+from app.services.stats_rollup import load_dashboard
 from fastapi.responses import HTMLResponse
 from fastapi.templating import Jinja2Templates
 from fastapi import Request
@@ -20,111 +22,61 @@ BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.pa
 templates = Jinja2Templates(directory=os.path.join(BASE_DIR, "templates"))
 
 @router.get("/stats", response_class=HTMLResponse)
-async def get_stats(request: Request, db: AsyncSession = Depends(get_db)):
-    """获取API统计图表"""
-    try:
-        # 获取最近24小时的数据
-        start_time = datetime.now() - timedelta(hours=24)
-        
-        # 按端点统计调用次数
-        endpoint_stats = await db.execute(
-            select(
-                ApiStats.endpoint,
-                func.count().label('count'),
-                func.avg(ApiStats.response_time).label('avg_response_time')
-            )
-            .where(ApiStats.timestamp >= start_time)
-            .group_by(ApiStats.endpoint)
-        )
-        endpoint_stats = endpoint_stats.all()
-        
-        # 按小时统计调用次数
-        hourly_stats = await db.execute(
-            select(
-                func.strftime('%Y-%m-%d %H:00:00', ApiStats.timestamp).label('hour'),
-                func.count().label('count')
-            )
-            .where(ApiStats.timestamp >= start_time)
-            .group_by('hour')
-            .order_by('hour')
-        )
-        hourly_stats = hourly_stats.all()
-        
-        # 生成端点统计图表
-        df_endpoints = pd.DataFrame(endpoint_stats, columns=['endpoint', 'count', 'avg_response_time'])
-        fig_endpoints = make_subplots(rows=2, cols=1, 
-                                   subplot_titles=('API调用次数', '平均响应时间'))
-        
-        fig_endpoints.add_trace(
-            go.Bar(x=df_endpoints['endpoint'], y=df_endpoints['count'], name='调用次数'),
-            row=1, col=1
-        )
-        
-        fig_endpoints.add_trace(
-            go.Bar(x=df_endpoints['endpoint'], y=df_endpoints['avg_response_time'], name='平均响应时间(ms)'),
-            row=2, col=1
-        )
-        
-        fig_endpoints.update_layout(height=800, title_text="API端点统计")
-        endpoint_chart = fig_endpoints.to_html(full_html=False)
-        
-        # 生成时间趋势图表
-        df_hourly = pd.DataFrame(hourly_stats, columns=['hour', 'count'])
-        fig_hourly = px.line(df_hourly, x='hour', y='count',
-                           title='24小时API调用趋势')
-        hourly_chart = fig_hourly.to_html(full_html=False)
-        
-        # 生成状态码分布图表
-        status_stats = await db.execute(
-            select(
-                ApiStats.status_code,
-                func.count().label('count')
-            )
-            .where(ApiStats.timestamp >= start_time)
-            .group_by(ApiStats.status_code)
-        )
-        status_stats = status_stats.all()
-        
-        df_status = pd.DataFrame(status_stats, columns=['status_code', 'count'])
-        fig_status = px.pie(df_status, values='count', names='status_code',
-                          title='API响应状态码分布')
-        status_chart = fig_status.to_html(full_html=False)
-        
-        # 获取一些基本统计信息
-        total_requests = await db.scalar(
-            select(func.count()).select_from(ApiStats)
-            .where(ApiStats.timestamp >= start_time)
-        )
-        
-        avg_response_time = await db.scalar(
-            select(func.avg(ApiStats.response_time)).select_from(ApiStats)
-            .where(ApiStats.timestamp >= start_time)
-        )
-        
-        error_count = await db.scalar(
-            select(func.count()).select_from(ApiStats)
-            .where(ApiStats.timestamp >= start_time, ApiStats.status_code >= 400)
-        )
-        
-        return templates.TemplateResponse(
-            "stats.html",
-            {
-                "request": request,
-                "endpoint_chart": endpoint_chart,
-                "hourly_chart": hourly_chart,
-                "status_chart": status_chart,
-                "total_requests": total_requests or 0,
-                "avg_response_time": round(avg_response_time or 0, 2),
-                "error_count": error_count or 0,
-                "error_rate": round((error_count or 0) / (total_requests or 1) * 100, 2)
-            }
-        )
-        
-    except Exception as e:
-        return templates.TemplateResponse(
-            "error.html",
-            {
-                "request": request,
-                "error": str(e)
-            }
-        ) 
\ No newline at end of file
+async def get_stats(request: Request):
+    """获取API统计页面，图表由浏览器根据 /stats/data 的数据绘制"""
+    return templates.TemplateResponse("stats.html", {"request": request})
+
+@router.get("/stats/data")
+async def get_stats_data(hours: int = Query(24, ge=1, le=24 * 90)):
+    """
+    获取API统计数据
+    
+    数据来自小时级预聚合表，并在内存中缓存 STATS_DATA_CACHE_SECONDS 秒，
+    多个统计页面同时刷新时只查询一次数据库。
+    
+    Args:
+        hours: 统计最近多少小时，默认24小时
+    """
+    data = stats_memory_cache.get(hours)
+    if data is not None:
+        return data
+
+    async def load():
+        async with AsyncSessionLocal() as session:
+            data = await load_dashboard(session, hours=hours)
+        stats_memory_cache.set(hours, data)
+        return data
+
+    return await stats_flight.do(hours, load)
+
+@router.get("/stats/cache")
+async def get_cache_stats():
+    """获取进程内存缓存、并发请求合并和API统计写入器的统计信息"""
+    return {
+        "memory": {
+            "danmaku": danmaku_memory_cache.stats(),
+            "danmaku_index": danmaku_index_cache.stats(),
+            "tmdb": tmdb_memory_cache.stats(),
+            "search": search_memory_cache.stats(),
+            "stats": stats_memory_cache.stats()
+        },
+        "singleflight": {
+            "danmaku": danmaku_flight.stats(),
+            "danmaku_index": index_flight.stats(),
+            "match": match_flight.stats(),
+            "tmdb": tmdb_flight.stats(),
+            "search": search_flight.stats(),
+            "stats": stats_flight.stats()
+        },
+        "search": search_metrics.stats(),
+        "local_match": local_matcher.stats(),
+        "negative": negative_cache.stats(),
+        "prefetch": prefetcher.stats(),
+        "cache_warmer": cache_warmer.stats(),
+        "upstream": [
+            comment_upstream.stats(),
+            match_upstream.stats(),
+            search_upstream.stats()
+        ],
+        "stats_writer": stats_writer.stats()
+    }
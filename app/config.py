@@ -4,6 +4,9 @@ from typing import Optional
 class Settings(BaseSettings):
     # 数据库配置
     DATABASE_URL: str = "sqlite+aiosqlite:///./dandan.db"
+    SQLITE_BUSY_TIMEOUT: float = 30  # 等待其他连接或工作进程释放写锁的最长时间（秒）
+    SQLITE_READ_POOL_SIZE: int = 5  # 每个工作进程的读连接池大小，写操作共用一个写连接
+    WEB_CONCURRENCY: int = 1  # 工作进程数，由 run_server.sh 的 --workers 参数设置，上游限速按进程数平分
     
     # 弹弹play API配置
     DANDAN_API_BASE_URL: str = "https://api.dandanplay.net"
@@ -12,6 +15,99 @@ class Settings(BaseSettings):
     
     # 缓存配置
     CACHE_EXPIRE_MINUTES: int = 1440
+    CACHE_STALE_GRACE_MINUTES: int = 60  # 缓存过期后仍可直接返回并在后台刷新的时间，0表示关闭
+    CACHE_REFRESH_FAILURE_COOLDOWN_SECONDS: int = 60  # 后台刷新失败后同一缓存在此时间内不再刷新，0表示关闭
+    CACHE_MAX_STALE_MINUTES: int = 2880  # 可返回的缓存数据的最大时长，超过后必须等待上游
+    DANMAKU_FULL_REFRESH_MINUTES: int = 10080  # 增量刷新之间强制全量刷新的间隔，用于同步上游删除的弹幕
+    SEARCH_CACHE_EXPIRE_MINUTES: int = 360  # 关键词搜索作品结果的缓存时间
+    NEGATIVE_CACHE_ENABLED: bool = True  # 是否缓存上游没有结果的查询
+    NEGATIVE_CACHE_MATCH_MINUTES: int = 360  # 未能匹配的文件在此时间内不再请求上游
+    NEGATIVE_CACHE_DANMAKU_MINUTES: int = 60  # 上游返回404的节目在此时间内不再请求上游
+    NEGATIVE_CACHE_SEARCH_MINUTES: int = 30  # 没有结果的搜索在此时间内不再请求上游
+    CATALOG_ENABLED: bool = True  # 是否将搜索和匹配结果中的作品和剧集写入本地目录
+    SEARCH_LOCAL_FIRST: bool = False  # 近期的搜索结果可以代替上游回答时不请求上游搜索
+    SEARCH_LOCAL_MAX_RESULTS: int = 100  # 本地优先搜索返回的结果数上限
+    CACHE_STORAGE_FORMAT: str = "gzip"  # 缓存数据存储格式：json、gzip 或 zstd（需要安装zstandard）
+    CACHE_COMPRESSION_LEVEL: Optional[int] = None  # 压缩级别，为空时gzip使用6，zstd使用3
+    DANMAKU_RAW_PASSTHROUGH: bool = True  # 直接返回缓存的JSON字节串，不经解码和重新序列化
+    HTTP_CACHE_MAX_AGE: int = 300  # 弹幕和TMDB响应的 Cache-Control max-age（秒），0表示不允许缓存
+    DANMAKU_STREAMING: bool = False  # 流式模式：分块读取上游弹幕并边写入缓存边返回，内存占用与弹幕数量无关
+    DANMAKU_STREAM_MIN_BYTES: int = 1024 * 1024  # 流式模式下超过此大小的弹幕不进入内存缓存，直接分块返回
+    
+    # 进程内存缓存配置（按缓存数据总字节数限制容量）
+    MEMORY_CACHE_ENABLED: bool = True
+    DANMAKU_MEMORY_CACHE_MAX_BYTES: int = 256 * 1024 * 1024
+    TMDB_MEMORY_CACHE_MAX_BYTES: int = 16 * 1024 * 1024
+    SEARCH_MEMORY_CACHE_MAX_BYTES: int = 16 * 1024 * 1024
+    NEGATIVE_CACHE_MEMORY_MAX_BYTES: int = 4 * 1024 * 1024
+    DANMAKU_INDEX_CACHE_MAX_BYTES: int = 128 * 1024 * 1024  # 按播放时间截取弹幕使用的时间索引
+    
+    # 上游HTTP客户端配置（全局共享连接池）
+    HTTP_MAX_CONNECTIONS: int = 100  # 连接池最大连接数
+    HTTP_MAX_KEEPALIVE_CONNECTIONS: int = 20  # 最大保持活动的空闲连接数
+    HTTP_KEEPALIVE_EXPIRY: float = 30.0  # 空闲连接保持时间（秒）
+    HTTP2_ENABLED: bool = False  # 是否启用HTTP/2（需要安装h2）
+    HTTP_CONNECT_TIMEOUT: float = 5.0  # 建立连接超时（秒）
+    HTTP_READ_TIMEOUT: float = 30.0  # 读取响应超时（秒）
+    HTTP_WRITE_TIMEOUT: float = 10.0  # 发送请求超时（秒）
+    HTTP_POOL_TIMEOUT: float = 5.0  # 等待连接池空闲连接超时（秒）
+    
+    # 上游流量控制配置
+    UPSTREAM_COMMENT_RATE: float = 20.0  # 弹幕接口每秒请求数上限，0表示不限速
+    UPSTREAM_COMMENT_BURST: int = 40  # 弹幕接口允许的突发请求数
+    UPSTREAM_COMMENT_MAX_IN_FLIGHT: int = 16  # 弹幕接口同时进行的请求数上限
+    UPSTREAM_MATCH_RATE: float = 10.0  # 匹配接口每秒请求数上限
+    UPSTREAM_MATCH_BURST: int = 20  # 匹配接口允许的突发请求数
+    UPSTREAM_MATCH_MAX_IN_FLIGHT: int = 8  # 匹配接口同时进行的请求数上限
+    UPSTREAM_SEARCH_RATE: float = 5.0  # 搜索接口每秒请求数上限
+    UPSTREAM_SEARCH_BURST: int = 10  # 搜索接口允许的突发请求数
+    UPSTREAM_SEARCH_MAX_IN_FLIGHT: int = 4  # 搜索接口同时进行的请求数上限
+    UPSTREAM_QUEUE_TIMEOUT: float = 10.0  # 等待限速令牌和并发名额的超时（秒）
+    UPSTREAM_MAX_RETRIES: int = 2  # 上游返回429/5xx或网络错误时幂等请求的重试次数
+    UPSTREAM_RETRY_BASE_DELAY: float = 0.5  # 重试退避的基础时间（秒），每次翻倍并随机抖动
+    UPSTREAM_RETRY_MAX_DELAY: float = 5.0  # 重试退避的最大时间（秒）
+    UPSTREAM_BREAKER_FAILURE_THRESHOLD: int = 5  # 连续失败多少次后熔断，0表示不熔断
+    UPSTREAM_BREAKER_RESET_SECONDS: float = 30.0  # 熔断后多久放行探测请求（秒）
+    UPSTREAM_SERVE_STALE: bool = True  # 上游熔断时是否返回任意时长的旧弹幕缓存
+    
+    # 批量请求配置
+    MATCH_UPSTREAM_CONCURRENCY: int = 8  # 批量匹配时同时进行的上游请求数
+    MATCH_UPSTREAM_BATCH_SIZE: int = 32  # 每次调用上游批量匹配接口的文件数，0表示不使用批量接口
+    DANMAKU_BATCH_CONCURRENCY: int = 4  # 批量获取弹幕时同时进行的上游请求数
+    
+    # 本地文件名匹配配置（matchMode 为 local 或 localFirst 时使用）
+    LOCAL_MATCH_ENABLED: bool = True  # 是否启用本地匹配，关闭后 local 模式不匹配，localFirst 模式直接请求上游
+    LOCAL_MATCH_MIN_SCORE: float = 0.85  # 文件名标题与历史记录的最低相似度（0-1）
+    LOCAL_MATCH_DURATION_TOLERANCE: int = 5  # 视频时长与历史记录的最大差值（秒）
+    LOCAL_MATCH_SIZE_TOLERANCE: float = 0.1  # 文件大小与历史记录相差在此比例内时优先选择
+    LOCAL_MATCH_INFER_EPISODES: bool = False  # 没有某一集的记录时是否由同一作品其他集的编号推算，推算结果须在本地剧集目录中
+    LOCAL_MATCH_REFRESH_MINUTES: int = 60  # 从数据库重建本地匹配索引的间隔
+    
+    # 预取下一集弹幕配置
+    PREFETCH_ENABLED: bool = False  # 获取弹幕后是否在后台预取下一集
+    PREFETCH_CONCURRENCY: int = 2  # 同时进行的预取数，达到上限时放弃新的预取
+    PREFETCH_MIN_REMAINING_MINUTES: int = 60  # 缓存剩余有效时间不足此值时才重新预取
+    
+    # 热门弹幕缓存预热配置
+    CACHE_WARM_ENABLED: bool = False  # 是否定期在过期前刷新热门弹幕缓存
+    CACHE_WARM_INTERVAL_MINUTES: int = 10  # 预热间隔（分钟）
+    CACHE_WARM_TOP_N: int = 100  # 每轮考虑的热门条目数
+    CACHE_WARM_LEAD_MINUTES: int = 30  # 缓存在此时间内即将过期时刷新（分钟）
+    CACHE_WARM_BUDGET: int = 20  # 每轮最多请求上游的次数
+    CACHE_WARM_CONCURRENCY: int = 2  # 预热时同时进行的上游请求数
+    CACHE_WARM_DEMAND_WINDOW_MINUTES: int = 60  # 统计访问热度的时间窗口（分钟）
+    
+    # API调用统计配置
+    API_STATS_QUEUE_SIZE: int = 10000  # 待写入统计记录的队列容量，队列满时丢弃记录
+    API_STATS_BATCH_SIZE: int = 500  # 每次批量写入的最大记录数
+    API_STATS_FLUSH_INTERVAL: float = 2.0  # 批量写入的最长等待时间（秒）
+    API_STATS_PARAMS_SAMPLE_RATE: float = 1.0  # 记录请求参数的采样比例（0-1）
+    API_STATS_KEEP_RAW: bool = True  # 是否保存每次调用的原始记录（预聚合数据始终保存）
+    API_STATS_RAW_RETENTION_HOURS: int = 72  # 原始记录保留时间（小时）
+    API_STATS_MINUTE_RETENTION_HOURS: int = 48  # 分钟级预聚合数据保留时间（小时）
+    API_STATS_HOUR_RETENTION_DAYS: int = 90  # 小时级预聚合数据保留时间（天）
+    API_STATS_PURGE_INTERVAL_MINUTES: int = 10  # 清理过期统计数据的间隔（分钟）
+    STATS_DATA_CACHE_SECONDS: int = 30  # 统计面板数据的缓存时间（秒）
     
     class Config:
         env_file = ".env"
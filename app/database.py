@@ -1,35 +1,248 @@
 import os
+import logging
+from sqlalchemy import event, inspect, text
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.sql.dml import UpdateBase
 from .config import settings
-from .models.danmaku import Base as DanmakuBase, TmdbCache
+from .models.danmaku import Base as DanmakuBase, DanmakuCache, TmdbCache
 from .models.file_match import Base as FileMatchBase
+from .models.catalog import CatalogAnime, CatalogEpisode
+
+# 配置日志记录器
+logger = logging.getLogger(__name__)
 
 # 确保数据库目录存在
 db_dir = os.path.dirname(settings.DATABASE_URL.replace('sqlite+aiosqlite:///', ''))
 if db_dir and not os.path.exists(db_dir):
     os.makedirs(db_dir)
 
-# 创建异步引擎
+# 内存数据库每个连接都是独立的数据库，只能共用一个连接
+_in_memory = make_url(settings.DATABASE_URL).database in (None, '', ':memory:')
+
+# 创建异步引擎（读连接池）
 engine = create_async_engine(
     settings.DATABASE_URL,
     echo=False,  # 生产环境关闭SQL日志输出
-    future=True
+    future=True,
+    connect_args={'timeout': settings.SQLITE_BUSY_TIMEOUT},
+    **({} if _in_memory else {
+        'poolclass': AsyncAdaptedQueuePool,
+        'pool_size': settings.SQLITE_READ_POOL_SIZE
+    })
 )
 
+# 写引擎只有一个连接，进程内的写事务依次执行；多个工作进程之间由 SQLite 的写锁串行
+write_engine = engine if _in_memory else create_async_engine(
+    settings.DATABASE_URL,
+    echo=False,
+    future=True,
+    poolclass=AsyncAdaptedQueuePool,
+    pool_size=1,
+    max_overflow=0,
+    pool_timeout=settings.SQLITE_BUSY_TIMEOUT,
+    connect_args={'timeout': settings.SQLITE_BUSY_TIMEOUT}
+)
+
+@event.listens_for(engine.sync_engine, 'connect')
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """
+    WAL 模式下读不阻塞写、写不阻塞读，多个工作进程可以同时读取；
+    synchronous=NORMAL 在 WAL 模式下只在检查点时同步磁盘，断电时最多丢失最近的事务而不会损坏数据库
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA busy_timeout={int(settings.SQLITE_BUSY_TIMEOUT * 1000)}")
+    if not _in_memory:
+        cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+if write_engine is not engine:
+    event.listen(write_engine.sync_engine, 'connect', _set_sqlite_pragmas)
+
+    @event.listens_for(write_engine.sync_engine, 'connect')
+    def _disable_implicit_begin(dbapi_connection, connection_record):
+        """由 begin 事件发出 BEGIN IMMEDIATE，不使用驱动隐式开始的事务"""
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(write_engine.sync_engine, 'begin')
+    def _begin_immediate(conn):
+        """
+        写事务开始时即获取写锁：延迟事务在读取后升级为写事务时，若其他进程已提交写入会直接失败而不等待，
+        立即获取写锁时则按 busy_timeout 等待
+        """
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+class RoutingSession(Session):
+    """
+    读写分离的会话：查询使用读连接池，写入和同一事务中写入之后的查询使用写连接
+
+    先查询再决定插入或更新的会话应使用 WriteSessionLocal，查询也在写事务中进行，
+    否则多个工作进程可能同时查询到记录不存在并重复插入。
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if (
+            self.info.get('writer') or self.info.get('writing')
+            or self._flushing or isinstance(clause, UpdateBase)
+        ):
+            self.info['writing'] = True
+            return write_engine.sync_engine
+        return engine.sync_engine
+
+@event.listens_for(RoutingSession, 'after_transaction_end')
+def _reset_writing(session, transaction):
+    """事务结束后重新使用读连接"""
+    if transaction.parent is None:
+        session.info.pop('writing', None)
+
 # 创建异步会话工厂
 AsyncSessionLocal = sessionmaker(
-    engine,
     class_=AsyncSession,
+    sync_session_class=RoutingSession,
     expire_on_commit=False
 )
 
+# 所有语句都使用写连接的会话工厂，用于先查询再写入的操作
+WriteSessionLocal = sessionmaker(
+    class_=AsyncSession,
+    sync_session_class=RoutingSession,
+    expire_on_commit=False,
+    info={'writer': True}
+)
+
+def _migrate_legacy_danmaku_cache(sync_conn):
+    """
+    旧版弹幕缓存只按 episode_id 唯一，无法区分弹幕来源参数，SQLite 不能修改唯一约束，
+    因此按新结构重建表，并把旧记录作为包含关联弹幕、不转换的缓存复制过来
+
+    旧记录的来源参数未知，也可能只是增量数据，复制时不保留最大弹幕编号和全量刷新时间，
+    下次刷新时会全量获取并覆盖。
+    """
+    inspector = inspect(sync_conn)
+    if not inspector.has_table('danmaku_cache'):
+        return
+    existing = {column['name'] for column in inspector.get_columns('danmaku_cache')}
+    if 'with_related' in existing:
+        return
+
+    table = DanmakuCache.__table__
+    old_name = 'danmaku_cache_legacy'
+    # 索引名称在整个数据库中唯一，先删除旧表的索引再重建
+    for index in inspector.get_indexes('danmaku_cache'):
+        sync_conn.execute(text(f'DROP INDEX IF EXISTS {index["name"]}'))
+    sync_conn.execute(text(f'ALTER TABLE danmaku_cache RENAME TO {old_name}'))
+    table.create(sync_conn)
+    columns = ', '.join(
+        name for name in ('id', 'episode_id', 'data', 'created_at', 'updated_at') if name in existing
+    )
+    result = sync_conn.execute(text(
+        f'INSERT INTO danmaku_cache ({columns}, with_related, ch_convert) '
+        f'SELECT {columns}, 1, 0 FROM {old_name}'
+    ))
+    sync_conn.execute(text(f'DROP TABLE {old_name}'))
+    logger.warning(f"已将旧版弹幕缓存迁移到新表结构: {result.rowcount} 条记录")
+
+def _add_missing_columns(sync_conn):
+    """为已存在的表补充模型中新增的列（create_all 不会修改已有的表）"""
+    inspector = inspect(sync_conn)
+    for table in DanmakuBase.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            column_type = column.type.compile(dialect=sync_conn.dialect)
+            sync_conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+
+def _relax_not_null_columns(sync_conn):
+    """
+    模型中改为可空的列在旧数据库中仍带有 NOT NULL 约束，SQLite 不支持修改列约束，
+    因此按新结构重建表并复制原有数据
+    """
+    inspector = inspect(sync_conn)
+    for table in DanmakuBase.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column['name']: column for column in inspector.get_columns(table.name)}
+        needs_rebuild = any(
+            column.nullable and column.name in existing and not existing[column.name]['nullable']
+            for column in table.columns
+        )
+        if not needs_rebuild:
+            continue
+
+        old_name = f'{table.name}_old'
+        # 索引名称在整个数据库中唯一，先删除旧表的索引再重建
+        for index in inspector.get_indexes(table.name):
+            sync_conn.execute(text(f'DROP INDEX IF EXISTS {index["name"]}'))
+        sync_conn.execute(text(f'ALTER TABLE {table.name} RENAME TO {old_name}'))
+        table.create(sync_conn)
+        columns = ', '.join(column.name for column in table.columns if column.name in existing)
+        sync_conn.execute(text(f'INSERT INTO {table.name} ({columns}) SELECT {columns} FROM {old_name}'))
+        sync_conn.execute(text(f'DROP TABLE {old_name}'))
+        logger.info(f"已重建数据表以更新列约束: {table.name}")
+
+def _create_catalog_index(sync_conn):
+    """
+    为作品目录的规范化标题创建 FTS5 全文索引，并用触发器与目录表保持同步
+
+    优先使用 trigram 分词器以支持中日文的任意子串搜索，SQLite 版本过低不支持时退回 unicode61。
+    索引新建时从目录表重建。
+    """
+    inspector = inspect(sync_conn)
+    if inspector.has_table('catalog_anime_fts'):
+        return
+    for tokenizer in ('trigram', 'unicode61'):
+        try:
+            sync_conn.execute(text(
+                "CREATE VIRTUAL TABLE catalog_anime_fts USING fts5("
+                "search_title, content='catalog_anime', content_rowid='id', "
+                f"tokenize='{tokenizer}')"
+            ))
+            break
+        except Exception as e:
+            logger.warning(f"创建作品目录全文索引失败: tokenize={tokenizer}, {e}")
+    else:
+        return
+    sync_conn.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS catalog_anime_ai AFTER INSERT ON catalog_anime BEGIN "
+        "INSERT INTO catalog_anime_fts(rowid, search_title) VALUES (new.id, new.search_title); END"
+    ))
+    sync_conn.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS catalog_anime_ad AFTER DELETE ON catalog_anime BEGIN "
+        "INSERT INTO catalog_anime_fts(catalog_anime_fts, rowid, search_title) "
+        "VALUES ('delete', old.id, old.search_title); END"
+    ))
+    sync_conn.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS catalog_anime_au AFTER UPDATE OF search_title ON catalog_anime BEGIN "
+        "INSERT INTO catalog_anime_fts(catalog_anime_fts, rowid, search_title) "
+        "VALUES ('delete', old.id, old.search_title); "
+        "INSERT INTO catalog_anime_fts(rowid, search_title) VALUES (new.id, new.search_title); END"
+    ))
+    sync_conn.execute(text("INSERT INTO catalog_anime_fts(catalog_anime_fts) VALUES ('rebuild')"))
+    logger.info("已创建作品目录全文索引")
+
 async def init_db():
-    """初始化数据库"""
-    async with engine.begin() as conn:
+    """初始化数据库，多个工作进程同时启动时由写锁依次执行"""
+    async with write_engine.begin() as conn:
+        await conn.run_sync(_migrate_legacy_danmaku_cache)
         # 创建所有表
         await conn.run_sync(DanmakuBase.metadata.create_all)
         await conn.run_sync(FileMatchBase.metadata.create_all)
+        # 升级旧数据库的表结构
+        await conn.run_sync(_add_missing_columns)
+        await conn.run_sync(_relax_not_null_columns)
+        await conn.run_sync(_create_catalog_index)
+
+async def close_db():
+    """关闭读写连接池"""
+    await engine.dispose()
+    if write_engine is not engine:
+        await write_engine.dispose()
 
 async def get_db():
     """获取数据库会话"""
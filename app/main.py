@@ -1,19 +1,45 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from .api.v1 import danmaku, stats
-from .database import init_db
+from .database import init_db, close_db
 from app.utils.logger import setup_logger
 import logging
 from app.middleware.api_stats import ApiStatsMiddleware
+from app.services.http_client import init_http_client, close_http_client
+from app.services import background
+from app.services.stats_writer import stats_writer
+from app.services.cache_warmer import cache_warmer
 
 # 初始化日志配置
 setup_logger()
 logger = logging.getLogger(__name__)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用生命周期：启动时初始化数据库和共享HTTP客户端，关闭时释放连接"""
+    await init_db()
+    await init_http_client()
+    # 在清理过期的原始记录之前补充预聚合数据
+    await stats_writer.backfill(app.routes)
+    await stats_writer.start()
+    await cache_warmer.start()
+    logger.info("应用程序启动")
+    try:
+        yield
+    finally:
+        await cache_warmer.stop()
+        await background.shutdown()
+        await stats_writer.stop()
+        await close_http_client()
+        await close_db()
+        logger.info("应用程序关闭")
+
 app = FastAPI(
     title="Dandan Server",
     description="A proxy server for Dandanplay API",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # 配置CORS
@@ -30,13 +56,3 @@ app.add_middleware(ApiStatsMiddleware)
 # 注册路由
 app.include_router(stats.router, prefix="/api/v1", tags=["stats"])
 app.include_router(danmaku.router, prefix="/api/v1", tags=["danmaku"])
-
-@app.on_event("startup")
-async def startup_event():
-    """应用启动时初始化数据库"""
-    await init_db()
-    logger.info("应用程序启动")
-
-@app.on_event("shutdown")
-async def shutdown_event():
-    logger.info("应用程序关闭") 
\ No newline at end of file
@@ -1,61 +1,83 @@
-from fastapi import Request
-from starlette.middleware.base import BaseHTTPMiddleware
-from sqlalchemy.ext.asyncio import AsyncSession
-from app.database import AsyncSessionLocal
-from app.models.api_stats import ApiStats
-import time
 import json
+import time
+import random
 from datetime import datetime, UTC
+from starlette.datastructures import QueryParams
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from app.config import settings
+from app.services.stats_writer import stats_writer
+
+# 记录请求体参数时最多保留的字节数
+MAX_BODY_BYTES = 64 * 1024
+
+class ApiStatsMiddleware:
+    """
+    记录API调用统计的ASGI中间件
+    
+    统计记录放入内存队列后由后台写入器批量写入数据库，不在请求路径上访问数据库。
+    请求参数按 API_STATS_PARAMS_SAMPLE_RATE 采样记录。
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start_time = time.perf_counter()
+        method = scope["method"]
+        status_code = 500
+        error = None
+        capture_params = random.random() < settings.API_STATS_PARAMS_SAMPLE_RATE
+        body = bytearray() if capture_params and method in ("POST", "PUT") else None
+
+        async def receive_wrapper() -> Message:
+            message = await receive()
+            # 边读取边保存请求体，不影响下游读取
+            if body is not None and message["type"] == "http.request" and len(body) < MAX_BODY_BYTES:
+                body.extend(message.get("body", b""))
+            return message
+
+        async def send_wrapper(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
 
-class ApiStatsMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        start_time = time.time()
-        
         try:
-            response = await call_next(request)
-            
+            await self.app(scope, receive_wrapper, send_wrapper)
+        except Exception as e:
+            # 记录错误信息
+            status_code = 500
+            error = str(e)[:500]
+            raise
+        finally:
             # 计算响应时间
-            response_time = int((time.time() - start_time) * 1000)
+            response_time = int((time.perf_counter() - start_time) * 1000)
             
             # 获取请求参数
             params = None
-            if request.method in ["POST", "PUT"]:
-                try:
-                    body = await request.body()
-                    if body:
-                        params = json.loads(body)
-                except:
-                    pass
-            else:
-                params = dict(request.query_params)
+            if capture_params:
+                if body is not None:
+                    try:
+                        if body:
+                            params = json.loads(bytes(body))
+                    except ValueError:
+                        pass
+                else:
+                    params = dict(QueryParams(scope.get("query_string", b"")))
             
-            # 记录API调用
-            async with AsyncSessionLocal() as session:
-                stats = ApiStats(
-                    endpoint=request.url.path,
-                    method=request.method,
-                    status_code=response.status_code,
-                    response_time=response_time,
-                    params=params,
-                    timestamp=datetime.now(UTC)
-                )
-                session.add(stats)
-                await session.commit()
-            
-            return response
-            
-        except Exception as e:
-            # 记录错误信息
-            async with AsyncSessionLocal() as session:
-                stats = ApiStats(
-                    endpoint=request.url.path,
-                    method=request.method,
-                    status_code=500,
-                    response_time=int((time.time() - start_time) * 1000),
-                    params=dict(request.query_params),
-                    error=str(e),
-                    timestamp=datetime.now(UTC)
-                )
-                session.add(stats)
-                await session.commit()
-            raise 
\ No newline at end of file
+            # 记录API调用，路由模板由FastAPI在路由匹配时写入scope，用于预聚合
+            route = scope.get("route")
+            stats_writer.record({
+                "route": getattr(route, "path", None),
+                "endpoint": scope["path"],
+                "method": method,
+                "status_code": status_code,
+                "response_time": response_time,
+                "params": params,
+                "error": error,
+                "timestamp": datetime.now(UTC)
+            })
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, JSON
+from sqlalchemy import Column, Integer, String, DateTime, JSON, UniqueConstraint
 from datetime import datetime, UTC
 from .base import Base
 
@@ -13,4 +13,50 @@ class ApiStats(Base):
     response_time = Column(Integer)  # 响应时间（毫秒）
     timestamp = Column(DateTime, default=datetime.now(UTC))  # 调用时间
     params = Column(JSON, nullable=True)  # 请求参数
-    error = Column(String(500), nullable=True)  # 错误信息（如果有） 
\ No newline at end of file
+    error = Column(String(500), nullable=True)  # 错误信息（如果有）
+
+class ApiStatsRollup(Base):
+    """按分钟或小时预聚合的API调用统计"""
+    __tablename__ = "api_stats_rollup"
+
+    id = Column(Integer, primary_key=True, index=True)
+    resolution = Column(String(10), nullable=False)  # 聚合粒度：minute 或 hour
+    bucket = Column(DateTime, nullable=False, index=True)  # 时间段起点（UTC）
+    endpoint = Column(String(100), nullable=False)  # 路由模板，例如 /api/v1/{episode_id}
+    status_code = Column(Integer, nullable=False)  # 响应状态码
+    count = Column(Integer, nullable=False, default=0)  # 调用次数
+    error_count = Column(Integer, nullable=False, default=0)  # 错误次数
+    total_time = Column(Integer, nullable=False, default=0)  # 响应时间总和（毫秒）
+    max_time = Column(Integer, nullable=False, default=0)  # 最大响应时间（毫秒）
+
+    __table_args__ = (
+        UniqueConstraint('resolution', 'bucket', 'endpoint', 'status_code', name='uix_rollup_key'),
+    )
+
+class ApiLatencyHistogram(Base):
+    """按分钟或小时预聚合的响应时间直方图，可按区间累加合并"""
+    __tablename__ = "api_latency_histogram"
+
+    id = Column(Integer, primary_key=True, index=True)
+    resolution = Column(String(10), nullable=False)  # 聚合粒度：minute 或 hour
+    bucket = Column(DateTime, nullable=False, index=True)  # 时间段起点（UTC）
+    endpoint = Column(String(100), nullable=False)  # 路由模板
+    bin = Column(Integer, nullable=False)  # 响应时间区间编号，见 app.utils.histogram
+    count = Column(Integer, nullable=False, default=0)  # 落在该区间的调用次数
+
+    __table_args__ = (
+        UniqueConstraint('resolution', 'bucket', 'endpoint', 'bin', name='uix_histogram_key'),
+    )
+
+class ApiEpisodeRollup(Base):
+    """按小时预聚合的各节目弹幕请求次数，用于按热度排序节目"""
+    __tablename__ = "api_episode_rollup"
+
+    id = Column(Integer, primary_key=True, index=True)
+    bucket = Column(DateTime, nullable=False, index=True)  # 时间段起点（UTC）
+    episode_id = Column(Integer, nullable=False)  # 节目编号
+    count = Column(Integer, nullable=False, default=0)  # 请求次数
+
+    __table_args__ = (
+        UniqueConstraint('bucket', 'episode_id', name='uix_episode_rollup_key'),
+    )
@@ -0,0 +1,32 @@
+from sqlalchemy import Column, Integer, String, Float, DateTime
+from sqlalchemy.sql import func
+from .base import Base
+
+class CatalogAnime(Base):
+    """本地作品目录，由代理过的搜索和匹配结果累积而成"""
+    __tablename__ = "catalog_anime"
+
+    id = Column(Integer, primary_key=True)
+    anime_id = Column(Integer, unique=True, nullable=False)
+    title = Column(String(255), nullable=False)
+    search_title = Column(String(255), nullable=False)  # 规范化后的标题，用于全文索引
+    type = Column(String(20), nullable=True)
+    type_description = Column(String(50), nullable=True)
+    episode_count = Column(Integer, nullable=True)  # 只有搜索结果包含集数
+    image_url = Column(String(500), nullable=True)
+    bangumi_id = Column(String(50), nullable=True)
+    rating = Column(Float, nullable=True)
+    start_date = Column(String(50), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class CatalogEpisode(Base):
+    """本地剧集目录"""
+    __tablename__ = "catalog_episode"
+
+    id = Column(Integer, primary_key=True)
+    episode_id = Column(Integer, unique=True, nullable=False)
+    anime_id = Column(Integer, index=True, nullable=False)
+    title = Column(String(255), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, JSON, DateTime, UniqueConstraint
+from sqlalchemy import Column, Integer, String, JSON, DateTime, Boolean, LargeBinary, UniqueConstraint
 from sqlalchemy.sql import func
 from datetime import datetime, UTC
 from pydantic import BaseModel
@@ -20,12 +20,21 @@ class DanmakuCache(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     episode_id = Column(Integer, index=True, nullable=False)
-    data = Column(JSON, nullable=False)
+    with_related = Column(Boolean, nullable=False, default=False)  # 是否包含关联的第三方弹幕
+    ch_convert = Column(Integer, nullable=False, default=0)  # 中文简繁转换方式
+    data = Column(JSON(none_as_null=True), nullable=True)  # JSON格式存储的数据，使用压缩存储时为空
+    payload = Column(LargeBinary, nullable=True)  # 压缩后的序列化数据
+    encoding = Column(String(10), nullable=True)  # 存储格式：json、gzip 或 zstd
+    payload_size = Column(Integer, nullable=True)  # 序列化后未压缩的字节数
+    checksum = Column(String(64), nullable=True)  # 序列化数据的SHA-256校验和
+    max_cid = Column(Integer, nullable=True)  # 缓存中最大的弹幕编号，用于增量刷新
+    full_refreshed_at = Column(DateTime(timezone=True), nullable=True)  # 最近一次全量刷新时间
+    density = Column(JSON(none_as_null=True), nullable=True)  # 弹幕密度统计结果，数据刷新时清空
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
     __table_args__ = (
-        UniqueConstraint('episode_id', name='uix_episode_id'),
+        UniqueConstraint('episode_id', 'with_related', 'ch_convert', name='uix_episode_source'),
     )
 
 class MatchItem(BaseModel):
@@ -44,6 +53,13 @@ class MatchResponse(BaseModel):
     isMatched: bool = False
     matches: List[Dict[str, Any]] = []
 
+class BatchMatchResult(MatchResponse):
+    """批量匹配中单个文件的匹配结果"""
+    fileHash: str
+
+class BatchMatchResponse(BaseModel):
+    results: List[BatchMatchResult] = []
+
 class TmdbCache(Base):
     """TMDB搜索结果缓存模型"""
     __tablename__ = "tmdb_cache"
@@ -51,10 +67,49 @@ class TmdbCache(Base):
     id = Column(Integer, primary_key=True, index=True)
     tmdb_id = Column(Integer, index=True, nullable=False)
     episode = Column(Integer, nullable=False)
-    data = Column(JSON, nullable=False)
+    data = Column(JSON(none_as_null=True), nullable=True)  # JSON格式存储的数据，使用压缩存储时为空
+    payload = Column(LargeBinary, nullable=True)  # 压缩后的序列化数据
+    encoding = Column(String(10), nullable=True)  # 存储格式：json、gzip 或 zstd
+    payload_size = Column(Integer, nullable=True)  # 序列化后未压缩的字节数
+    checksum = Column(String(64), nullable=True)  # 序列化数据的SHA-256校验和
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
     __table_args__ = (
         UniqueConstraint('tmdb_id', 'episode', name='uix_tmdb_episode'),
     )
+
+class AnimeSearchCache(Base):
+    """关键词搜索作品结果缓存模型"""
+    __tablename__ = "anime_search_cache"
+
+    id = Column(Integer, primary_key=True, index=True)
+    keyword = Column(String(200), nullable=False)  # 规范化后的搜索关键词
+    anime_type = Column(String(20), nullable=False, default='')  # 限定的作品类型，不限定时为空字符串
+    data = Column(JSON(none_as_null=True), nullable=True)  # JSON格式存储的数据，使用压缩存储时为空
+    payload = Column(LargeBinary, nullable=True)  # 压缩后的序列化数据
+    encoding = Column(String(10), nullable=True)  # 存储格式：json、gzip 或 zstd
+    payload_size = Column(Integer, nullable=True)  # 序列化后未压缩的字节数
+    checksum = Column(String(64), nullable=True)  # 序列化数据的SHA-256校验和
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+
+    __table_args__ = (
+        UniqueConstraint('keyword', 'anime_type', name='uix_search_keyword_type'),
+    )
+
+class NegativeCacheEntry(Base):
+    """上游没有结果的查询，在较短的时间内不再请求上游"""
+    __tablename__ = "negative_cache"
+
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String(20), nullable=False)  # 查询类型：match、danmaku 或 search
+    key = Column(String(255), nullable=False)  # 文件哈希、节目编号或搜索缓存键
+    status_code = Column(Integer, nullable=True)  # 上游返回的错误状态码，没有错误时为空
+    data = Column(JSON(none_as_null=True), nullable=True)  # 需要原样返回的上游响应，例如未能精确匹配时的候选结果
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+
+    __table_args__ = (
+        UniqueConstraint('kind', 'key', name='uix_negative_kind_key'),
+    )
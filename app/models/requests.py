@@ -1,5 +1,5 @@
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, Field
+from typing import List, Optional
 
 class FileMatchRequest(BaseModel):
     file_name: str
@@ -26,6 +26,42 @@ class FileMatchRequest(BaseModel):
         d['video_duration'] = int(d['video_duration'])
         return d
 
+class BatchFileMatchRequest(BaseModel):
+    """批量文件匹配请求模型"""
+    files: List[FileMatchRequest] = Field(..., min_length=1, max_length=1000)
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "files": [
+                    {
+                        "file_name": "葬送的芙莉莲 - S01E01.mkv",
+                        "file_hash": "0a27428e49e9d6fddee74fcafb888027",
+                        "file_size": 0,
+                        "video_duration": 0,
+                        "match_mode": "hashAndFileName"
+                    }
+                ]
+            }
+        }
+
+class BatchDanmakuRequest(BaseModel):
+    """批量获取弹幕请求模型"""
+    episode_ids: List[int] = Field(..., min_length=1, max_length=200)
+    with_related: bool = False
+    ch_convert: int = 0
+    stream: bool = False  # 是否以NDJSON流式返回，每获取完一个节目返回一行
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "episode_ids": [177300001, 177300002],
+                "with_related": False,
+                "ch_convert": 0,
+                "stream": False
+            }
+        }
+
 class DanmakuWithDetailRequest(FileMatchRequest):
     """包含弹幕获取参数的请求模型"""
     from_id: Optional[int] = 0
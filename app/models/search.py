@@ -37,3 +37,18 @@ class AnimeSearchResponse(BaseModel):
     errorCode: int = 0
     errorMessage: Optional[str] = None
     animes: Optional[List[AnimeSearchItem]] = None
+
+
+class AnimeSuggestItem(BaseModel):
+    animeId: int
+    animeTitle: str
+    type: Optional[str] = None
+    typeDescription: Optional[str] = None
+    episodeCount: Optional[int] = None
+    imageUrl: Optional[str] = None
+
+
+class AnimeSuggestResponse(BaseModel):
+    success: bool = True
+    errorCode: int = 0
+    animes: List[AnimeSuggestItem] = []
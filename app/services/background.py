@@ -0,0 +1,53 @@
+import asyncio
+import logging
+from typing import Awaitable, Set
+
+# 配置日志记录器
+logger = logging.getLogger(__name__)
+
+# 正在运行的后台任务，保留引用避免任务被垃圾回收
+_tasks: Set[asyncio.Task] = set()
+
+def spawn(coro: Awaitable, name: str = "background") -> asyncio.Task:
+    """
+    启动一个后台任务，任务异常只记录日志，不会影响请求
+    
+    Args:
+        coro: 需要在后台执行的协程
+        name: 任务名称，用于日志
+        
+    Returns:
+        asyncio.Task: 创建的后台任务
+    """
+    async def runner():
+        try:
+            await coro
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"后台任务执行出错: {name}: {e}")
+
+    task = asyncio.create_task(runner(), name=name)
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return task
+
+def pending_count() -> int:
+    """获取正在运行的后台任务数量"""
+    return len(_tasks)
+
+async def shutdown(timeout: float = 10.0):
+    """
+    应用关闭时等待后台任务完成，超时后取消剩余任务
+    
+    Args:
+        timeout: 最长等待时间（秒）
+    """
+    if not _tasks:
+        return
+    done, pending = await asyncio.wait(set(_tasks), timeout=timeout)
+    for task in pending:
+        task.cancel()
+    if pending:
+        await asyncio.gather(*pending, return_exceptions=True)
+        logger.warning(f"关闭时取消了 {len(pending)} 个未完成的后台任务")
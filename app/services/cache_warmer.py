@@ -0,0 +1,168 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+from sqlalchemy import select, func, or_, and_
+from ..config import settings
+from app.database import AsyncSessionLocal
+from app.models.api_stats import ApiEpisodeRollup
+from app.models.danmaku import DanmakuCache
+from .demand import danmaku_demand
+from .proxy import DanmakuProxy
+from .singleflight import danmaku_flight
+from .stats_rollup import truncate, utcnow
+
+# 配置日志记录器
+logger = logging.getLogger(__name__)
+
+async def rank_from_api_stats(session, hours: int, limit: int) -> List[Tuple[int, int]]:
+    """
+    根据按小时预聚合的各节目请求次数排序节目，用于没有进程内访问计数时（例如命令行预热）
+
+    预聚合数据不依赖 API_STATS_KEEP_RAW，统计的时间段按整小时计算。
+
+    Args:
+        session: 数据库会话
+        hours: 统计最近多少小时
+        limit: 返回的节目数
+
+    Returns:
+        List[Tuple[int, int]]: (节目编号, 请求次数)，按请求次数从高到低排序
+    """
+    start = truncate(utcnow(), 'hour') - timedelta(hours=hours - 1)
+    total = func.sum(ApiEpisodeRollup.count)
+    stmt = (
+        select(ApiEpisodeRollup.episode_id, total)
+        .where(ApiEpisodeRollup.bucket >= start)
+        .group_by(ApiEpisodeRollup.episode_id)
+        .order_by(total.desc())
+        .limit(limit)
+    )
+    return [(episode_id, count) for episode_id, count in (await session.execute(stmt)).all()]
+
+class CacheWarmer:
+    """
+    按热度在缓存过期前主动刷新弹幕缓存
+
+    每轮取热度最高的 CACHE_WARM_TOP_N 个条目，刷新其中将在 CACHE_WARM_LEAD_MINUTES 内过期
+    （或已经过期）的缓存。每个工作进程按各自的访问计数预热，CACHE_WARM_BUDGET 是整个服务每轮请求上游的上限，
+    按进程数平分。
+    """
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+        self.runs = 0
+        self.refreshed = 0
+        self.failed = 0
+        self.last_run: Optional[datetime] = None
+
+    async def start(self):
+        """启动定期预热任务"""
+        if self._task is not None or not settings.CACHE_WARM_ENABLED:
+            return
+        self._task = asyncio.create_task(self._loop(), name="cache-warmer")
+        logger.info("缓存预热任务已启动")
+
+    async def stop(self):
+        """停止定期预热任务"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        logger.info("缓存预热任务已停止")
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(settings.CACHE_WARM_INTERVAL_MINUTES * 60)
+            try:
+                keys = [key for key, _ in danmaku_demand.top(settings.CACHE_WARM_TOP_N)]
+                await self.warm(keys, self._budget())
+            except Exception as e:
+                logger.error(f"预热缓存时出错: {e}")
+
+    def _budget(self) -> int:
+        """本进程每轮请求上游的次数：配置的预算是整个服务的上限，多个工作进程时按进程数平分"""
+        workers = max(settings.WEB_CONCURRENCY, 1)
+        return max(settings.CACHE_WARM_BUDGET // workers, 1) if settings.CACHE_WARM_BUDGET > 0 else 0
+
+    async def warm(self, keys: List[Tuple[int, bool, int]], budget: int) -> Dict[str, int]:
+        """
+        刷新指定条目中即将过期的缓存
+
+        Args:
+            keys: 按热度从高到低排序的缓存键，with_related 或 ch_convert 为 None 时匹配该节目所有已缓存的版本
+            budget: 最多请求上游的次数
+
+        Returns:
+            Dict[str, int]: 候选数、刷新数和失败数
+        """
+        self.runs += 1
+        self.last_run = datetime.now()
+        if not keys or budget <= 0:
+            return {'candidates': 0, 'refreshed': 0, 'failed': 0}
+
+        due = datetime.now() - timedelta(
+            minutes=max(settings.CACHE_EXPIRE_MINUTES - settings.CACHE_WARM_LEAD_MINUTES, 0)
+        )
+        conditions = []
+        for episode_id, with_related, ch_convert in keys:
+            condition = [DanmakuCache.episode_id == episode_id]
+            if with_related is not None:
+                condition.append(DanmakuCache.with_related == with_related)
+            if ch_convert is not None:
+                condition.append(DanmakuCache.ch_convert == ch_convert)
+            conditions.append(and_(*condition))
+
+        async with AsyncSessionLocal() as session:
+            stmt = select(
+                DanmakuCache.episode_id, DanmakuCache.with_related, DanmakuCache.ch_convert
+            ).where(or_(*conditions), DanmakuCache.updated_at < due)
+            rows = (await session.execute(stmt)).all()
+
+        # 按传入的热度顺序刷新
+        rank = {key: i for i, key in enumerate(keys)}
+        candidates = sorted(
+            (tuple(row) for row in rows),
+            key=lambda key: rank.get(key, rank.get((key[0], None, None), len(rank)))
+        )
+        selected = candidates[:budget]
+
+        semaphore = asyncio.Semaphore(settings.CACHE_WARM_CONCURRENCY)
+        refreshed, failed = 0, 0
+
+        async def refresh(key: Tuple[int, bool, int]):
+            nonlocal refreshed, failed
+            async with semaphore:
+                try:
+                    async with AsyncSessionLocal() as session:
+                        proxy = DanmakuProxy(session)
+                        await danmaku_flight.do(key, lambda: proxy._fetch_danmaku(*key))
+                    refreshed += 1
+                except Exception as e:
+                    failed += 1
+                    logger.warning(f"预热弹幕缓存失败: key={key}, {e}")
+
+        await asyncio.gather(*(refresh(key) for key in selected))
+        self.refreshed += refreshed
+        self.failed += failed
+        if selected:
+            logger.info(f"预热弹幕缓存: 候选={len(candidates)}, 刷新={refreshed}, 失败={failed}")
+        return {'candidates': len(candidates), 'refreshed': refreshed, 'failed': failed}
+
+    def stats(self) -> Dict[str, Any]:
+        """获取预热统计信息"""
+        return {
+            'enabled': settings.CACHE_WARM_ENABLED,
+            'tracked': len(danmaku_demand),
+            'runs': self.runs,
+            'refreshed': self.refreshed,
+            'failed': self.failed,
+            'last_run': self.last_run.isoformat() if self.last_run else None
+        }
+
+# 全局缓存预热器
+cache_warmer = CacheWarmer()
@@ -0,0 +1,199 @@
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+from sqlalchemy import select, text, func
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from ..config import settings
+from app.database import AsyncSessionLocal
+from app.models.catalog import CatalogAnime, CatalogEpisode
+from app.models.danmaku import AnimeSearchCache
+from .search_cache import normalize_keyword
+from .storage import load_payload
+
+# 配置日志记录器
+logger = logging.getLogger(__name__)
+
+# 上游字段到目录表列的映射
+_ANIME_FIELDS = {
+    'animeTitle': 'title',
+    'type': 'type',
+    'typeDescription': 'type_description',
+    'episodeCount': 'episode_count',
+    'imageUrl': 'image_url',
+    'bangumiId': 'bangumi_id',
+    'rating': 'rating',
+    'startDate': 'start_date'
+}
+
+# trigram 分词器只能匹配至少三个字符的子串
+_MIN_FTS_LENGTH = 3
+
+def extract_catalog(data: Dict[str, Any]) -> Tuple[Dict[int, Dict[str, Any]], Dict[int, Dict[str, Any]]]:
+    """
+    从搜索、TMDB搜索和匹配结果中提取作品和剧集信息
+
+    Args:
+        data: 上游返回的数据，作品在 animes 中，匹配结果在 matches 中
+
+    Returns:
+        Tuple[Dict[int, Dict[str, Any]], Dict[int, Dict[str, Any]]]: 以编号为键的作品和剧集列值
+    """
+    animes: Dict[int, Dict[str, Any]] = {}
+    episodes: Dict[int, Dict[str, Any]] = {}
+    for item in (data.get('animes') or []) + (data.get('matches') or []):
+        anime_id = item.get('animeId')
+        if not anime_id or not item.get('animeTitle'):
+            continue
+        values = animes.setdefault(anime_id, {'anime_id': anime_id})
+        for field, column in _ANIME_FIELDS.items():
+            if item.get(field) is not None:
+                values[column] = item[field]
+        values['search_title'] = normalize_keyword(values['title'])
+        # 匹配结果本身就是剧集，TMDB搜索结果的剧集在 episodes 中
+        for episode in [item] if item.get('episodeId') else item.get('episodes') or []:
+            if episode.get('episodeId'):
+                episodes[episode['episodeId']] = {
+                    'episode_id': episode['episodeId'],
+                    'anime_id': anime_id,
+                    'title': episode.get('episodeTitle')
+                }
+    return animes, episodes
+
+async def record_catalog(data: Dict[str, Any]):
+    """将上游返回的作品和剧集写入本地目录，已有的记录只更新本次提供的字段"""
+    animes, episodes = extract_catalog(data)
+    if not animes:
+        return
+    async with AsyncSessionLocal() as session:
+        try:
+            for values in animes.values():
+                stmt = sqlite_insert(CatalogAnime).values(**values)
+                update_values = {key: stmt.excluded[key] for key in values if key != 'anime_id'}
+                update_values['updated_at'] = func.now()
+                await session.execute(
+                    stmt.on_conflict_do_update(index_elements=['anime_id'], set_=update_values)
+                )
+            for values in episodes.values():
+                stmt = sqlite_insert(CatalogEpisode).values(**values)
+                await session.execute(stmt.on_conflict_do_update(
+                    index_elements=['episode_id'],
+                    set_={
+                        'anime_id': stmt.excluded.anime_id,
+                        'title': func.coalesce(stmt.excluded.title, CatalogEpisode.title),
+                        'updated_at': func.now()
+                    }
+                ))
+            await session.commit()
+            logger.debug(f"更新作品目录: 作品={len(animes)}, 剧集={len(episodes)}")
+        except Exception as e:
+            logger.error(f"更新作品目录时出错: {e}")
+            await session.rollback()
+
+def _fts_phrase(query: str) -> str:
+    """将规范化的关键词转为 FTS5 短语查询"""
+    return '"' + query.replace('"', '""') + '"'
+
+def _like_pattern(query: str) -> str:
+    """转义 LIKE 通配符"""
+    return query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+async def find_animes(
+    session: AsyncSession,
+    keyword: str,
+    limit: int,
+    anime_type: Optional[str] = None
+) -> List[CatalogAnime]:
+    """
+    按标题查找目录中的作品，标题以关键词开头的排在前面，其次按标题长度
+
+    关键词至少三个字符时使用全文索引查找任意位置的子串，更短的关键词（常见于中日文）扫描目录表。
+
+    Args:
+        session: 数据库会话
+        keyword: 关键词
+        limit: 最多返回的作品数
+        anime_type: 限定的作品类型
+
+    Returns:
+        List[CatalogAnime]: 匹配的作品
+    """
+    query = normalize_keyword(keyword)
+    if not query or limit <= 0:
+        return []
+    stmt = select(CatalogAnime)
+    if anime_type:
+        stmt = stmt.where(CatalogAnime.type == anime_type)
+
+    prefix = _like_pattern(query) + '%'
+    if len(query) >= _MIN_FTS_LENGTH:
+        ids = text("SELECT rowid FROM catalog_anime_fts WHERE catalog_anime_fts MATCH :query")
+        try:
+            matched = (await session.execute(ids, {'query': _fts_phrase(query)})).scalars().all()
+        except Exception as e:
+            # 全文索引不可用时退回子串扫描
+            logger.warning(f"作品目录全文索引查询失败: {e}")
+            stmt = stmt.where(CatalogAnime.search_title.like('%' + prefix, escape='\\'))
+        else:
+            if not matched:
+                return []
+            stmt = stmt.where(CatalogAnime.id.in_(matched))
+    else:
+        stmt = stmt.where(CatalogAnime.search_title.like('%' + prefix, escape='\\'))
+
+    stmt = stmt.order_by(
+        CatalogAnime.search_title.like(prefix, escape='\\').desc(),
+        func.length(CatalogAnime.title),
+        CatalogAnime.anime_id
+    ).limit(limit)
+    return list((await session.execute(stmt)).scalars().all())
+
+async def search_local(
+    session: AsyncSession,
+    keyword: str,
+    anime_type: Optional[str] = None
+) -> Optional[Dict[str, Any]]:
+    """
+    在近期的上游搜索结果能够代替上游回答时返回搜索结果，否则返回 None
+
+    近期向上游搜索过的关键词是本次关键词的子串时（例如输入过程中逐字增加的关键词），
+    上游对本次关键词的结果包含在那次搜索的结果中，从那次缓存的结果中筛选标题包含本次关键词的作品。
+    上游还按别名匹配作品，因此只有那次搜索的结果全部按标题匹配时才可以筛选，
+    筛选结果为空时也可能是别名匹配的作品未被识别，仍需请求上游。
+
+    Args:
+        session: 数据库会话
+        keyword: 搜索关键词
+        anime_type: 限定的作品类型
+
+    Returns:
+        Optional[Dict[str, Any]]: 与上游格式相同的搜索结果
+    """
+    query = normalize_keyword(keyword)
+    fresh = datetime.now() - timedelta(minutes=settings.SEARCH_CACHE_EXPIRE_MINUTES)
+    covering = select(AnimeSearchCache).where(
+        AnimeSearchCache.updated_at >= fresh,
+        AnimeSearchCache.anime_type.in_(['', anime_type or '']),
+        AnimeSearchCache.keyword != query,
+        func.instr(query, AnimeSearchCache.keyword) > 0
+    ).order_by(func.length(AnimeSearchCache.keyword).desc()).limit(5)
+
+    for row in (await session.execute(covering)).scalars():
+        animes = (load_payload(row) or {}).get('animes') or []
+        titles = [normalize_keyword(anime.get('animeTitle') or '') for anime in animes]
+        # 有按别名匹配的作品时无法判断这些作品是否也匹配本次关键词
+        if any(row.keyword not in title for title in titles):
+            continue
+        results = [
+            anime for anime, title in zip(animes, titles)
+            if query in title and (not anime_type or anime.get('type') == anime_type)
+        ]
+        if not results:
+            return None
+        return {
+            'success': True,
+            'errorCode': 0,
+            'errorMessage': None,
+            'animes': results[:settings.SEARCH_LOCAL_MAX_RESULTS]
+        }
+    return None
@@ -0,0 +1,159 @@
+import re
+from typing import Any, Dict, List
+
+# 序列化数据中的弹幕编号字段。合法JSON的字符串内容中引号必须转义，因此只会匹配到对象的键
+_CID_PATTERN = re.compile(rb'"cid"\s*:\s*(\d+)')
+# 完整的JSON字符串
+_STRING_PATTERN = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"')
+# 字符串以外的括号
+_BRACKET_PATTERN = re.compile(rb'[\[\]{}]')
+# 内部没有括号的一对括号
+_PAIR_PATTERN = re.compile(rb'\{[^\[\]{}]*\}|\[[^\[\]{}]*\]')
+# 右括号对应的左括号
+_BRACKET_PAIRS = {ord('}'): ord('{'), ord(']'): ord('[')}
+
+def get_comments(data: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    获取弹幕数据中的弹幕列表
+    
+    Args:
+        data: 弹弹play返回的弹幕数据，格式为 {"count": int, "comments": [...]}
+        
+    Returns:
+        List[Dict[str, Any]]: 弹幕列表
+    """
+    if not isinstance(data, dict):
+        return []
+    return data.get('comments') or []
+
+def max_comment_id(data: Dict[str, Any]) -> int:
+    """
+    获取弹幕数据中最大的弹幕编号（cid）
+    
+    Args:
+        data: 弹幕数据
+        
+    Returns:
+        int: 最大的弹幕编号，没有弹幕时返回 0
+    """
+    return max((comment.get('cid', 0) for comment in get_comments(data)), default=0)
+
+def merge_comments(base: Dict[str, Any], delta: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    将增量获取的弹幕合并到已缓存的完整弹幕数据中，按弹幕编号去重
+    
+    Args:
+        base: 已缓存的完整弹幕数据
+        delta: 从上游增量获取的弹幕数据
+        
+    Returns:
+        Dict[str, Any]: 合并后的弹幕数据
+    """
+    comments = list(get_comments(base))
+    known = {comment.get('cid') for comment in comments}
+    for comment in get_comments(delta):
+        if comment.get('cid') not in known:
+            known.add(comment.get('cid'))
+            comments.append(comment)
+    return {**base, 'count': len(comments), 'comments': comments}
+
+def slice_comments(data: Dict[str, Any], from_id: int) -> Dict[str, Any]:
+    """
+    截取弹幕编号不小于 from_id 的弹幕，与上游 from 参数的语义一致
+    
+    Args:
+        data: 完整弹幕数据
+        from_id: 起始弹幕编号，忽略此编号以前的弹幕
+        
+    Returns:
+        Dict[str, Any]: 截取后的弹幕数据
+    """
+    comments = [comment for comment in get_comments(data) if comment.get('cid', 0) >= from_id]
+    return {**data, 'count': len(comments), 'comments': comments}
+
+
+class CommentIdScanner:
+    """
+    增量扫描分块到达的序列化弹幕数据，统计弹幕数量和最大弹幕编号，并检查数据结构是否完整
+
+    标准库没有增量JSON解析器，完整解码又需要在内存中保留全部数据，因此只用正则表达式匹配弹幕编号字段，
+    并在去除字符串后按括号检查嵌套结构：数据结束时顶层对象必须已经闭合，且没有未结束的字符串。
+    这样可以发现被截断的响应，但不检查数值和字面量是否合法。
+    """
+
+    # 保留上一块末尾的字节数，用于匹配跨越分块边界的字段
+    _TAIL_SIZE = 64
+
+    def __init__(self):
+        self.count = 0
+        self.max_cid = 0
+        self._tail = b''
+        # 尚未结束的字符串，留到下一块一起检查结构
+        self._pending = b''
+        self._stack: List[int] = []
+        self._started = False
+        self._closed = False
+        self._broken = False
+
+    def feed(self, chunk: bytes):
+        """扫描一块数据"""
+        buffer = self._tail + chunk
+        consumed = 0
+        for match in _CID_PATTERN.finditer(buffer):
+            if match.end() == len(buffer):
+                # 数字可能在下一块继续
+                break
+            self.count += 1
+            self.max_cid = max(self.max_cid, int(match.group(1)))
+            consumed = match.end()
+        self._tail = buffer[max(consumed, len(buffer) - self._TAIL_SIZE):]
+        if not self._broken:
+            self._check_structure(chunk)
+
+    def _check_structure(self, chunk: bytes):
+        """去除完整的字符串后按括号检查嵌套结构"""
+        stripped = _STRING_PATTERN.sub(b'', self._pending + chunk)
+        # 去除完整的字符串后剩下的引号是未结束的字符串的开头，其后的内容与原数据相同
+        start = stripped.find(b'"')
+        if start >= 0:
+            stripped, self._pending = stripped[:start], stripped[start:]
+        else:
+            self._pending = b''
+        if not self._started and stripped.strip():
+            self._started = True
+            if not stripped.lstrip().startswith(b'{'):
+                self._broken = True
+                return
+        if self._stack:
+            # 先把块内闭合的括号对替换为占位符，只逐个检查跨越分块的括号
+            replaced = 1
+            while replaced:
+                stripped, replaced = _PAIR_PATTERN.subn(b'0', stripped)
+        for match in _BRACKET_PATTERN.finditer(stripped):
+            if self._closed:
+                # 顶层对象闭合后又出现了其他数据
+                self._broken = True
+                return
+            bracket = match.group()[0]
+            if bracket in b'{[':
+                self._stack.append(bracket)
+            elif not self._stack or _BRACKET_PAIRS[bracket] != self._stack.pop():
+                self._broken = True
+                return
+            if not self._stack:
+                self._closed = True
+                if stripped[match.end():].strip():
+                    self._broken = True
+                return
+        if self._closed and stripped.strip():
+            self._broken = True
+
+    @property
+    def complete(self) -> bool:
+        """已扫描的数据是否为结构完整的JSON对象"""
+        return self._closed and not self._broken and not self._pending
+
+    def close(self):
+        """数据结束，处理最后一块中剩余的字段"""
+        self.feed(b' ')
+        self._tail = b''
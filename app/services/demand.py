@@ -0,0 +1,57 @@
+import time
+from collections import Counter
+from typing import Dict, Hashable, List, Tuple
+from ..config import settings
+
+class DemandTracker:
+    """
+    进程内的访问计数器，用于按近期热度排序缓存条目
+
+    计数按时间窗口轮换：当前窗口计数加上一窗口计数的一半作为热度，
+    不需要为每次访问保存时间戳，内存占用与条目数成正比。
+    """
+
+    def __init__(self, window_seconds: float, max_keys: int = 100000):
+        self.window_seconds = window_seconds
+        self.max_keys = max_keys
+        self._current: Counter = Counter()
+        self._previous: Counter = Counter()
+        self._window_started = time.monotonic()
+
+    def record(self, key: Hashable):
+        """记录一次访问"""
+        self._rotate()
+        if key not in self._current and len(self._current) >= self.max_keys:
+            return
+        self._current[key] += 1
+
+    def top(self, n: int) -> List[Tuple[Hashable, float]]:
+        """
+        获取热度最高的条目
+
+        Args:
+            n: 返回的条目数
+
+        Returns:
+            List[Tuple[Hashable, float]]: (键, 热度)，按热度从高到低排序
+        """
+        self._rotate()
+        scores: Dict[Hashable, float] = {key: count / 2 for key, count in self._previous.items()}
+        for key, count in self._current.items():
+            scores[key] = scores.get(key, 0) + count
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:n]
+
+    def _rotate(self):
+        """当前窗口结束后开始新窗口，超过两个窗口没有访问时清空"""
+        elapsed = time.monotonic() - self._window_started
+        if elapsed < self.window_seconds:
+            return
+        self._previous = self._current if elapsed < 2 * self.window_seconds else Counter()
+        self._current = Counter()
+        self._window_started = time.monotonic()
+
+    def __len__(self) -> int:
+        return len(set(self._current) | set(self._previous))
+
+# 弹幕请求热度，键与 DanmakuCache 一致：(episode_id, with_related, ch_convert)
+danmaku_demand = DemandTracker(settings.CACHE_WARM_DEMAND_WINDOW_MINUTES * 60)
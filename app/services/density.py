@@ -0,0 +1,69 @@
+import numpy as np
+from typing import Any, Dict, List
+from .comments import get_comments
+
+def parse_comment_fields(data: Dict[str, Any]):
+    """
+    解析全部弹幕的 p 字段，返回播放时间、模式和颜色数组
+
+    Args:
+        data: 完整弹幕数据，p 字段格式为 "时间,模式,颜色,用户"
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: 播放时间（秒）、模式、颜色
+    """
+    comments = get_comments(data)
+    times = np.zeros(len(comments), dtype=np.float64)
+    modes = np.ones(len(comments), dtype=np.int64)
+    colors = np.full(len(comments), 16777215, dtype=np.int64)
+    for i, comment in enumerate(comments):
+        fields = str(comment.get('p', '')).split(',')
+        try:
+            times[i] = float(fields[0])
+            if len(fields) > 1:
+                modes[i] = int(fields[1])
+            if len(fields) > 2:
+                colors[i] = int(fields[2])
+        except ValueError:
+            continue
+    return times, modes, colors
+
+def _split_counts(bins: np.ndarray, groups: np.ndarray, length: int) -> Dict[str, List[int]]:
+    """按分组统计每个区间的弹幕数，一次 bincount 完成所有分组"""
+    values, inverse = np.unique(groups, return_inverse=True)
+    counts = np.bincount(inverse * length + bins, minlength=len(values) * length)
+    counts = counts.reshape(len(values), length)
+    return {str(value): row.tolist() for value, row in zip(values.tolist(), counts)}
+
+def compute_density(
+    data: Dict[str, Any],
+    bucket: int,
+    by_mode: bool = False,
+    by_color: bool = False
+) -> Dict[str, Any]:
+    """
+    按播放时间区间统计弹幕数量
+
+    Args:
+        data: 完整弹幕数据
+        bucket: 区间长度（秒）
+        by_mode: 是否同时按弹幕模式分别统计
+        by_color: 是否同时按弹幕颜色分别统计
+
+    Returns:
+        Dict[str, Any]: 包含 bucket、count、counts，以及可选的 byMode、byColor
+    """
+    times, modes, colors = parse_comment_fields(data)
+    bins = np.floor_divide(np.clip(times, 0, None), bucket).astype(np.int64)
+    length = int(bins.max()) + 1 if len(bins) else 0
+
+    result: Dict[str, Any] = {
+        'bucket': bucket,
+        'count': int(len(bins)),
+        'counts': np.bincount(bins, minlength=length).tolist()
+    }
+    if by_mode:
+        result['byMode'] = _split_counts(bins, modes, length) if length else {}
+    if by_color:
+        result['byColor'] = _split_counts(bins, colors, length) if length else {}
+    return result
@@ -0,0 +1,96 @@
+import re
+from typing import NamedTuple, Optional
+from .search_cache import normalize_keyword
+
+# 视频文件扩展名
+_EXTENSION = re.compile(r'\.(?:mkv|mp4|avi|rmvb|flv|wmv|mov|ts|m2ts|webm|m4v)$', re.IGNORECASE)
+
+# 集数的常见写法，按可靠程度排列
+_EPISODE_PATTERNS = [
+    re.compile(r'\bS(?P<season>\d{1,2})\s?E(?P<episode>\d{1,4})(?:v\d)?\b', re.IGNORECASE),
+    re.compile(r'第(?P<episode>\d{1,4})[话話集]'),
+    re.compile(r'[\[【(（]\s*(?P<episode>\d{1,3})(?:\.\d)?(?:v\d)?(?:\s*END)?\s*[\]】)）]', re.IGNORECASE),
+    re.compile(r'\b(?:EP|E|#)\s?(?P<episode>\d{1,4})(?:v\d)?\b', re.IGNORECASE),
+    re.compile(r'\s[-–]\s(?P<episode>\d{1,4})(?:v\d)?\b', re.IGNORECASE),
+    re.compile(r'(?:^|\s)(?P<episode>\d{1,3})(?:v\d)?\s*$', re.IGNORECASE),
+]
+
+# 季数的常见写法
+_SEASON_PATTERNS = [
+    re.compile(r'\bS(?P<season>\d{1,2})\b', re.IGNORECASE),
+    re.compile(r'\bseason\s?(?P<season>\d{1,2})\b', re.IGNORECASE),
+    re.compile(r'\b(?P<season>\d{1,2})(?:st|nd|rd|th)\s?season\b', re.IGNORECASE),
+    re.compile(r'第(?P<season>\d{1,2})[季期]'),
+]
+
+# 方括号等包围的片段
+_BRACKETED = re.compile(r'[\[【(（]([^\]】)）]*)[\]】)）]')
+
+# 字幕组、画质、编码、语言等标签
+_TAG = re.compile(
+    r'^(?:\d{3,4}[pi]|\d{3,4}x\d{3,4}|[248]k|x26[45]|h\.?26[45]|hevc|avc|aac|flac|ac3|opus|'
+    r'10\s?bit|8\s?bit|hdr|web[\s-]?(?:dl|rip)|bd(?:rip)?|blu[\s-]?ray|dvd(?:rip)?|tv(?:rip)?|'
+    r'mkv|mp4|gb|big5|chs|cht|jpsc|jptc|sc|tc|简体|繁体|简日|繁日|简繁|内封|外挂|字幕|双语|'
+    r'v\d|end|fin|raw|baha|cr|nf|amzn|b-global)(?:[\s_&+-].*)?$',
+    re.IGNORECASE
+)
+
+class ParsedName(NamedTuple):
+    """从文件名中解析出的作品标题、季数和集数"""
+    title: str
+    season: int
+    episode: Optional[int]
+
+def _clean_title(text: str) -> str:
+    """规范化标题并将标点替换为空格"""
+    text = normalize_keyword(text.replace('_', ' ').replace('.', ' '))
+    return re.sub(r'[^\w]+', ' ', text).strip()
+
+def _pick_title(text: str) -> str:
+    """从集数之前的部分选出作品标题：优先使用括号外的文字，否则选最长的非标签括号片段"""
+    plain = _BRACKETED.sub(' ', text)
+    if re.search(r'[^\W\d_]', plain):
+        return plain
+    segments = [segment.strip() for segment in _BRACKETED.findall(text)]
+    # 第一个括号片段通常是字幕组
+    candidates = [segment for segment in segments[1:] if segment and not _TAG.match(segment)]
+    if not candidates:
+        candidates = [segment for segment in segments if segment and not _TAG.match(segment)]
+    return max(candidates, key=len) if candidates else ''
+
+def parse_filename(file_name: str) -> ParsedName:
+    """
+    从视频文件名中解析作品标题、季数和集数
+
+    支持 S01E01、第01话、[01]、EP01、" - 01" 等写法，去除字幕组、画质、编码等标签。
+
+    Args:
+        file_name: 视频文件名，可以包含路径
+
+    Returns:
+        ParsedName: 规范化的标题（可能为空）、季数（默认为1）和集数（无法解析时为 None）
+    """
+    name = re.split(r'[\\/]', file_name)[-1]
+    name = _EXTENSION.sub('', name)
+    # 去除 ★10月新番★ 之类的宣传文字
+    name = re.sub(r'★[^★]*★', ' ', name).strip()
+
+    season, episode, head = None, None, name
+    for pattern in _EPISODE_PATTERNS:
+        match = pattern.search(name)
+        if match:
+            episode = int(match.group('episode'))
+            if 'season' in pattern.groupindex:
+                season = int(match.group('season'))
+            head = name[:match.start()]
+            break
+
+    title = _pick_title(head)
+    if season is None:
+        for pattern in _SEASON_PATTERNS:
+            match = pattern.search(title)
+            if match:
+                season = int(match.group('season'))
+                title = title[:match.start()] + title[match.end():]
+                break
+    return ParsedName(_clean_title(title), season or 1, episode)
@@ -0,0 +1,65 @@
+import httpx
+import logging
+from typing import Optional
+from ..config import settings
+
+# 配置日志记录器
+logger = logging.getLogger(__name__)
+
+# 全局共享的上游HTTP客户端，由应用生命周期管理
+_client: Optional[httpx.AsyncClient] = None
+
+def create_http_client() -> httpx.AsyncClient:
+    """
+    根据配置创建带连接池的HTTP客户端
+    
+    Returns:
+        httpx.AsyncClient: 新建的HTTP客户端
+    """
+    limits = httpx.Limits(
+        max_connections=settings.HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY
+    )
+    timeout = httpx.Timeout(
+        connect=settings.HTTP_CONNECT_TIMEOUT,
+        read=settings.HTTP_READ_TIMEOUT,
+        write=settings.HTTP_WRITE_TIMEOUT,
+        pool=settings.HTTP_POOL_TIMEOUT
+    )
+    return httpx.AsyncClient(
+        limits=limits,
+        timeout=timeout,
+        http2=settings.HTTP2_ENABLED
+    )
+
+async def init_http_client() -> httpx.AsyncClient:
+    """应用启动时创建全局HTTP客户端"""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = create_http_client()
+        logger.info(
+            f"上游HTTP客户端已创建: max_connections={settings.HTTP_MAX_CONNECTIONS}, "
+            f"http2={settings.HTTP2_ENABLED}"
+        )
+    return _client
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    获取全局HTTP客户端，如果尚未创建（例如在命令行脚本中）则懒加载创建
+    
+    Returns:
+        httpx.AsyncClient: 全局共享的HTTP客户端
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        _client = create_http_client()
+    return _client
+
+async def close_http_client():
+    """应用关闭时释放全局HTTP客户端的连接"""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+        logger.info("上游HTTP客户端已关闭")
@@ -0,0 +1,229 @@
+import asyncio
+import difflib
+import logging
+import time
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+from sqlalchemy import select
+from ..config import settings
+from app.database import AsyncSessionLocal
+from app.models.catalog import CatalogEpisode
+from app.models.file_match import FileMatch
+from .filename import parse_filename
+from .prefetch import EPISODES_PER_ANIME
+
+# 配置日志记录器
+logger = logging.getLogger(__name__)
+
+# 本地匹配模式：local 只在本地匹配，localFirst 本地未匹配时再请求上游
+LOCAL_MATCH_MODES = ('local', 'localFirst')
+
+# localFirst 模式请求上游时使用的匹配模式
+UPSTREAM_FALLBACK_MODE = 'hashAndFileName'
+
+class LocalMatch(NamedTuple):
+    """本地匹配结果"""
+    episode_id: int
+    score: float
+    inferred: bool  # 是否由同一作品其他集的编号推算得到
+
+class _Observation(NamedTuple):
+    episode_id: int
+    video_duration: int
+    file_size: int
+
+class LocalMatchIndex:
+    """
+    由已保存的文件匹配记录构建的文件名索引
+
+    按 (规范化标题, 季数, 集数) 记录匹配过的节目编号；同一作品的节目编号与集数的差值一致时，
+    记录该作品的编号，用于推算尚未匹配过的集数。
+    """
+
+    def __init__(self):
+        self._episodes: Dict[str, Dict[Tuple[int, int], List[_Observation]]] = defaultdict(lambda: defaultdict(list))
+        self._series: Dict[str, Dict[int, Counter]] = defaultdict(lambda: defaultdict(Counter))
+        self._titles: List[str] = []
+        self.size = 0
+
+    def add(self, file_name: str, episode_id: int, video_duration: int = 0, file_size: int = 0):
+        """加入一条匹配记录"""
+        parsed = parse_filename(file_name)
+        if not parsed.title or parsed.episode is None:
+            return
+        if parsed.title not in self._episodes:
+            self._titles.append(parsed.title)
+        self._episodes[parsed.title][(parsed.season, parsed.episode)].append(
+            _Observation(episode_id, video_duration or 0, file_size or 0)
+        )
+        if episode_id % EPISODES_PER_ANIME == parsed.episode:
+            self._series[parsed.title][parsed.season][episode_id // EPISODES_PER_ANIME] += 1
+        self.size += 1
+
+    def _similar_titles(self, title: str, min_score: float) -> List[Tuple[str, float]]:
+        """标题完全相同时直接返回，否则按相似度查找"""
+        if title in self._episodes:
+            return [(title, 1.0)]
+        matches = difflib.get_close_matches(title, self._titles, n=3, cutoff=min_score)
+        return [(match, difflib.SequenceMatcher(None, title, match).ratio()) for match in matches]
+
+    def _duration_ok(self, observation: _Observation, video_duration: int) -> bool:
+        if not video_duration or not observation.video_duration:
+            return True
+        return abs(observation.video_duration - video_duration) <= settings.LOCAL_MATCH_DURATION_TOLERANCE
+
+    def _size_ok(self, observation: _Observation, file_size: int) -> bool:
+        if not file_size or not observation.file_size:
+            return False
+        return abs(observation.file_size - file_size) <= observation.file_size * settings.LOCAL_MATCH_SIZE_TOLERANCE
+
+    def lookup(self, file_name: str, video_duration: int = 0, file_size: int = 0) -> Optional[LocalMatch]:
+        """
+        匹配文件名
+
+        候选节目按标题相似度、时长在容差内的历史记录数、文件大小是否接近排序，
+        最优的两个候选无法区分时不返回结果。
+
+        Args:
+            file_name: 视频文件名
+            video_duration: 视频时长（秒），0表示未知
+            file_size: 文件大小（字节），0表示未知
+
+        Returns:
+            Optional[LocalMatch]: 匹配结果，无法可靠匹配时返回 None
+        """
+        parsed = parse_filename(file_name)
+        if not parsed.title or parsed.episode is None:
+            return None
+        key = (parsed.season, parsed.episode)
+        min_score = settings.LOCAL_MATCH_MIN_SCORE
+
+        ranked: Dict[int, Tuple[float, int, bool]] = {}
+        for title, score in self._similar_titles(parsed.title, min_score):
+            for observation in self._episodes[title].get(key, ()):
+                if not self._duration_ok(observation, video_duration):
+                    continue
+                best_score, count, size_ok = ranked.get(observation.episode_id, (0.0, 0, False))
+                ranked[observation.episode_id] = (
+                    max(best_score, score),
+                    count + 1,
+                    size_ok or self._size_ok(observation, file_size)
+                )
+        if ranked:
+            order = sorted(ranked.items(), key=lambda item: item[1], reverse=True)
+            if len(order) > 1 and order[0][1] == order[1][1]:
+                return None
+            episode_id, (score, _, _) = order[0]
+            return LocalMatch(episode_id, round(score, 4), False)
+
+        if not settings.LOCAL_MATCH_INFER_EPISODES:
+            return None
+        # 没有这一集的记录时，由同一作品其他集一致的编号推算
+        for title, score in self._similar_titles(parsed.title, min_score):
+            animes = self._series[title].get(parsed.season)
+            if not animes:
+                continue
+            (anime_id, count), *rest = animes.most_common(2)
+            if rest and rest[0][1] == count:
+                continue
+            return LocalMatch(anime_id * EPISODES_PER_ANIME + parsed.episode, round(score, 4), True)
+        return None
+
+class LocalMatcher:
+    """
+    进程内共享的本地匹配器，首次使用时从数据库构建索引，之后定期重建
+
+    新保存的匹配记录通过 add 直接加入当前索引。标题不完全相同时需要逐个计算相似度，
+    因此在线程中查找，不阻塞事件循环；推算出的节目编号只有在本地剧集目录中存在时才返回。
+    """
+
+    def __init__(self):
+        self._index: Optional[LocalMatchIndex] = None
+        self._built_at = 0.0
+        self._building: Optional[asyncio.Task] = None
+        self.lookups = 0
+        self.matched = 0
+        self.inferred = 0
+
+    async def _build(self) -> LocalMatchIndex:
+        """从文件匹配记录构建索引，解析文件名在线程中进行"""
+        async with AsyncSessionLocal() as session:
+            stmt = select(
+                FileMatch.file_name, FileMatch.episode_id, FileMatch.video_duration, FileMatch.file_size
+            )
+            rows = (await session.execute(stmt)).all()
+
+        def build() -> LocalMatchIndex:
+            index = LocalMatchIndex()
+            for row in rows:
+                if row.file_name and row.episode_id:
+                    index.add(row.file_name, row.episode_id, row.video_duration, row.file_size)
+            return index
+
+        started = time.perf_counter()
+        index = await asyncio.to_thread(build)
+        logger.info(
+            f"构建本地匹配索引: 记录数={index.size}, 耗时={(time.perf_counter() - started) * 1000:.0f}ms"
+        )
+        return index
+
+    async def _get_index(self) -> LocalMatchIndex:
+        """获取索引，过期时重建，并发的重建只执行一次"""
+        expired = time.time() - self._built_at > settings.LOCAL_MATCH_REFRESH_MINUTES * 60
+        if self._index is not None and not expired:
+            return self._index
+        if self._building is None:
+            self._building = asyncio.ensure_future(self._build())
+        try:
+            self._index = await asyncio.shield(self._building)
+            self._built_at = time.time()
+        finally:
+            if self._building is not None and self._building.done():
+                self._building = None
+        return self._index
+
+    async def match(self, file_name: str, video_duration: int = 0, file_size: int = 0) -> Optional[LocalMatch]:
+        """
+        按文件名在本地匹配节目
+
+        Args:
+            file_name: 视频文件名
+            video_duration: 视频时长（秒）
+            file_size: 文件大小（字节）
+
+        Returns:
+            Optional[LocalMatch]: 匹配结果，无法可靠匹配时返回 None
+        """
+        index = await self._get_index()
+        self.lookups += 1
+        result = await asyncio.to_thread(index.lookup, file_name, video_duration, file_size)
+        if result is not None and result.inferred and not await self._in_catalog(result.episode_id):
+            result = None
+        if result is not None:
+            self.matched += 1
+            self.inferred += int(result.inferred)
+        return result
+
+    async def _in_catalog(self, episode_id: int) -> bool:
+        """节目是否在本地剧集目录中"""
+        async with AsyncSessionLocal() as session:
+            stmt = select(CatalogEpisode.id).where(CatalogEpisode.episode_id == episode_id)
+            return (await session.execute(stmt)).first() is not None
+
+    def add(self, file_name: str, episode_id: int, video_duration: int = 0, file_size: int = 0):
+        """将新保存的匹配记录加入已构建的索引"""
+        if self._index is not None:
+            self._index.add(file_name, episode_id, video_duration, file_size)
+
+    def stats(self) -> Dict[str, Any]:
+        """获取本地匹配统计信息"""
+        return {
+            'indexed': self._index.size if self._index is not None else 0,
+            'lookups': self.lookups,
+            'matched': self.matched,
+            'inferred': self.inferred,
+            'match_rate': round(self.matched / self.lookups, 4) if self.lookups else 0.0
+        }
+
+# 全局本地匹配器
+local_matcher = LocalMatcher()
@@ -0,0 +1,201 @@
+import json
+import time
+import logging
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Hashable, Optional
+from ..config import settings
+
+# 配置日志记录器
+logger = logging.getLogger(__name__)
+
+def estimate_size(value: Any) -> int:
+    """
+    估算缓存数据的字节数（按紧凑JSON编码后的长度计算）
+    
+    Args:
+        value: 需要估算大小的数据
+        
+    Returns:
+        int: 估算的字节数
+    """
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    return len(json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+
+class _Entry:
+    __slots__ = ('value', 'size', 'stored_at')
+
+    def __init__(self, value: Any, size: int, stored_at: float):
+        self.value = value
+        self.size = size
+        self.stored_at = stored_at
+
+class MemoryCache:
+    """
+    进程内的LRU/TTL内存缓存，容量按缓存数据的总字节数而不是条目数限制
+    
+    过期判断与数据库缓存一致：以数据的更新时间为准，由调用方传入本次请求的TTL，
+    因此同一条目可以同时满足不同 cache_ttl 的请求。
+    """
+
+    def __init__(self, name: str, max_bytes: int, default_ttl: timedelta):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self._entries: "OrderedDict[Hashable, _Entry]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.stale_hits = 0
+
+    def get(self, key: Hashable, ttl: Optional[timedelta] = None) -> Optional[Any]:
+        """
+        获取未过期的缓存数据
+        
+        Args:
+            key: 缓存键
+            ttl: 本次请求允许的最大缓存时间，如果为None则使用默认配置
+            
+        Returns:
+            Optional[Any]: 缓存数据，不存在或已过期时返回 None
+        """
+        entry = self._entries.get(key)
+        ttl = ttl if ttl is not None else self.default_ttl
+        if entry is None or time.time() - entry.stored_at > ttl.total_seconds():
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry.value
+
+    def get_stale(self, key: Hashable, max_age: timedelta) -> Optional[Any]:
+        """
+        获取已过期但仍在允许陈旧时间内的缓存数据，用于后台刷新期间直接返回旧数据
+        
+        Args:
+            key: 缓存键
+            max_age: 允许返回的数据最大时长
+            
+        Returns:
+            Optional[Any]: 缓存数据，不存在或超过最大时长时返回 None
+        """
+        entry = self._entries.get(key)
+        if entry is None or time.time() - entry.stored_at > max_age.total_seconds():
+            return None
+        self._entries.move_to_end(key)
+        self.stale_hits += 1
+        return entry.value
+
+    def peek(self, key: Hashable, max_age: timedelta) -> Optional[Any]:
+        """
+        查看缓存数据但不更新命中统计和淘汰顺序，用于条件请求等只需要元数据的场景
+        
+        Args:
+            key: 缓存键
+            max_age: 允许返回的数据最大时长
+            
+        Returns:
+            Optional[Any]: 缓存数据，不存在或超过最大时长时返回 None
+        """
+        entry = self._entries.get(key)
+        if entry is None or time.time() - entry.stored_at > max_age.total_seconds():
+            return None
+        return entry.value
+
+    def set(
+        self,
+        key: Hashable,
+        value: Any,
+        size: Optional[int] = None,
+        updated_at: Optional[datetime] = None
+    ):
+        """
+        写入缓存数据，超出容量时按最近最少使用顺序淘汰
+        
+        Args:
+            key: 缓存键
+            value: 缓存数据
+            size: 数据的字节数，如果为None则自动估算
+            updated_at: 数据的更新时间，如果为None则使用当前时间
+        """
+        size = size if size is not None else estimate_size(value)
+        if size > self.max_bytes:
+            # 单条数据超过总容量，不缓存，同时丢弃旧数据
+            self.invalidate(key)
+            return
+        stored_at = updated_at.timestamp() if updated_at else time.time()
+
+        self.invalidate(key)
+        self._entries[key] = _Entry(value, size, stored_at)
+        self._bytes += size
+
+        while self._bytes > self.max_bytes and self._entries:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.size
+            self.evictions += 1
+
+    def invalidate(self, key: Hashable):
+        """删除指定缓存键"""
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+    def clear(self):
+        """清空所有缓存"""
+        self._entries.clear()
+        self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """获取缓存统计信息"""
+        total = self.hits + self.misses
+        return {
+            'name': self.name,
+            'entries': len(self._entries),
+            'bytes': self._bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'stale_hits': self.stale_hits,
+            'hit_rate': round(self.hits / total, 4) if total else 0.0
+        }
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+# 弹幕数据内存缓存，键与 DanmakuCache 一致：(episode_id, with_related, ch_convert)
+danmaku_memory_cache = MemoryCache(
+    'danmaku',
+    settings.DANMAKU_MEMORY_CACHE_MAX_BYTES,
+    timedelta(minutes=settings.CACHE_EXPIRE_MINUTES)
+)
+
+# TMDB搜索结果内存缓存，键与 TmdbCache 一致：(tmdb_id, episode)
+tmdb_memory_cache = MemoryCache(
+    'tmdb',
+    settings.TMDB_MEMORY_CACHE_MAX_BYTES,
+    timedelta(minutes=settings.CACHE_EXPIRE_MINUTES)
+)
+
+# 关键词搜索作品结果内存缓存，键与 AnimeSearchCache 一致：(规范化的关键词, 作品类型)
+search_memory_cache = MemoryCache(
+    'search',
+    settings.SEARCH_MEMORY_CACHE_MAX_BYTES,
+    timedelta(minutes=settings.SEARCH_CACHE_EXPIRE_MINUTES)
+)
+
+# 弹幕时间索引内存缓存，键与 DanmakuCache 一致，索引与完整数据的校验和绑定
+danmaku_index_cache = MemoryCache(
+    'danmaku_index',
+    settings.DANMAKU_INDEX_CACHE_MAX_BYTES,
+    timedelta(minutes=settings.CACHE_EXPIRE_MINUTES)
+)
+
+# 统计面板数据内存缓存，键为统计的小时数
+stats_memory_cache = MemoryCache(
+    'stats',
+    1024 * 1024,
+    timedelta(seconds=settings.STATS_DATA_CACHE_SECONDS)
+)
@@ -0,0 +1,167 @@
+import logging
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, NamedTuple, Optional
+from sqlalchemy import select, delete
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from ..config import settings
+from app.database import AsyncSessionLocal
+from app.models.danmaku import NegativeCacheEntry
+from .memory_cache import MemoryCache, estimate_size
+
+# 配置日志记录器
+logger = logging.getLogger(__name__)
+
+# 查询类型：文件匹配（键为文件哈希）、弹幕（键为节目编号）、关键词搜索（键为规范化的关键词和类型）
+MATCH = 'match'
+DANMAKU = 'danmaku'
+SEARCH = 'search'
+
+# 每写入多少条记录清理一次过期记录
+_PURGE_EVERY = 500
+
+class NegativeEntry(NamedTuple):
+    """上游没有结果的查询"""
+    status_code: Optional[int]
+    data: Any
+    updated_at: datetime
+
+def _entry_size(entry: NegativeEntry) -> int:
+    """估算内存中一条记录的字节数"""
+    return estimate_size(entry.data) + 64
+
+class NegativeCache:
+    """
+    上游没有结果的查询的缓存：未能匹配的文件、上游返回404的节目、没有结果的搜索
+
+    各类查询的有效时间分别配置，通常比正常结果短，以便上游补充数据后能及时获取。
+    内存中缓存最近的记录，数据库记录供其他进程和重启后使用。
+    """
+
+    def __init__(self, max_bytes: int):
+        self._memory = MemoryCache('negative', max_bytes, timedelta(minutes=settings.NEGATIVE_CACHE_MATCH_MINUTES))
+        self.hits: Counter = Counter()
+        self.misses: Counter = Counter()
+        self.stores: Counter = Counter()
+        self._writes = 0
+
+    def ttl(self, kind: str) -> timedelta:
+        """获取查询类型的有效时间"""
+        minutes = {
+            MATCH: settings.NEGATIVE_CACHE_MATCH_MINUTES,
+            DANMAKU: settings.NEGATIVE_CACHE_DANMAKU_MINUTES,
+            SEARCH: settings.NEGATIVE_CACHE_SEARCH_MINUTES
+        }[kind]
+        return timedelta(minutes=minutes)
+
+    async def get(self, session: AsyncSession, kind: str, key: str) -> Optional[NegativeEntry]:
+        """
+        查询一条未过期的记录
+
+        Args:
+            session: 数据库会话
+            kind: 查询类型
+            key: 查询键
+
+        Returns:
+            Optional[NegativeEntry]: 记录，不存在或已过期时返回 None
+        """
+        return (await self.get_many(session, kind, [key])).get(key)
+
+    async def get_many(self, session: AsyncSession, kind: str, keys: Iterable[str]) -> Dict[str, NegativeEntry]:
+        """批量查询未过期的记录，返回查询键到记录的映射"""
+        if not settings.NEGATIVE_CACHE_ENABLED:
+            return {}
+        ttl = self.ttl(kind)
+        keys = list(dict.fromkeys(keys))
+        found: Dict[str, NegativeEntry] = {}
+        pending = []
+        for key in keys:
+            entry = self._memory.get((kind, key), ttl) if settings.MEMORY_CACHE_ENABLED else None
+            if entry is not None:
+                found[key] = entry
+            else:
+                pending.append(key)
+
+        try:
+            for i in range(0, len(pending), 500):
+                stmt = select(NegativeCacheEntry).where(
+                    NegativeCacheEntry.kind == kind,
+                    NegativeCacheEntry.key.in_(pending[i:i + 500]),
+                    NegativeCacheEntry.updated_at >= datetime.now() - ttl
+                )
+                for row in (await session.execute(stmt)).scalars():
+                    entry = NegativeEntry(row.status_code, row.data, row.updated_at)
+                    found[row.key] = entry
+                    if settings.MEMORY_CACHE_ENABLED:
+                        self._memory.set((kind, row.key), entry, _entry_size(entry), updated_at=row.updated_at)
+        except Exception as e:
+            logger.error(f"读取无结果查询缓存时出错: {e}")
+
+        self.hits[kind] += len(found)
+        self.misses[kind] += len(keys) - len(found)
+        return found
+
+    async def put(self, kind: str, key: str, status_code: Optional[int] = None, data: Any = None):
+        """
+        记录一条上游没有结果的查询
+
+        Args:
+            kind: 查询类型
+            key: 查询键
+            status_code: 上游返回的错误状态码
+            data: 需要原样返回的上游响应
+        """
+        if not settings.NEGATIVE_CACHE_ENABLED:
+            return
+        now = datetime.now()
+        async with AsyncSessionLocal() as session:
+            try:
+                stmt = sqlite_insert(NegativeCacheEntry).values(
+                    kind=kind, key=key, status_code=status_code, data=data, updated_at=now
+                )
+                await session.execute(stmt.on_conflict_do_update(
+                    index_elements=['kind', 'key'],
+                    set_={'status_code': status_code, 'data': data, 'updated_at': now}
+                ))
+                self._writes += 1
+                if self._writes % _PURGE_EVERY == 0:
+                    await self._purge(session)
+                await session.commit()
+            except Exception as e:
+                logger.error(f"保存无结果查询缓存时出错: {e}")
+                await session.rollback()
+                return
+        self.stores[kind] += 1
+        if settings.MEMORY_CACHE_ENABLED:
+            entry = NegativeEntry(status_code, data, now)
+            self._memory.set((kind, key), entry, _entry_size(entry), updated_at=now)
+        logger.info(f"缓存无结果的查询: {kind} {key}")
+
+    async def _purge(self, session: AsyncSession):
+        """删除各类查询中已过期的记录"""
+        for kind in (MATCH, DANMAKU, SEARCH):
+            await session.execute(delete(NegativeCacheEntry).where(
+                NegativeCacheEntry.kind == kind,
+                NegativeCacheEntry.updated_at < datetime.now() - self.ttl(kind)
+            ))
+
+    def stats(self) -> Dict[str, Any]:
+        """获取各类查询的命中统计信息"""
+        return {
+            'enabled': settings.NEGATIVE_CACHE_ENABLED,
+            'memory_entries': len(self._memory),
+            **{
+                kind: {
+                    'ttl_minutes': int(self.ttl(kind).total_seconds() // 60),
+                    'hits': self.hits[kind],
+                    'misses': self.misses[kind],
+                    'stores': self.stores[kind]
+                }
+                for kind in (MATCH, DANMAKU, SEARCH)
+            }
+        }
+
+# 全局无结果查询缓存
+negative_cache = NegativeCache(settings.NEGATIVE_CACHE_MEMORY_MAX_BYTES)
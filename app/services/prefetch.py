@@ -0,0 +1,182 @@
+import logging
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Optional, Set, Tuple
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from ..config import settings
+from app.database import AsyncSessionLocal
+from app.models.catalog import CatalogAnime, CatalogEpisode
+from app.models.danmaku import DanmakuCache
+from .background import spawn
+from .memory_cache import danmaku_memory_cache
+from .singleflight import danmaku_flight
+
+# 配置日志记录器
+logger = logging.getLogger(__name__)
+
+# 弹弹play的节目编号为 动画编号 * 10000 + 集数编号
+EPISODES_PER_ANIME = 10000
+
+def next_episode_id(episode_id: int, anime_id: Optional[int] = None) -> Optional[int]:
+    """
+    推算下一集的节目编号
+
+    Args:
+        episode_id: 当前节目编号
+        anime_id: 匹配结果中的动画编号，提供时用于校验节目编号
+
+    Returns:
+        Optional[int]: 下一集的节目编号，无法推算时返回 None
+    """
+    if episode_id <= 0:
+        return None
+    if anime_id is not None and episode_id // EPISODES_PER_ANIME != anime_id:
+        return None
+    next_id = episode_id + 1
+    if next_id // EPISODES_PER_ANIME != episode_id // EPISODES_PER_ANIME:
+        return None
+    return next_id
+
+async def resolve_episode_id(session: AsyncSession, episode_id: int) -> Optional[int]:
+    """
+    用本地目录校验推算出的节目编号
+
+    目录中记录了同一动画在该编号及之后的剧集时取其中最小的一个（跳过编号空缺），
+    否则在目录记录的集数范围内沿用推算的编号。
+
+    Args:
+        session: 数据库会话
+        episode_id: 推算出的节目编号
+
+    Returns:
+        Optional[int]: 校验后的节目编号，超出已知集数时返回 None
+    """
+    anime_id = episode_id // EPISODES_PER_ANIME
+    stmt = select(func.min(CatalogEpisode.episode_id)).where(
+        CatalogEpisode.anime_id == anime_id,
+        CatalogEpisode.episode_id >= episode_id,
+        CatalogEpisode.episode_id < (anime_id + 1) * EPISODES_PER_ANIME
+    )
+    listed = (await session.execute(stmt)).scalar()
+    if listed is not None:
+        return listed
+    stmt = select(CatalogAnime.episode_count).where(CatalogAnime.anime_id == anime_id)
+    episode_count = (await session.execute(stmt)).scalar()
+    if episode_count and episode_id % EPISODES_PER_ANIME > episode_count:
+        return None
+    return episode_id
+
+class Prefetcher:
+    """
+    预取下一集的弹幕：观看通常是顺序的，获取第N集后在后台低优先级地缓存第N+1集
+
+    预取有独立的并发上限，达到上限时直接放弃而不是排队；缓存中已有新鲜数据的节目不预取。
+    记录预取过的节目，在 CACHE_EXPIRE_MINUTES 内被请求时计为命中，用于评估预取是否值得；
+    超过这个时间仍未被请求的节目可以再次预取。
+    """
+
+    def __init__(self, max_concurrency: int, max_tracked: int = 10000):
+        self.max_concurrency = max_concurrency
+        self.max_tracked = max_tracked
+        self._running: Set[Tuple[int, bool, int]] = set()
+        # 预取完成且尚未被请求的节目及预取时间
+        self._prefetched: "OrderedDict[Tuple[int, bool, int], float]" = OrderedDict()
+        self.scheduled = 0
+        self.dropped = 0
+        self.skipped_fresh = 0
+        self.skipped_unknown = 0
+        self.completed = 0
+        self.failed = 0
+        self.hits = 0
+
+    def schedule(self, key: Tuple[int, bool, int], fetch: Callable[[int], Awaitable[Any]]):
+        """
+        安排预取
+
+        Args:
+            key: 弹幕缓存键 (episode_id, with_related, ch_convert)，episode_id 为推算的下一集节目编号
+            fetch: 接收节目编号，从上游获取并写入缓存的函数
+        """
+        if key in self._running or self._prefetched_recently(key):
+            return
+        if len(self._running) >= self.max_concurrency:
+            self.dropped += 1
+            return
+        if settings.MEMORY_CACHE_ENABLED and danmaku_memory_cache.peek(key, self._fresh_for()) is not None:
+            self.skipped_fresh += 1
+            return
+        self.scheduled += 1
+        self._running.add(key)
+        spawn(self._run(key, fetch), name=f"prefetch-danmaku-{key[0]}")
+
+    def record_access(self, key: Tuple[int, bool, int]):
+        """记录一次弹幕请求，请求的是近期预取过的节目时计为命中"""
+        if self._prefetched_recently(key):
+            self.hits += 1
+        self._prefetched.pop(key, None)
+
+    def _prefetched_recently(self, key: Tuple[int, bool, int]) -> bool:
+        """节目是否在 CACHE_EXPIRE_MINUTES 内预取过"""
+        prefetched_at = self._prefetched.get(key)
+        if prefetched_at is None:
+            return False
+        if datetime.now().timestamp() - prefetched_at > settings.CACHE_EXPIRE_MINUTES * 60:
+            del self._prefetched[key]
+            return False
+        return True
+
+    def _fresh_for(self) -> timedelta:
+        """预取时认为缓存仍然新鲜的时长：距离过期不足 PREFETCH_MIN_REMAINING_MINUTES 时重新获取"""
+        return timedelta(minutes=max(settings.CACHE_EXPIRE_MINUTES - settings.PREFETCH_MIN_REMAINING_MINUTES, 0))
+
+    async def _run(self, key: Tuple[int, bool, int], fetch: Callable[[int], Awaitable[Any]]):
+        """用本地目录校验节目编号并检查数据库缓存后从上游获取"""
+        try:
+            episode_id, with_related, ch_convert = key
+            async with AsyncSessionLocal() as session:
+                episode_id = await resolve_episode_id(session, episode_id)
+                if episode_id is None:
+                    self.skipped_unknown += 1
+                    return
+                stmt = select(DanmakuCache.updated_at).where(
+                    DanmakuCache.episode_id == episode_id,
+                    DanmakuCache.with_related == with_related,
+                    DanmakuCache.ch_convert == ch_convert,
+                    DanmakuCache.updated_at >= datetime.now() - self._fresh_for()
+                )
+                fresh = (await session.execute(stmt)).first()
+            if fresh is not None:
+                self.skipped_fresh += 1
+                return
+            target = (episode_id, with_related, ch_convert)
+            await danmaku_flight.do(target, lambda: fetch(episode_id))
+            self.completed += 1
+            self._prefetched[target] = datetime.now().timestamp()
+            self._prefetched.move_to_end(target)
+            while len(self._prefetched) > self.max_tracked:
+                self._prefetched.popitem(last=False)
+            logger.info(f"预取弹幕数据: episode_id={episode_id}")
+        except Exception as e:
+            self.failed += 1
+            logger.warning(f"预取弹幕数据失败: key={key}, {e}")
+        finally:
+            self._running.discard(key)
+
+    def stats(self) -> Dict[str, Any]:
+        """获取预取统计信息"""
+        return {
+            'enabled': settings.PREFETCH_ENABLED,
+            'running': len(self._running),
+            'scheduled': self.scheduled,
+            'dropped': self.dropped,
+            'skipped_fresh': self.skipped_fresh,
+            'skipped_unknown': self.skipped_unknown,
+            'completed': self.completed,
+            'failed': self.failed,
+            'hits': self.hits,
+            'hit_rate': round(self.hits / self.completed, 4) if self.completed else 0.0
+        }
+
+# 全局预取器
+prefetcher = Prefetcher(settings.PREFETCH_CONCURRENCY)
@@ -1,24 +1,59 @@
 import httpx
+import asyncio
+import hashlib
+import json
 import logging
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, AsyncIterator, Callable, Optional, List, Tuple, Union
 from ..config import settings
 from .signature import generate_signature
+from .http_client import get_http_client
+from .memory_cache import danmaku_memory_cache, danmaku_index_cache, search_memory_cache, tmdb_memory_cache
+from .singleflight import danmaku_flight, index_flight, match_flight, search_flight, tmdb_flight
+from .background import spawn
+from .comments import CommentIdScanner, get_comments, max_comment_id, merge_comments, slice_comments
+from .storage import CachedPayload, PayloadWriter, serialize, iter_raw, load_payload, load_raw, store_raw
+from .streaming import ChunkRelay, PayloadStream
+from .time_index import TimeIndex, TimeWindow, build_time_index
+from .density import compute_density
+from .prefetch import next_episode_id, prefetcher
+from .demand import danmaku_demand
+from .upstream import UpstreamUnavailable, comment_upstream, match_upstream, search_upstream
+from .search_cache import search_cache_key, search_metrics
+from .catalog import find_animes, record_catalog, search_local
+from .local_match import LOCAL_MATCH_MODES, UPSTREAM_FALLBACK_MODE, local_matcher
+from .negative_cache import DANMAKU, MATCH, SEARCH, negative_cache
+from app.database import AsyncSessionLocal, WriteSessionLocal
 from fastapi import HTTPException
-from app.models.danmaku import MatchResponse, DanmakuCache, TmdbCache
+from app.models.danmaku import MatchResponse, BatchMatchResult, AnimeSearchCache, DanmakuCache, TmdbCache
+from app.models.requests import FileMatchRequest
 from app.models.file_match import FileMatch
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from datetime import datetime, timedelta
 
 # 配置日志记录器
 logger = logging.getLogger(__name__)
 
+# 后台刷新弹幕缓存最近一次失败的时间
+_refresh_failures: Dict[Tuple[int, bool, int], datetime] = {}
+
+def _slice_checksum(checksum: str, from_id: int, window: Optional[TimeWindow] = None) -> str:
+    """截取部分弹幕时，由完整数据的校验和派生出截取结果的校验和"""
+    if window is not None:
+        digest = hashlib.sha256(window.key().encode('utf-8')).hexdigest()[:16]
+        return f"{checksum}-{from_id}-{digest}"
+    return f"{checksum}-{from_id}"
+
 class DanmakuProxy:
-    def __init__(self, db: AsyncSession):
+    def __init__(self, db: AsyncSession, client: Optional[httpx.AsyncClient] = None):
         self.base_url = settings.DANDAN_API_BASE_URL
-        self.client = httpx.AsyncClient()
+        # 默认使用应用级共享的HTTP客户端，复用连接池避免每次请求重新握手
+        self.client = client or get_http_client()
         self.db = db
         self.cache_ttl = timedelta(minutes=settings.CACHE_EXPIRE_MINUTES)
+        self.stale_grace = timedelta(minutes=settings.CACHE_STALE_GRACE_MINUTES)
+        self.max_stale = timedelta(minutes=settings.CACHE_MAX_STALE_MINUTES)
 
     async def get_danmaku(
         self,
@@ -26,40 +61,734 @@ class DanmakuProxy:
         from_id: int = 0,
         with_related: bool = True,
         ch_convert: int = 0,
-        cache_ttl: Optional[int] = None
-    ) -> Optional[Dict[str, Any]]:
+        cache_ttl: Optional[int] = None,
+        raw: bool = False,
+        window: Optional[TimeWindow] = None,
+        prefetch: Optional[bool] = None
+    ) -> Union[Dict[str, Any], CachedPayload]:
         """
         从弹弹play获取弹幕数据，支持数据库缓存
         
+        每个节目按 with_related 和 ch_convert 缓存一份完整弹幕，from_id 大于0的请求在本地
+        截取缓存中的弹幕返回，不再请求上游。指定 window 时通过按播放时间排序的索引截取和分页。
+        
+        缓存过期后的宽限时间内直接返回旧数据并在后台刷新，超过宽限时间或最大陈旧时间后
+        等待上游返回新数据。
+        
         Args:
             episode_id: 节目编号
             from_id: 起始弹幕编号，忽略此编号以前的弹幕
             with_related: 是否同时获取关联的第三方弹幕
             ch_convert: 中文简繁转换。0-不转换，1-转换为简体，2-转换为繁体
-            cache_ttl: 缓存过期时间（分钟），如果为None则使用默认配置
+            cache_ttl: 缓存过期时间（分钟），如果为None则使用默认配置；指定时不返回过期的旧数据
+            raw: 是否返回序列化后的字节串（CachedPayload），用于直接作为响应体返回
+            window: 播放时间范围和分页参数
+            prefetch: 是否在后台预取下一集，如果为None则使用 PREFETCH_ENABLED 配置
+            
+        Returns:
+            Union[Dict[str, Any], CachedPayload]: 弹幕数据
+        """
+        prefetcher.record_access((episode_id, with_related, ch_convert))
+        danmaku_demand.record((episode_id, with_related, ch_convert))
+        payload = await self._get_full_danmaku(episode_id, with_related, ch_convert, cache_ttl)
+        if settings.PREFETCH_ENABLED if prefetch is None else prefetch:
+            self._prefetch_next(episode_id, with_related, ch_convert)
+        if window is not None:
+            index = await self._get_time_index((episode_id, with_related, ch_convert), payload)
+            windowed = CachedPayload(
+                index.render(window, from_id),
+                _slice_checksum(payload.checksum, from_id, window),
+                payload.updated_at
+            )
+            return windowed if raw else windowed.decode()
+        if from_id > 0:
+            data = slice_comments(payload.decode(), from_id)
+            if not raw:
+                return data
+            sliced = CachedPayload.from_data(data)
+            sliced.checksum = _slice_checksum(payload.checksum, from_id)
+            sliced.updated_at = payload.updated_at
+            return sliced
+        return payload if raw else payload.decode()
+
+    async def get_danmaku_meta(
+        self,
+        episode_id: int,
+        from_id: int = 0,
+        with_related: bool = True,
+        ch_convert: int = 0,
+        cache_ttl: Optional[int] = None,
+        window: Optional[TimeWindow] = None
+    ) -> Optional[Tuple[str, datetime]]:
+        """
+        获取可直接返回的缓存弹幕的校验和与更新时间，不加载和解码弹幕数据，用于条件请求
+        
+        Args:
+            episode_id: 节目编号
+            from_id: 起始弹幕编号
+            with_related: 是否同时获取关联的第三方弹幕
+            ch_convert: 中文简繁转换方式
+            cache_ttl: 缓存过期时间（分钟），如果为None则使用默认配置；指定时不返回过期的旧数据
+            window: 播放时间范围和分页参数
+            
+        Returns:
+            Optional[Tuple[str, datetime]]: (校验和, 更新时间)，没有可用缓存时返回 None
+        """
+        cache_key = (episode_id, with_related, ch_convert)
+        ttl, stale_limit = self._cache_window(cache_ttl)
+        checksum, updated_at = None, None
+        
+        if settings.MEMORY_CACHE_ENABLED:
+            cached = danmaku_memory_cache.peek(cache_key, stale_limit)
+            if cached is not None:
+                checksum, updated_at = cached.checksum, cached.updated_at
+        
+        if checksum is None:
+            try:
+                stmt = select(DanmakuCache.checksum, DanmakuCache.updated_at).where(
+                    DanmakuCache.episode_id == episode_id,
+                    DanmakuCache.with_related == with_related,
+                    DanmakuCache.ch_convert == ch_convert,
+                    DanmakuCache.updated_at >= datetime.now() - stale_limit
+                )
+                row = (await self.db.execute(stmt)).one_or_none()
+                if row and row.checksum:
+                    checksum, updated_at = row.checksum, row.updated_at
+            except Exception as e:
+                logger.error(f"获取弹幕缓存元数据时出错: {e}")
+        
+        if checksum is None:
+            return None
+        if updated_at < datetime.now() - ttl:
+            self._refresh_danmaku_in_background(episode_id, with_related, ch_convert)
+        if from_id > 0 or window is not None:
+            checksum = _slice_checksum(checksum, from_id, window)
+        return checksum, updated_at
+
+    async def get_danmaku_density(
+        self,
+        episode_id: int,
+        bucket: int,
+        by_mode: bool = False,
+        by_color: bool = False,
+        with_related: bool = True,
+        ch_convert: int = 0,
+        cache_ttl: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """
+        获取按播放时间区间统计的弹幕数量，结果保存在弹幕缓存记录中，弹幕刷新时清空
+        
+        Args:
+            episode_id: 节目编号
+            bucket: 区间长度（秒）
+            by_mode: 是否同时按弹幕模式分别统计
+            by_color: 是否同时按弹幕颜色分别统计
+            with_related: 是否同时获取关联的第三方弹幕
+            ch_convert: 中文简繁转换方式
+            cache_ttl: 缓存过期时间（分钟），如果为None则使用默认配置；指定时不返回过期的旧数据
+            
+        Returns:
+            Dict[str, Any]: 弹幕密度统计结果
+        """
+        result_key = f"{bucket}:{int(by_mode)}:{int(by_color)}"
+        _, stale_limit = self._cache_window(cache_ttl)
+        try:
+            stmt = select(DanmakuCache.density, DanmakuCache.checksum).where(
+                DanmakuCache.episode_id == episode_id,
+                DanmakuCache.with_related == with_related,
+                DanmakuCache.ch_convert == ch_convert,
+                DanmakuCache.updated_at >= datetime.now() - stale_limit
+            )
+            row = (await self.db.execute(stmt)).one_or_none()
+            if row and row.density and row.density.get('checksum') == row.checksum:
+                cached = row.density.get('results', {}).get(result_key)
+                if cached is not None:
+                    return cached
+        except Exception as e:
+            logger.error(f"获取弹幕密度缓存时出错: {e}")
+        
+        payload = await self._get_full_danmaku(episode_id, with_related, ch_convert, cache_ttl)
+        result = await asyncio.to_thread(
+            lambda: compute_density(payload.decode(), bucket, by_mode, by_color)
+        )
+        
+        # 保存统计结果，只在弹幕数据未变化时写入，避免覆盖刷新后的记录
+        try:
+            async with AsyncSessionLocal() as session:
+                stmt = select(DanmakuCache.density).where(
+                    DanmakuCache.episode_id == episode_id,
+                    DanmakuCache.with_related == with_related,
+                    DanmakuCache.ch_convert == ch_convert,
+                    DanmakuCache.checksum == payload.checksum
+                )
+                density = (await session.execute(stmt)).scalar_one_or_none()
+                if not density or density.get('checksum') != payload.checksum:
+                    density = {'checksum': payload.checksum, 'results': {}}
+                density['results'][result_key] = result
+                await session.execute(
+                    update(DanmakuCache)
+                    .where(
+                        DanmakuCache.episode_id == episode_id,
+                        DanmakuCache.with_related == with_related,
+                        DanmakuCache.ch_convert == ch_convert,
+                        DanmakuCache.checksum == payload.checksum
+                    )
+                    # 保持 updated_at 不变，否则 onupdate 会让缓存看起来刚刚刷新
+                    .values(density=density, updated_at=DanmakuCache.updated_at)
+                )
+                await session.commit()
+        except Exception as e:
+            logger.error(f"保存弹幕密度缓存时出错: {e}")
+        return result
+
+    def _prefetch_next(
+        self,
+        episode_id: int,
+        with_related: bool,
+        ch_convert: int,
+        anime_id: Optional[int] = None
+    ):
+        """在后台预取下一集的弹幕"""
+        next_id = next_episode_id(episode_id, anime_id)
+        if next_id is None:
+            return
+        prefetcher.schedule(
+            (next_id, with_related, ch_convert),
+            lambda episode_id: self._fetch_danmaku(episode_id, with_related, ch_convert)
+        )
+
+    async def _get_time_index(
+        self,
+        cache_key: Tuple[int, bool, int],
+        payload: CachedPayload
+    ) -> TimeIndex:
+        """获取完整弹幕数据对应的时间索引，每个版本的数据只在线程池中构建一次"""
+        index = danmaku_index_cache.get(cache_key)
+        if index is not None and index.checksum == payload.checksum:
+            return index
+
+        async def build() -> TimeIndex:
+            index = await asyncio.to_thread(build_time_index, payload)
+            danmaku_index_cache.set(cache_key, index, size=index.size)
+            logger.info(f"构建弹幕时间索引: episode_id={cache_key[0]}, 弹幕数={len(index)}")
+            return index
+
+        return await index_flight.do((*cache_key, payload.checksum), build)
+
+    def _cache_window(self, cache_ttl: Optional[int]) -> Tuple[timedelta, timedelta]:
+        """计算缓存有效时间和允许返回旧数据的最大时长，调用方指定 cache_ttl 时不返回旧数据"""
+        if cache_ttl is not None:
+            # 调用方明确要求的缓存时间（cache_ttl=0 表示总是请求上游）不加宽限时间
+            ttl = timedelta(minutes=cache_ttl)
+            return ttl, ttl
+        # 允许返回旧数据的最大时长：TTL加宽限时间，且不超过最大陈旧时间
+        stale_limit = min(self.cache_ttl + self.stale_grace, max(self.max_stale, self.cache_ttl))
+        return self.cache_ttl, stale_limit
+
+    async def _get_full_danmaku(
+        self,
+        episode_id: int,
+        with_related: bool,
+        ch_convert: int,
+        cache_ttl: Optional[int]
+    ) -> CachedPayload:
+        """按缓存、上游的顺序获取节目序列化后的完整弹幕数据"""
+        cache_key = (episode_id, with_related, ch_convert)
+        ttl, stale_limit = self._cache_window(cache_ttl)
+        
+        # 首先尝试从内存缓存获取数据
+        if settings.MEMORY_CACHE_ENABLED:
+            cached = danmaku_memory_cache.get(cache_key, ttl)
+            if cached is not None:
+                logger.debug(f"从内存缓存获取弹幕数据: episode_id={episode_id}")
+                return cached
+            if stale_limit > ttl:
+                cached = danmaku_memory_cache.get_stale(cache_key, stale_limit)
+                if cached is not None:
+                    logger.info(f"返回过期的内存缓存并后台刷新: episode_id={episode_id}")
+                    self._refresh_danmaku_in_background(episode_id, with_related, ch_convert)
+                    return cached
+        
+        # 其次尝试从数据库缓存获取数据
+        cached_data = await self._load_danmaku_row(episode_id, with_related, ch_convert, ttl, stale_limit)
+        if cached_data:
+            return self._cache_danmaku_row(cache_key, cached_data)
+
+        # 如果缓存不存在或已过期，从API获取数据，并发的相同请求只向上游请求一次
+        try:
+            payload = await danmaku_flight.do(
+                cache_key,
+                lambda: self._fetch_danmaku(episode_id, with_related, ch_convert)
+            )
+        except UpstreamUnavailable:
+            payload = await self._load_stale_danmaku(cache_key)
+            if payload is None:
+                raise
+        if payload is None:
+            # 流式获取的数据只写入了数据库缓存，重新读取
+            cached_data = await self._load_danmaku_row(episode_id, with_related, ch_convert, ttl, stale_limit)
+            if cached_data is None:
+                raise HTTPException(status_code=500, detail="读取弹幕缓存失败")
+            payload = self._cache_danmaku_row(cache_key, cached_data)
+        return payload
+
+    async def stream_danmaku(
+        self,
+        episode_id: int,
+        with_related: bool = True,
+        ch_convert: int = 0,
+        cache_ttl: Optional[int] = None
+    ) -> Union[CachedPayload, PayloadStream]:
+        """
+        以流式方式获取节目的完整弹幕数据，内存占用与弹幕数量无关
+        
+        内存缓存命中时直接返回；数据库缓存较大时分块解压返回；缓存未命中时从上游分块读取，
+        边写入压缩缓存边转发给客户端。
+        
+        Args:
+            episode_id: 节目编号
+            with_related: 是否同时获取关联的第三方弹幕
+            ch_convert: 中文简繁转换方式
+            cache_ttl: 缓存过期时间（分钟），如果为None则使用默认配置；指定时不返回过期的旧数据
+            
+        Returns:
+            Union[CachedPayload, PayloadStream]: 完整的序列化数据或分块数据
+        """
+        cache_key = (episode_id, with_related, ch_convert)
+        ttl, stale_limit = self._cache_window(cache_ttl)
+        prefetcher.record_access(cache_key)
+        danmaku_demand.record(cache_key)
+        if settings.PREFETCH_ENABLED:
+            self._prefetch_next(episode_id, with_related, ch_convert)
+        
+        if settings.MEMORY_CACHE_ENABLED:
+            cached = danmaku_memory_cache.get(cache_key, ttl)
+            if cached is None and stale_limit > ttl:
+                cached = danmaku_memory_cache.get_stale(cache_key, stale_limit)
+                if cached is not None:
+                    self._refresh_danmaku_in_background(episode_id, with_related, ch_convert)
+            if cached is not None:
+                return cached
+        
+        cached_data = await self._load_danmaku_row(episode_id, with_related, ch_convert, ttl, stale_limit)
+        if cached_data:
+            if (
+                cached_data.payload is not None
+                and (cached_data.payload_size or 0) >= settings.DANMAKU_STREAM_MIN_BYTES
+            ):
+                return PayloadStream(iter_raw(cached_data), cached_data.checksum, cached_data.updated_at)
+            return self._cache_danmaku_row(cache_key, cached_data)
+        
+        relay = ChunkRelay()
+        started = danmaku_flight.start(
+            cache_key,
+            lambda: self._stream_fetch_danmaku(episode_id, with_related, ch_convert, relay)
+        )
+        if not started:
+            # 已有相同的上游请求，等待其写入缓存
+            return await self._get_full_danmaku(episode_id, with_related, ch_convert, cache_ttl)
+        try:
+            await relay.ready
+        except UpstreamUnavailable:
+            payload = await self._load_stale_danmaku(cache_key)
+            if payload is None:
+                raise
+            return payload
+        except BaseException:
+            # 请求已取消或出错，后台任务不再等待客户端读取
+            relay.detach()
+            raise
+        return PayloadStream(relay.iterate())
+
+    async def get_danmaku_batch(
+        self,
+        episode_ids: List[int],
+        with_related: bool = True,
+        ch_convert: int = 0,
+        cache_ttl: Optional[int] = None
+    ) -> AsyncIterator[Tuple[int, Optional[CachedPayload], Optional[str]]]:
+        """
+        批量获取多个节目的完整弹幕数据，按获取完成的顺序返回
+        
+        缓存的节目通过一次数据库查询获取，未缓存的节目并发向上游请求，
+        并发数不超过 DANMAKU_BATCH_CONCURRENCY。
+        
+        Args:
+            episode_ids: 节目编号列表
+            with_related: 是否同时获取关联的第三方弹幕
+            ch_convert: 中文简繁转换方式
+            cache_ttl: 缓存过期时间（分钟），如果为None则使用默认配置；指定时不返回过期的旧数据
             
         Returns:
-            Optional[Dict[str, Any]]: 弹幕数据
+            AsyncIterator[Tuple[int, Optional[CachedPayload], Optional[str]]]:
+                (节目编号, 弹幕数据, 错误信息)，获取失败时弹幕数据为 None
         """
-        # 使用传入的缓存时间或默认配置
-        ttl = timedelta(minutes=cache_ttl) if cache_ttl is not None else self.cache_ttl
+        ttl, stale_limit = self._cache_window(cache_ttl)
+        pending = list(dict.fromkeys(episode_ids))
+        for episode_id in pending:
+            danmaku_demand.record((episode_id, with_related, ch_convert))
+        
+        # 内存缓存
+        if settings.MEMORY_CACHE_ENABLED:
+            missing = []
+            for episode_id in pending:
+                cached = danmaku_memory_cache.get((episode_id, with_related, ch_convert), ttl)
+                if cached is None:
+                    missing.append(episode_id)
+                else:
+                    yield episode_id, cached, None
+            pending = missing
+        
+        # 一次查询数据库缓存
+        if pending:
+            try:
+                stmt = select(DanmakuCache).where(
+                    DanmakuCache.episode_id.in_(pending),
+                    DanmakuCache.with_related == with_related,
+                    DanmakuCache.ch_convert == ch_convert,
+                    DanmakuCache.updated_at >= datetime.now() - stale_limit
+                )
+                rows = (await self.db.execute(stmt)).scalars().all()
+            except Exception as e:
+                logger.error(f"批量获取弹幕缓存时出错: {e}")
+                rows = []
+            for row in rows:
+                if row.updated_at < datetime.now() - ttl:
+                    self._refresh_danmaku_in_background(row.episode_id, with_related, ch_convert)
+                yield row.episode_id, self._cache_danmaku_row((row.episode_id, with_related, ch_convert), row), None
+            cached_ids = {row.episode_id for row in rows}
+            pending = [episode_id for episode_id in pending if episode_id not in cached_ids]
+        
+        if not pending:
+            return
+        logger.info(f"批量获取弹幕: 请求上游={len(pending)}")
+        
+        # 未缓存的节目并发请求上游
+        semaphore = asyncio.Semaphore(settings.DANMAKU_BATCH_CONCURRENCY)
+        
+        async def fetch(episode_id: int) -> Tuple[int, Optional[CachedPayload], Optional[str]]:
+            cache_key = (episode_id, with_related, ch_convert)
+            try:
+                async with semaphore:
+                    try:
+                        payload = await danmaku_flight.do(
+                            cache_key,
+                            lambda: self._fetch_danmaku(episode_id, with_related, ch_convert)
+                        )
+                    except UpstreamUnavailable:
+                        payload = await self._load_stale_danmaku(cache_key)
+                        if payload is None:
+                            raise
+                if payload is None:
+                    async with AsyncSessionLocal() as session:
+                        row = await self._load_danmaku_row(
+                            episode_id, with_related, ch_convert, ttl, stale_limit, session=session
+                        )
+                    if row is None:
+                        return episode_id, None, "读取弹幕缓存失败"
+                    payload = self._cache_danmaku_row(cache_key, row)
+                return episode_id, payload, None
+            except HTTPException as e:
+                return episode_id, None, str(e.detail)
+            except Exception as e:
+                logger.error(f"批量获取弹幕时出错: episode_id={episode_id}, {e}")
+                return episode_id, None, str(e)
         
-        # 首先尝试从缓存获取数据
+        tasks = [asyncio.ensure_future(fetch(episode_id)) for episode_id in pending]
+        try:
+            for completed in asyncio.as_completed(tasks):
+                yield await completed
+        finally:
+            # 调用方提前结束（例如客户端断开）时取消剩余任务，已开始的上游请求仍会完成并写入缓存
+            for task in tasks:
+                task.cancel()
+
+    async def _load_danmaku_row(
+        self,
+        episode_id: int,
+        with_related: bool,
+        ch_convert: int,
+        ttl: timedelta,
+        stale_limit: timedelta,
+        session: Optional[AsyncSession] = None
+    ) -> Optional[DanmakuCache]:
+        """读取可以返回的数据库弹幕缓存，已过期时同时在后台刷新"""
         try:
             stmt = select(DanmakuCache).where(
                 DanmakuCache.episode_id == episode_id,
-                DanmakuCache.updated_at >= datetime.now() - ttl
+                DanmakuCache.with_related == with_related,
+                DanmakuCache.ch_convert == ch_convert,
+                DanmakuCache.updated_at >= datetime.now() - stale_limit
             )
-            result = await self.db.execute(stmt)
+            result = await (session or self.db).execute(stmt)
             cached_data = result.scalar_one_or_none()
-            
-            if cached_data:
-                logger.info(f"从缓存获取弹幕数据: episode_id={episode_id}")
-                return cached_data.data
         except Exception as e:
             logger.error(f"从缓存获取弹幕数据时出错: {e}")
+            return None
+        
+        if cached_data:
+            if cached_data.updated_at >= datetime.now() - ttl:
+                logger.info(f"从缓存获取弹幕数据: episode_id={episode_id}")
+            else:
+                logger.info(f"返回过期的弹幕缓存并后台刷新: episode_id={episode_id}")
+                self._refresh_danmaku_in_background(episode_id, with_related, ch_convert)
+        return cached_data
+
+    async def _load_stale_danmaku(self, cache_key: Tuple[int, bool, int]) -> Optional[CachedPayload]:
+        """上游熔断时读取任意时长的旧弹幕缓存，UPSTREAM_SERVE_STALE 关闭或没有缓存时返回 None"""
+        if not settings.UPSTREAM_SERVE_STALE:
+            return None
+        if settings.MEMORY_CACHE_ENABLED:
+            cached = danmaku_memory_cache.peek(cache_key, timedelta.max)
+            if cached is not None:
+                logger.warning(f"上游不可用，返回过期的内存缓存: episode_id={cache_key[0]}")
+                return cached
+        episode_id, with_related, ch_convert = cache_key
+        try:
+            async with AsyncSessionLocal() as session:
+                stmt = select(DanmakuCache).where(
+                    DanmakuCache.episode_id == episode_id,
+                    DanmakuCache.with_related == with_related,
+                    DanmakuCache.ch_convert == ch_convert
+                )
+                cached_data = (await session.execute(stmt)).scalar_one_or_none()
+        except Exception as e:
+            logger.error(f"读取过期弹幕缓存时出错: {e}")
+            return None
+        if cached_data is None:
+            return None
+        logger.warning(f"上游不可用，返回过期的弹幕缓存: episode_id={episode_id}")
+        return self._cache_danmaku_row(cache_key, cached_data)
+
+    def _cache_danmaku_row(self, cache_key: Tuple[int, bool, int], cached_data: DanmakuCache) -> CachedPayload:
+        """将数据库缓存读取为 CachedPayload 并写入内存缓存"""
+        payload = CachedPayload(load_raw(cached_data), cached_data.checksum, cached_data.updated_at)
+        if settings.MEMORY_CACHE_ENABLED:
+            danmaku_memory_cache.set(
+                cache_key, payload, size=len(payload), updated_at=cached_data.updated_at
+            )
+        return payload
+
+    def _refresh_danmaku_in_background(
+        self,
+        episode_id: int,
+        with_related: bool,
+        ch_convert: int
+    ):
+        """在后台刷新弹幕缓存，与同键的其他上游请求合并；刷新失败后的一段时间内不再刷新"""
+        cache_key = (episode_id, with_related, ch_convert)
+        cooldown = timedelta(seconds=settings.CACHE_REFRESH_FAILURE_COOLDOWN_SECONDS)
+        failed_at = _refresh_failures.get(cache_key)
+        if failed_at is not None and datetime.now() - failed_at < cooldown:
+            return
+
+        async def refresh():
+            try:
+                await danmaku_flight.do(
+                    cache_key,
+                    lambda: self._fetch_danmaku(episode_id, with_related, ch_convert)
+                )
+            except Exception:
+                now = datetime.now()
+                # 清理冷却已结束的记录
+                for key in [key for key, at in _refresh_failures.items() if now - at >= cooldown]:
+                    del _refresh_failures[key]
+                _refresh_failures[cache_key] = now
+                raise
+            _refresh_failures.pop(cache_key, None)
+
+        spawn(refresh(), name=f"refresh-danmaku-{episode_id}")
+
+    async def _fetch_danmaku(
+        self,
+        episode_id: int,
+        with_related: bool,
+        ch_convert: int
+    ) -> Optional[CachedPayload]:
+        """
+        从弹弹play获取节目的完整弹幕数据并写入缓存
+        
+        如果已有缓存且未到全量刷新时间，只向上游请求缓存中最大弹幕编号之后的弹幕并合并到缓存中。
+        启用流式模式时全量获取改为分块读取，数据较大时只写入数据库缓存并返回 None。
+        """
+        cache_key = (episode_id, with_related, ch_convert)
+        await self._check_missing_episode(episode_id)
+        # 读取已有缓存，决定是否可以增量刷新
+        existing_data = None
+        upstream_from = 0
+        try:
+            async with AsyncSessionLocal() as session:
+                stmt = select(DanmakuCache).where(
+                    DanmakuCache.episode_id == episode_id,
+                    DanmakuCache.with_related == with_related,
+                    DanmakuCache.ch_convert == ch_convert
+                )
+                result = await session.execute(stmt)
+                existing_cache = result.scalar_one_or_none()
+            full_refresh_due = datetime.now() - timedelta(minutes=settings.DANMAKU_FULL_REFRESH_MINUTES)
+            if (
+                existing_cache
+                and existing_cache.max_cid
+                and existing_cache.full_refreshed_at
+                and existing_cache.full_refreshed_at >= full_refresh_due
+            ):
+                existing_data = load_payload(existing_cache)
+                upstream_from = existing_cache.max_cid
+        except Exception as e:
+            logger.error(f"读取弹幕缓存以增量刷新时出错: {e}")
+
+        if existing_data is None and settings.DANMAKU_STREAMING:
+            # 全量获取时分块读取并写入缓存，不在内存中保留完整数据
+            return await self._stream_fetch_danmaku(episode_id, with_related, ch_convert)
+
+        url, params, headers = self._danmaku_request(episode_id, with_related, ch_convert, upstream_from)
+        
+        try:
+            response = await comment_upstream.request(
+                self.client,
+                'GET',
+                url,
+                params=params,
+                headers=headers,
+                follow_redirects=True
+            )
+            response.raise_for_status()
+            # 全量获取时直接缓存上游返回的原始字节串
+            body = response.content
+            data = response.json()
+            
+            is_incremental = existing_data is not None
+            if is_incremental:
+                delta_count = len(get_comments(data))
+                data = merge_comments(existing_data, data)
+                body = serialize(data)
+                logger.info(f"增量刷新弹幕数据: episode_id={episode_id}, from={upstream_from}, 新增={delta_count}")
+            max_cid = max_comment_id(data)
+            payload = CachedPayload(body)
+            
+            await self._save_danmaku_cache(
+                episode_id, with_related, ch_convert,
+                lambda row: store_raw(row, body, data=data, checksum=payload.checksum),
+                max_cid, payload.updated_at, full_refresh=not is_incremental
+            )
+            
+            if settings.MEMORY_CACHE_ENABLED:
+                danmaku_memory_cache.set(cache_key, payload, size=len(payload))
+            
+            return payload
+            
+        except HTTPException:
+            raise
+        except httpx.HTTPStatusError as e:
+            raise await self._danmaku_status_error(episode_id, e)
+        except httpx.HTTPError as e:
+            logger.error(f"获取弹幕数据时发生HTTP错误: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
+        except Exception as e:
+            logger.error(f"获取弹幕数据时发生意外错误: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
+
+    async def _stream_fetch_danmaku(
+        self,
+        episode_id: int,
+        with_related: bool,
+        ch_convert: int,
+        relay: Optional[ChunkRelay] = None
+    ) -> Optional[CachedPayload]:
+        """
+        从弹弹play分块读取节目的完整弹幕数据，边读取边压缩写入缓存，并可同时转发给客户端
+        
+        数据不超过 DANMAKU_STREAM_MIN_BYTES 时同时写入内存缓存并返回，否则返回 None，
+        需要时从数据库缓存读取。数据结束时检查结构是否完整，较小的数据完整解码，检查失败时不写入缓存。
+        """
+        try:
+            await self._check_missing_episode(episode_id)
+        except HTTPException as e:
+            if relay is not None:
+                await relay.close(e)
+            raise
+        url, params, headers = self._danmaku_request(episode_id, with_related, ch_convert, 0)
+        writer = PayloadWriter()
+        scanner = CommentIdScanner()
+        # 较小的数据同时保留完整字节串，用于写入内存缓存
+        parts: Optional[List[bytes]] = []
+        
+        try:
+            async with comment_upstream.stream(
+                self.client, 'GET', url, params=params, headers=headers, follow_redirects=True
+            ) as response:
+                response.raise_for_status()
+                if relay is not None:
+                    relay.ready.set_result(None)
+                async for chunk in response.aiter_bytes():
+                    writer.write(chunk)
+                    scanner.feed(chunk)
+                    if parts is not None:
+                        parts.append(chunk)
+                        if writer.size > settings.DANMAKU_STREAM_MIN_BYTES:
+                            parts = None
+                    if relay is not None:
+                        await relay.put(chunk)
+            scanner.close()
+            # 数据不完整时不写入缓存，较小的数据完整解码检查
+            if not scanner.complete:
+                raise ValueError("上游返回的弹幕数据不完整")
+            body = b''.join(parts) if parts is not None else None
+            if body is not None:
+                await asyncio.to_thread(json.loads, body)
+        except Exception as e:
+            if isinstance(e, httpx.HTTPStatusError):
+                error = await self._danmaku_status_error(episode_id, e)
+            else:
+                logger.error(f"流式获取弹幕数据时出错: {e}")
+                error = e if isinstance(e, HTTPException) else HTTPException(status_code=500, detail=str(e))
+            if relay is not None:
+                await relay.close(error)
+            raise error
+        
+        if relay is not None:
+            await relay.close()
+        logger.info(
+            f"流式获取弹幕数据: episode_id={episode_id}, 弹幕数={scanner.count}, 字节数={writer.size}"
+        )
+        
+        now = datetime.now()
+        await self._save_danmaku_cache(
+            episode_id, with_related, ch_convert, writer.store, scanner.max_cid, now, full_refresh=True
+        )
+        
+        if body is None:
+            danmaku_memory_cache.invalidate((episode_id, with_related, ch_convert))
+            return None
+        payload = CachedPayload(body, writer.checksum, now)
+        if settings.MEMORY_CACHE_ENABLED:
+            danmaku_memory_cache.set((episode_id, with_related, ch_convert), payload, size=len(payload))
+        return payload
+
+    async def _check_missing_episode(self, episode_id: int):
+        """上游近期返回404的节目不再请求上游，直接返回404"""
+        async with AsyncSessionLocal() as session:
+            entry = await negative_cache.get(session, DANMAKU, str(episode_id))
+        if entry is not None:
+            raise HTTPException(status_code=entry.status_code or 404, detail=f"节目不存在: {episode_id}")
+
+    async def _danmaku_status_error(self, episode_id: int, error: httpx.HTTPStatusError) -> HTTPException:
+        """将上游的错误状态码转换为返回给客户端的错误，上游返回404时记录节目不存在"""
+        if error.response.status_code == 404:
+            logger.warning(f"上游不存在该节目: episode_id={episode_id}")
+            await negative_cache.put(DANMAKU, str(episode_id), status_code=404)
+            return HTTPException(status_code=404, detail=f"节目不存在: {episode_id}")
+        logger.error(f"获取弹幕数据时发生HTTP错误: {error}")
+        return HTTPException(status_code=500, detail=str(error))
 
-        # 如果缓存不存在或已过期，从API获取数据
+    def _danmaku_request(
+        self,
+        episode_id: int,
+        with_related: bool,
+        ch_convert: int,
+        upstream_from: int
+    ) -> Tuple[str, Dict[str, Any], Dict[str, str]]:
+        """构造获取弹幕的上游请求地址、参数和签名请求头"""
         path = f"/api/v2/comment/{episode_id}"
         signature, timestamp, app_id = generate_signature(path)
         
@@ -70,55 +799,72 @@ class DanmakuProxy:
         }
         
         params = {
-            'from': from_id,
+            'from': upstream_from,
             'withRelated': str(with_related).lower(),
             'chConvert': ch_convert
         }
+        return f"{self.base_url}{path}", params, headers
+
+    async def _save_danmaku_cache(
+        self,
+        episode_id: int,
+        with_related: bool,
+        ch_convert: int,
+        store: Callable[[DanmakuCache], Any],
+        max_cid: int,
+        now: datetime,
+        full_refresh: bool
+    ):
+        """
+        保存弹幕数据到缓存（使用独立会话，合并的请求可能比发起请求的生命周期更长）
         
-        try:
-            response = await self.client.get(
-                f"{self.base_url}{path}",
-                params=params,
-                headers=headers,
-                follow_redirects=True
-            )
-            response.raise_for_status()
-            data = response.json()
-            
-            # 保存到缓存
+        Args:
+            episode_id: 节目编号
+            with_related: 是否包含关联的第三方弹幕
+            ch_convert: 中文简繁转换方式
+            store: 将数据写入缓存记录的函数
+            max_cid: 最大弹幕编号
+            now: 更新时间
+            full_refresh: 是否为全量获取的数据
+        """
+        async with WriteSessionLocal() as session:
             try:
                 # 检查是否已存在缓存
-                stmt = select(DanmakuCache).where(DanmakuCache.episode_id == episode_id)
-                result = await self.db.execute(stmt)
+                stmt = select(DanmakuCache).where(
+                    DanmakuCache.episode_id == episode_id,
+                    DanmakuCache.with_related == with_related,
+                    DanmakuCache.ch_convert == ch_convert
+                )
+                result = await session.execute(stmt)
                 existing_cache = result.scalar_one_or_none()
-                
+            
                 if existing_cache:
-                    # 更新现有缓存
-                    existing_cache.data = data
-                    existing_cache.updated_at = datetime.now()
+                    # 更新现有缓存，弹幕变化后密度统计结果失效
+                    store(existing_cache)
+                    existing_cache.density = None
+                    existing_cache.max_cid = max_cid
+                    existing_cache.updated_at = now
+                    if full_refresh:
+                        existing_cache.full_refreshed_at = now
                     logger.info(f"更新弹幕数据缓存: episode_id={episode_id}")
                 else:
                     # 创建新缓存
                     cache = DanmakuCache(
                         episode_id=episode_id,
-                        data=data
+                        with_related=with_related,
+                        ch_convert=ch_convert,
+                        max_cid=max_cid,
+                        full_refreshed_at=now,
+                        updated_at=now
                     )
-                    self.db.add(cache)
+                    store(cache)
+                    session.add(cache)
                     logger.info(f"创建弹幕数据缓存: episode_id={episode_id}")
-                
-                await self.db.commit()
+            
+                await session.commit()
             except Exception as e:
                 logger.error(f"保存弹幕数据到缓存时出错: {e}")
-                await self.db.rollback()
-            
-            return data
-            
-        except httpx.HTTPError as e:
-            logger.error(f"获取弹幕数据时发生HTTP错误: {e}")
-            raise HTTPException(status_code=500, detail=str(e))
-        except Exception as e:
-            logger.error(f"获取弹幕数据时发生意外错误: {e}")
-            raise HTTPException(status_code=500, detail=str(e))
+                await session.rollback()
 
     async def match_file(
         self,
@@ -161,7 +907,72 @@ class DanmakuProxy:
         except Exception as e:
             logger.error(f"从缓存获取文件匹配记录时出错: {e}")
 
-        # 如果缓存不存在，从API获取数据
+        # 本地匹配模式按文件名在已保存的匹配记录中查找，localFirst 未匹配时再请求上游
+        if match_mode in LOCAL_MATCH_MODES:
+            local = await self._match_locally(file_name, file_size, video_duration)
+            if local is not None:
+                return local
+            if match_mode == 'local':
+                return MatchResponse(isMatched=False, matches=[])
+            match_mode = UPSTREAM_FALLBACK_MODE
+
+        # 近期上游未能匹配的文件直接返回上次的结果
+        negative = await negative_cache.get(self.db, MATCH, file_hash)
+        if negative is not None:
+            logger.info(f"从缓存获取未匹配的文件: {file_name}")
+            return MatchResponse(**(negative.data or {'isMatched': False, 'matches': []}))
+
+        # 如果缓存不存在，从API获取数据，同一文件的并发请求只向上游请求一次
+        return await match_flight.do(
+            file_hash,
+            lambda: self._fetch_match(file_name, file_hash, file_size, video_duration, match_mode)
+        )
+
+    @staticmethod
+    def _is_unmatched(result: Dict[str, Any]) -> bool:
+        """上游正常返回但未能精确匹配（可能带有候选结果）"""
+        return (
+            result.get('success', True)
+            and not result.get('errorCode')
+            and not (result.get('isMatched') and result.get('matches'))
+        )
+
+    async def _match_locally(
+        self,
+        file_name: str,
+        file_size: int,
+        video_duration: int
+    ) -> Optional[MatchResponse]:
+        """按文件名在本地匹配，未启用本地匹配或无法可靠匹配时返回 None"""
+        if not settings.LOCAL_MATCH_ENABLED:
+            return None
+        try:
+            result = await local_matcher.match(file_name, video_duration, file_size)
+        except Exception as e:
+            logger.error(f"本地匹配文件时出错: {e}")
+            return None
+        if result is None:
+            return None
+        logger.info(f"本地匹配文件: {file_name} -> episode_id={result.episode_id}, score={result.score}")
+        return MatchResponse(
+            isMatched=True,
+            matches=[{
+                'episodeId': result.episode_id,
+                'fileName': file_name,
+                'fileSize': file_size,
+                'videoDuration': video_duration
+            }]
+        )
+
+    async def _request_match(
+        self,
+        file_name: str,
+        file_hash: str,
+        file_size: int,
+        video_duration: int,
+        match_mode: str
+    ) -> Dict[str, Any]:
+        """向弹弹play请求文件匹配，返回上游的匹配结果"""
         path = "/api/v2/match"
         signature, timestamp, app_id = generate_signature(path)
         
@@ -180,53 +991,264 @@ class DanmakuProxy:
             'Content-Type': 'application/json'
         }
         
+        # 匹配接口只查询不修改数据，可以安全重试
+        response = await match_upstream.request(
+            self.client,
+            'POST',
+            f"{self.base_url}{path}",
+            idempotent=True,
+            json=data,
+            headers=headers
+        )
+        response.raise_for_status()
+        result = response.json()
+        
+        if not isinstance(result, dict):
+            raise ValueError("Invalid response format")
+        
+        # 确保 matches 字段是列表类型
+        if result.get('matches') is None:
+            result['matches'] = []
+        self._record_catalog(result)
+        return result
+
+    async def match_files(self, files: List[FileMatchRequest]) -> List[BatchMatchResult]:
+        """
+        批量匹配文件：一次查询所有已保存的匹配记录，只将未知的文件发送到上游
+        
+        未知文件先按 MATCH_UPSTREAM_BATCH_SIZE 分组调用弹弹play批量匹配接口，批量接口只返回精确匹配，
+        未能精确匹配的文件再逐个调用普通匹配接口以获取候选结果，上游并发数不超过 MATCH_UPSTREAM_CONCURRENCY。
+        新的匹配记录在一个事务中保存。
+        
+        Args:
+            files: 文件信息列表
+            
+        Returns:
+            List[BatchMatchResult]: 与请求顺序一致的匹配结果
+        """
+        hashes = list(dict.fromkeys(file.file_hash for file in files))
+        
+        # 一次查询已保存的匹配记录（分组查询，避免超过SQLite的参数数量限制）
+        known: Dict[str, FileMatch] = {}
         try:
-            response = await self.client.post(
-                f"{self.base_url}{path}",
-                json=data,
-                headers=headers
+            for i in range(0, len(hashes), 500):
+                stmt = select(FileMatch).where(FileMatch.file_hash.in_(hashes[i:i + 500]))
+                for match in (await self.db.execute(stmt)).scalars():
+                    known[match.file_hash] = match
+        except Exception as e:
+            logger.error(f"批量查询文件匹配记录时出错: {e}")
+        
+        results: Dict[str, MatchResponse] = {
+            file_hash: MatchResponse(
+                isMatched=True,
+                matches=[{
+                    'episodeId': match.episode_id,
+                    'fileName': match.file_name,
+                    'fileSize': match.file_size,
+                    'videoDuration': match.video_duration
+                }]
             )
-            response.raise_for_status()
-            result = response.json()
+            for file_hash, match in known.items()
+        }
+        
+        misses = list({file.file_hash: file for file in files if file.file_hash not in known}.values())
+        
+        # 本地匹配模式的文件先按文件名在本地匹配
+        local_files = [file for file in misses if file.match_mode in LOCAL_MATCH_MODES]
+        if local_files:
+            misses = [file for file in misses if file.match_mode not in LOCAL_MATCH_MODES]
+            for file in local_files:
+                local = await self._match_locally(file.file_name, file.file_size, file.video_duration)
+                if local is not None:
+                    results[file.file_hash] = local
+                elif file.match_mode == 'local':
+                    results[file.file_hash] = MatchResponse(isMatched=False, matches=[])
+                else:
+                    misses.append(file.model_copy(update={'match_mode': UPSTREAM_FALLBACK_MODE}))
+        
+        # 近期上游未能匹配的文件直接返回上次的结果
+        if misses:
+            negative = await negative_cache.get_many(self.db, MATCH, [file.file_hash for file in misses])
+            for file_hash, entry in negative.items():
+                results[file_hash] = MatchResponse(**(entry.data or {'isMatched': False, 'matches': []}))
+            misses = [file for file in misses if file.file_hash not in negative]
+        
+        if misses:
+            logger.info(f"批量匹配文件: 总数={len(hashes)}, 缓存命中={len(known)}, 请求上游={len(misses)}")
+            semaphore = asyncio.Semaphore(settings.MATCH_UPSTREAM_CONCURRENCY)
+            upstream = await self._request_match_batches(misses, semaphore)
             
-            if not isinstance(result, dict):
-                raise ValueError("Invalid response format")
+            async def match_one(file: FileMatchRequest) -> Tuple[str, MatchResponse]:
+                async with semaphore:
+                    try:
+                        result = await self._request_match(
+                            file.file_name, file.file_hash, file.file_size,
+                            file.video_duration, file.match_mode
+                        )
+                        return file.file_hash, MatchResponse(**result)
+                    except Exception as e:
+                        logger.error(f"匹配文件时发生错误: {file.file_name}, {e}")
+                        return file.file_hash, MatchResponse(
+                            errorCode=500,
+                            success=False,
+                            errorMessage=str(e),
+                            isMatched=False,
+                            matches=[]
+                        )
             
-            # 确保 matches 字段是列表类型
-            if result.get('matches') is None:
-                result['matches'] = []
+            results.update(upstream)
+            results.update(await asyncio.gather(*(
+                match_one(file) for file in misses if file.file_hash not in upstream
+            )))
+            await self._save_file_matches(misses, results)
+            for file in misses:
+                result = results[file.file_hash].model_dump()
+                if self._is_unmatched(result):
+                    await negative_cache.put(MATCH, file.file_hash, data=result)
+        
+        return [
+            BatchMatchResult(fileHash=file.file_hash, **results[file.file_hash].model_dump())
+            for file in files
+        ]
+
+    async def _request_match_batches(
+        self,
+        files: List[FileMatchRequest],
+        semaphore: asyncio.Semaphore
+    ) -> Dict[str, MatchResponse]:
+        """
+        调用弹弹play批量匹配接口，返回精确匹配的结果
+        
+        Args:
+            files: 需要匹配的文件
+            semaphore: 限制上游并发数的信号量
+            
+        Returns:
+            Dict[str, MatchResponse]: 文件哈希到匹配结果的映射，只包含精确匹配的文件
+        """
+        path = "/api/v2/match/batch"
+        size = settings.MATCH_UPSTREAM_BATCH_SIZE
+        if size <= 0:
+            return {}
+        
+        async def request(chunk: List[FileMatchRequest]) -> Dict[str, MatchResponse]:
+            signature, timestamp, app_id = generate_signature(path)
+            headers = {
+                'X-AppId': app_id,
+                'X-Timestamp': timestamp,
+                'X-Signature': signature,
+                'Content-Type': 'application/json'
+            }
+            data = {
+                'requests': [
+                    {
+                        'fileName': file.file_name,
+                        'fileHash': file.file_hash,
+                        'fileSize': file.file_size,
+                        'videoDuration': file.video_duration,
+                        'matchMode': file.match_mode
+                    }
+                    for file in chunk
+                ]
+            }
+            async with semaphore:
+                try:
+                    response = await match_upstream.request(
+                        self.client, 'POST', f"{self.base_url}{path}", idempotent=True, json=data, headers=headers
+                    )
+                    response.raise_for_status()
+                    result = response.json()
+                except Exception as e:
+                    # 批量接口失败时由调用方逐个匹配
+                    logger.error(f"批量匹配文件时发生错误: {e}")
+                    return {}
+            
+            matched = {}
+            for item in result.get('results') or []:
+                match_item = item.get('matchResult')
+                if item.get('success') and match_item and item.get('fileHash'):
+                    matched[item['fileHash']] = MatchResponse(isMatched=True, matches=[match_item])
+            self._record_catalog({'matches': [response.matches[0] for response in matched.values()]})
+            return matched
+        
+        matched: Dict[str, MatchResponse] = {}
+        for part in await asyncio.gather(*(
+            request(files[i:i + size]) for i in range(0, len(files), size)
+        )):
+            matched.update(part)
+        return matched
+
+    async def _save_file_matches(self, files: List[FileMatchRequest], results: Dict[str, MatchResponse]):
+        """在一个事务中保存批量匹配成功的文件匹配记录"""
+        rows = []
+        for file in files:
+            result = results.get(file.file_hash)
+            if result is None or not result.isMatched or not result.matches:
+                continue
+            rows.append({
+                'file_hash': file.file_hash,
+                'episode_id': result.matches[0]['episodeId'],
+                'file_name': file.file_name,
+                'file_size': file.file_size,
+                'video_duration': file.video_duration
+            })
+        if not rows:
+            return
+        
+        async with AsyncSessionLocal() as session:
+            try:
+                stmt = sqlite_insert(FileMatch).on_conflict_do_nothing(index_elements=['file_hash'])
+                await session.execute(stmt, rows)
+                await session.commit()
+                logger.info(f"成功保存文件匹配记录: {len(rows)} 条")
+                for row in rows:
+                    local_matcher.add(row['file_name'], row['episode_id'], row['video_duration'], row['file_size'])
+            except Exception as e:
+                logger.error(f"保存文件匹配记录时出错: {e}")
+                await session.rollback()
+
+    async def _fetch_match(
+        self,
+        file_name: str,
+        file_hash: str,
+        file_size: int,
+        video_duration: int,
+        match_mode: str
+    ) -> MatchResponse:
+        """向弹弹play请求文件匹配并保存匹配记录"""
+        try:
+            result = await self._request_match(file_name, file_hash, file_size, video_duration, match_mode)
             
             # 如果匹配成功，保存文件信息到数据库
             if result.get('isMatched') and result.get('matches'):
                 match_item = result['matches'][0]  # 使用第一个匹配结果
-                try:
-                    # 检查是否已存在相同的hash
-                    stmt = select(FileMatch).where(FileMatch.file_hash == file_hash)
-                    existing = await self.db.execute(stmt)
-                    existing_match = existing.scalar_one_or_none()
-                    
-                    if not existing_match:
-                        # 创建新的文件匹配记录
-                        file_match = FileMatch(
+                async with AsyncSessionLocal() as session:
+                    try:
+                        # 已存在相同hash的记录时保持不变
+                        stmt = sqlite_insert(FileMatch).values(
                             file_hash=file_hash,
                             episode_id=match_item['episodeId'],
                             file_name=file_name,
                             file_size=file_size,
                             video_duration=video_duration
-                        )
-                        self.db.add(file_match)
-                        await self.db.commit()
-                        logger.info(f"成功保存文件匹配记录: {file_name}")
-                except Exception as e:
-                    logger.error(f"保存文件匹配记录时出错: {e}")
-                    await self.db.rollback()
+                        ).on_conflict_do_nothing(index_elements=['file_hash'])
+                        inserted = await session.execute(stmt)
+                        await session.commit()
+                        if inserted.rowcount:
+                            logger.info(f"成功保存文件匹配记录: {file_name}")
+                            local_matcher.add(file_name, match_item['episodeId'], video_duration, file_size)
+                    except Exception as e:
+                        logger.error(f"保存文件匹配记录时出错: {e}")
+                        await session.rollback()
+            elif self._is_unmatched(result):
+                await negative_cache.put(MATCH, file_hash, data=result)
                 
             return MatchResponse(**result)
             
         except Exception as e:
             logger.error(f"匹配文件时发生错误: {e}")
             return MatchResponse(
-                errorCode=500,
+                errorCode=e.status_code if isinstance(e, HTTPException) else 500,
                 success=False,
                 errorMessage=str(e),
                 isMatched=False,
@@ -243,8 +1265,10 @@ class DanmakuProxy:
         from_id: int = 0,
         with_related: bool = True,
         ch_convert: int = 0,
-        cache_ttl: Optional[int] = None
-    ) -> Optional[Dict[str, Any]]:
+        cache_ttl: Optional[int] = None,
+        raw: bool = False,
+        prefetch: Optional[bool] = None
+    ) -> Optional[Union[Dict[str, Any], CachedPayload]]:
         """
         通过文件信息匹配节目并获取弹幕数据
         
@@ -257,10 +1281,12 @@ class DanmakuProxy:
             from_id: 起始弹幕编号，忽略此编号以前的弹幕
             with_related: 是否同时获取关联的第三方弹幕
             ch_convert: 中文简繁转换。0-不转换，1-转换为简体，2-转换为繁体
-            cache_ttl: 缓存过期时间（分钟），如果为None则使用默认配置
+            cache_ttl: 缓存过期时间（分钟），如果为None则使用默认配置；指定时不返回过期的旧数据
+            raw: 是否返回序列化后的字节串（CachedPayload）
+            prefetch: 是否在后台预取下一集，如果为None则使用 PREFETCH_ENABLED 配置
             
         Returns:
-            Optional[Dict[str, Any]]: 弹幕数据，如果匹配失败则返回 None
+            Optional[Union[Dict[str, Any], CachedPayload]]: 弹幕数据，如果匹配失败则返回 None
         """
         # 首先进行文件匹配
         match_result = await self.match_file(
@@ -276,29 +1302,84 @@ class DanmakuProxy:
             print(match_result.matches[0])
             episode_id = match_result.matches[0]['episodeId']
             print(episode_id)
-            return await self.get_danmaku(
+            result = await self.get_danmaku(
                 episode_id=episode_id,
                 from_id=from_id,
                 with_related=with_related,
                 ch_convert=ch_convert,
-                cache_ttl=cache_ttl
+                cache_ttl=cache_ttl,
+                raw=raw,
+                prefetch=False
             )
+            # 使用匹配结果中的动画编号校验后预取下一集
+            if settings.PREFETCH_ENABLED if prefetch is None else prefetch:
+                self._prefetch_next(
+                    episode_id, with_related, ch_convert, match_result.matches[0].get('animeId')
+                )
+            return result
         
         logger.warning(f"文件匹配失败: {file_name}")
         return None
 
-    async def search_by_tmdb(self, tmdb_id: int, episode: int) -> Dict[str, Any]:
+    async def search_by_tmdb(
+        self,
+        tmdb_id: int,
+        episode: int,
+        raw: bool = False
+    ) -> Union[Dict[str, Any], CachedPayload]:
         """
         通过TMDB ID搜索动画剧集，支持缓存
         
         Args:
             tmdb_id: TMDB ID
             episode: 集数
+            raw: 是否返回序列化后的字节串（CachedPayload）
             
         Returns:
-            Dict[str, Any]: 搜索结果
+            Union[Dict[str, Any], CachedPayload]: 搜索结果
+        """
+        payload = await self._get_tmdb_payload(tmdb_id, episode)
+        return payload if raw else payload.decode()
+
+    async def get_tmdb_meta(self, tmdb_id: int, episode: int) -> Optional[Tuple[str, datetime]]:
+        """
+        获取TMDB搜索结果缓存的校验和与更新时间，不加载缓存数据，用于条件请求
+        
+        Args:
+            tmdb_id: TMDB ID
+            episode: 集数
+            
+        Returns:
+            Optional[Tuple[str, datetime]]: (校验和, 更新时间)，没有可用缓存时返回 None
         """
-        # 首先尝试从缓存获取数据
+        if settings.MEMORY_CACHE_ENABLED:
+            cached = tmdb_memory_cache.peek((tmdb_id, episode), tmdb_memory_cache.default_ttl)
+            if cached is not None:
+                return cached.checksum, cached.updated_at
+        try:
+            stmt = select(TmdbCache.checksum, TmdbCache.updated_at).where(
+                TmdbCache.tmdb_id == tmdb_id,
+                TmdbCache.episode == episode
+            )
+            row = (await self.db.execute(stmt)).one_or_none()
+            if row and row.checksum:
+                return row.checksum, row.updated_at
+        except Exception as e:
+            logger.error(f"获取TMDB搜索结果缓存元数据时出错: {e}")
+        return None
+
+    async def _get_tmdb_payload(self, tmdb_id: int, episode: int) -> CachedPayload:
+        """按缓存、上游的顺序获取序列化后的TMDB搜索结果"""
+        cache_key = (tmdb_id, episode)
+        
+        # 首先尝试从内存缓存获取数据
+        if settings.MEMORY_CACHE_ENABLED:
+            cached = tmdb_memory_cache.get(cache_key)
+            if cached is not None:
+                logger.debug(f"从内存缓存获取TMDB搜索结果: tmdb_id={tmdb_id}, episode={episode}")
+                return cached
+        
+        # 其次尝试从数据库缓存获取数据
         try:
             stmt = select(TmdbCache).where(
                 TmdbCache.tmdb_id == tmdb_id,
@@ -309,11 +1390,24 @@ class DanmakuProxy:
             
             if cached_data:
                 logger.info(f"从缓存获取TMDB搜索结果: tmdb_id={tmdb_id}, episode={episode}")
-                return cached_data.data
+                payload = CachedPayload(
+                    load_raw(cached_data), cached_data.checksum, cached_data.updated_at
+                )
+                if settings.MEMORY_CACHE_ENABLED:
+                    tmdb_memory_cache.set(cache_key, payload, size=len(payload))
+                return payload
         except Exception as e:
             logger.error(f"从缓存获取TMDB搜索结果时出错: {e}")
 
-        # 如果缓存不存在，从API获取数据
+        # 如果缓存不存在，从API获取数据，并发的相同请求只向上游请求一次
+        return await tmdb_flight.do(
+            cache_key,
+            lambda: self._fetch_tmdb(tmdb_id, episode)
+        )
+
+    async def _fetch_tmdb(self, tmdb_id: int, episode: int) -> CachedPayload:
+        """向弹弹play请求TMDB剧集搜索并写入缓存"""
+        cache_key = (tmdb_id, episode)
         path = f"/api/v2/search/episodes"
         signature, timestamp, app_id = generate_signature(path)
         
@@ -329,7 +1423,9 @@ class DanmakuProxy:
         }
         
         try:
-            response = await self.client.get(
+            response = await search_upstream.request(
+                self.client,
+                'GET',
                 f"{self.base_url}{path}",
                 params=params,
                 headers=headers,
@@ -337,38 +1433,47 @@ class DanmakuProxy:
             )
             response.raise_for_status()
             data = response.json()
+            payload = CachedPayload(response.content)
+            self._record_catalog(data)
 
-            # 保存到缓存
-            try:
-                # 检查是否已存在缓存
-                stmt = select(TmdbCache).where(
-                    TmdbCache.tmdb_id == tmdb_id,
-                    TmdbCache.episode == episode
-                )
-                result = await self.db.execute(stmt)
-                existing_cache = result.scalar_one_or_none()
-                
-                if existing_cache:
-                    # 更新现有缓存
-                    existing_cache.data = data
-                    existing_cache.updated_at = datetime.now()
-                    logger.info(f"更新TMDB搜索结果缓存: tmdb_id={tmdb_id}, episode={episode}")
-                else:
-                    # 创建新缓存
-                    cache = TmdbCache(
-                        tmdb_id=tmdb_id,
-                        episode=episode,
-                        data=data
+            # 保存到缓存（使用独立会话）
+            async with WriteSessionLocal() as session:
+                try:
+                    # 检查是否已存在缓存
+                    stmt = select(TmdbCache).where(
+                        TmdbCache.tmdb_id == tmdb_id,
+                        TmdbCache.episode == episode
                     )
-                    self.db.add(cache)
-                    logger.info(f"创建TMDB搜索结果缓存: tmdb_id={tmdb_id}, episode={episode}")
+                    result = await session.execute(stmt)
+                    existing_cache = result.scalar_one_or_none()
                 
-                await self.db.commit()
-            except Exception as e:
-                logger.error(f"保存TMDB搜索结果到缓存时出错: {e}")
-                await self.db.rollback()
+                    if existing_cache:
+                        # 更新现有缓存
+                        store_raw(existing_cache, payload.body, data=data, checksum=payload.checksum)
+                        existing_cache.updated_at = payload.updated_at
+                        logger.info(f"更新TMDB搜索结果缓存: tmdb_id={tmdb_id}, episode={episode}")
+                    else:
+                        # 创建新缓存
+                        cache = TmdbCache(
+                            tmdb_id=tmdb_id,
+                            episode=episode,
+                            updated_at=payload.updated_at
+                        )
+                        store_raw(cache, payload.body, data=data, checksum=payload.checksum)
+                        session.add(cache)
+                        logger.info(f"创建TMDB搜索结果缓存: tmdb_id={tmdb_id}, episode={episode}")
+                
+                    await session.commit()
+                except Exception as e:
+                    logger.error(f"保存TMDB搜索结果到缓存时出错: {e}")
+                    await session.rollback()
             
-            return data
+            if settings.MEMORY_CACHE_ENABLED:
+                tmdb_memory_cache.set(cache_key, payload, size=len(payload))
+            
+            return payload
+        except HTTPException:
+            raise
         except httpx.HTTPError as e:
             logger.error(f"搜索动画时发生HTTP错误: {e}")
             raise HTTPException(status_code=500, detail=str(e))
@@ -378,7 +1483,7 @@ class DanmakuProxy:
 
     async def search_anime(self, keyword: str, anime_type: Optional[str] = None) -> Dict[str, Any]:
         """
-        根据关键词搜索动画作品
+        根据关键词搜索作品，结果按规范化的关键词和类型缓存
 
         Args:
             keyword: 搜索关键词，至少两个字符
@@ -387,6 +1492,73 @@ class DanmakuProxy:
         Returns:
             Dict[str, Any]: 搜索结果
         """
+        return (await self._get_search_payload(keyword, anime_type)).decode()
+
+    async def _get_search_payload(self, keyword: str, anime_type: Optional[str]) -> CachedPayload:
+        """按内存缓存、数据库缓存、上游的顺序获取序列化后的搜索结果"""
+        cache_key = search_cache_key(keyword, anime_type)
+        ttl = timedelta(minutes=settings.SEARCH_CACHE_EXPIRE_MINUTES)
+
+        # 首先尝试从内存缓存获取数据
+        if settings.MEMORY_CACHE_ENABLED:
+            cached = search_memory_cache.get(cache_key, ttl)
+            if cached is not None:
+                search_metrics.memory_hits += 1
+                return cached
+
+        # 其次尝试从数据库缓存获取数据，过期的记录在上游不可用时仍可返回
+        cached_data = None
+        try:
+            stmt = select(AnimeSearchCache).where(
+                AnimeSearchCache.keyword == cache_key[0],
+                AnimeSearchCache.anime_type == cache_key[1]
+            )
+            cached_data = (await self.db.execute(stmt)).scalar_one_or_none()
+        except Exception as e:
+            logger.error(f"从缓存获取搜索结果时出错: {e}")
+        if cached_data and cached_data.updated_at >= datetime.now() - ttl:
+            search_metrics.db_hits += 1
+            return self._cache_search_row(cache_key, cached_data)
+
+        # 近期上游没有结果的搜索直接返回上次的结果
+        negative = await negative_cache.get(self.db, SEARCH, '\t'.join(cache_key))
+        if negative is not None:
+            return CachedPayload.from_data(negative.data)
+
+        # 近期的搜索结果可以代替上游回答时不请求上游
+        if settings.SEARCH_LOCAL_FIRST:
+            try:
+                local = await search_local(self.db, keyword, anime_type)
+            except Exception as e:
+                logger.error(f"从近期的搜索结果筛选作品时出错: {e}")
+                local = None
+            if local is not None:
+                search_metrics.local_hits += 1
+                return CachedPayload.from_data(local)
+
+        # 如果缓存不存在或已过期，从API获取数据，并发的相同搜索只向上游请求一次
+        search_metrics.misses += 1
+        try:
+            return await search_flight.do(cache_key, lambda: self._fetch_search(keyword, anime_type))
+        except UpstreamUnavailable:
+            if cached_data is None or not settings.UPSTREAM_SERVE_STALE:
+                raise
+            logger.warning(f"上游不可用，返回过期的搜索结果缓存: keyword={cache_key[0]}")
+            search_metrics.stale_hits += 1
+            return self._cache_search_row(cache_key, cached_data)
+
+    def _cache_search_row(self, cache_key: Tuple[str, str], cached_data: AnimeSearchCache) -> CachedPayload:
+        """将数据库缓存读取为 CachedPayload 并写入内存缓存"""
+        payload = CachedPayload(load_raw(cached_data), cached_data.checksum, cached_data.updated_at)
+        if settings.MEMORY_CACHE_ENABLED:
+            search_memory_cache.set(
+                cache_key, payload, size=len(payload), updated_at=cached_data.updated_at
+            )
+        return payload
+
+    async def _fetch_search(self, keyword: str, anime_type: Optional[str]) -> CachedPayload:
+        """向弹弹play请求关键词搜索，上游使用用户输入的关键词，成功的结果按规范化的关键词写入缓存"""
+        cache_key = search_cache_key(keyword, anime_type)
         path = "/api/v2/search/anime"
         signature, timestamp, app_id = generate_signature(path)
 
@@ -401,14 +1573,19 @@ class DanmakuProxy:
         }
 
         try:
-            response = await self.client.get(
+            response = await search_upstream.request(
+                self.client,
+                'GET',
                 f"{self.base_url}{path}",
                 params=params,
                 headers=headers,
                 follow_redirects=True
             )
             response.raise_for_status()
-            return response.json()
+            data = response.json()
+            payload = CachedPayload(response.content)
+        except HTTPException:
+            raise
         except httpx.HTTPError as e:
             logger.error(f"搜索作品时发生HTTP错误: {e}")
             raise HTTPException(status_code=500, detail=str(e))
@@ -416,6 +1593,85 @@ class DanmakuProxy:
             logger.error(f"搜索作品时发生意外错误: {e}")
             raise HTTPException(status_code=500, detail=str(e))
 
+        # 上游返回错误时不缓存，没有结果时只在较短的时间内缓存
+        if not data.get('success', True):
+            return payload
+        if not data.get('animes'):
+            await negative_cache.put(SEARCH, '\t'.join(cache_key), data=data)
+            return payload
+        self._record_catalog(data)
+
+        # 保存到缓存（使用独立会话）
+        async with WriteSessionLocal() as session:
+            try:
+                stmt = select(AnimeSearchCache).where(
+                    AnimeSearchCache.keyword == cache_key[0],
+                    AnimeSearchCache.anime_type == cache_key[1]
+                )
+                existing_cache = (await session.execute(stmt)).scalar_one_or_none()
+                if existing_cache:
+                    store_raw(existing_cache, payload.body, data=data, checksum=payload.checksum)
+                    existing_cache.updated_at = payload.updated_at
+                else:
+                    cache = AnimeSearchCache(
+                        keyword=cache_key[0],
+                        anime_type=cache_key[1],
+                        updated_at=payload.updated_at
+                    )
+                    store_raw(cache, payload.body, data=data, checksum=payload.checksum)
+                    session.add(cache)
+                await session.commit()
+                logger.info(f"缓存搜索结果: keyword={cache_key[0]}, type={cache_key[1] or '-'}")
+            except Exception as e:
+                logger.error(f"保存搜索结果到缓存时出错: {e}")
+                await session.rollback()
+
+        if settings.MEMORY_CACHE_ENABLED:
+            search_memory_cache.set(cache_key, payload, size=len(payload))
+        return payload
+
+    async def suggest_anime(
+        self,
+        keyword: str,
+        limit: int = 10,
+        anime_type: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        根据关键词从本地作品目录联想作品，不请求上游
+
+        Args:
+            keyword: 输入中的关键词
+            limit: 最多返回的作品数
+            anime_type: 限定的作品类型，可选
+
+        Returns:
+            List[Dict[str, Any]]: 作品列表，标题以关键词开头的排在前面
+        """
+        try:
+            rows = await find_animes(self.db, keyword, limit, anime_type)
+        except Exception as e:
+            logger.error(f"从本地目录联想作品时出错: {e}")
+            return []
+        return [
+            {
+                'animeId': row.anime_id,
+                'animeTitle': row.title,
+                'type': row.type,
+                'typeDescription': row.type_description,
+                'episodeCount': row.episode_count,
+                'imageUrl': row.image_url
+            }
+            for row in rows
+        ]
+
+    def _record_catalog(self, data: Dict[str, Any]):
+        """在后台将上游返回的作品和剧集写入本地目录"""
+        if settings.CATALOG_ENABLED:
+            spawn(record_catalog(data), name="record-catalog")
+
     async def close(self):
-        """关闭HTTP客户端"""
-        await self.client.aclose()
+        """
+        兼容旧调用方式保留的接口。共享HTTP客户端由应用生命周期负责关闭，
+        命令行脚本可调用 app.services.http_client.close_http_client() 释放连接
+        """
+        return None
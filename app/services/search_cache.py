@@ -0,0 +1,49 @@
+import re
+import unicodedata
+from typing import Any, Dict, Optional, Tuple
+
+# 连续的空白字符
+_WHITESPACE = re.compile(r'\s+')
+
+def normalize_keyword(keyword: str) -> str:
+    """
+    规范化搜索关键词：Unicode NFKC（全角转半角等）、大小写折叠、合并连续空白
+
+    Args:
+        keyword: 原始关键词
+
+    Returns:
+        str: 规范化后的关键词，写法不同但含义相同的关键词得到相同的结果
+    """
+    keyword = unicodedata.normalize('NFKC', keyword).casefold()
+    return _WHITESPACE.sub(' ', keyword).strip()
+
+def search_cache_key(keyword: str, anime_type: Optional[str] = None) -> Tuple[str, str]:
+    """搜索结果的缓存键，与 AnimeSearchCache 一致：(规范化的关键词, 作品类型)"""
+    return normalize_keyword(keyword), anime_type or ''
+
+class SearchCacheMetrics:
+    """关键词搜索缓存各层的命中统计"""
+
+    def __init__(self):
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.stale_hits = 0
+        self.local_hits = 0
+        self.misses = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """获取命中统计信息"""
+        hits = self.memory_hits + self.db_hits + self.stale_hits + self.local_hits
+        total = hits + self.misses
+        return {
+            'memory_hits': self.memory_hits,
+            'db_hits': self.db_hits,
+            'stale_hits': self.stale_hits,
+            'local_hits': self.local_hits,
+            'misses': self.misses,
+            'hit_rate': round(hits / total, 4) if total else 0.0
+        }
+
+# 全局搜索缓存统计
+search_metrics = SearchCacheMetrics()
@@ -0,0 +1,91 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+# 配置日志记录器
+logger = logging.getLogger(__name__)
+
+class SingleFlight:
+    """
+    按键合并并发请求：同一个键同时只执行一次加载函数，其余调用者等待并共享结果
+    
+    加载函数在独立的任务中执行，发起者被取消（例如客户端断开）不会影响其他等待者。
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._flights: Dict[Hashable, asyncio.Task] = {}
+        self.executions = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        执行或加入指定键的加载任务
+        
+        Args:
+            key: 合并请求的键
+            fn: 加载函数，仅在当前没有同键任务时调用
+            
+        Returns:
+            Any: 加载函数的结果，异常会传递给所有等待者
+        """
+        task = self._flights.get(key)
+        if task is None:
+            task = self._launch(key, fn)
+        else:
+            self.coalesced += 1
+            logger.debug(f"合并并发请求: {self.name} key={key}")
+        return await asyncio.shield(task)
+
+    def start(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> bool:
+        """
+        在没有同键任务时启动加载任务但不等待结果，之后同键的 do 调用会等待该任务
+        
+        Args:
+            key: 合并请求的键
+            fn: 加载函数
+            
+        Returns:
+            bool: 是否启动了新任务，已有同键任务时返回 False
+        """
+        if key in self._flights:
+            return False
+        self._launch(key, fn)
+        return True
+
+    def _launch(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> asyncio.Task:
+        """启动加载任务并在完成后移除"""
+        self.executions += 1
+        task = asyncio.ensure_future(fn())
+        self._flights[key] = task
+        task.add_done_callback(lambda _: self._flights.pop(key, None))
+        # 没有等待者时也读取异常，避免 "exception was never retrieved" 警告
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return task
+
+    def stats(self) -> Dict[str, Any]:
+        """获取请求合并统计信息"""
+        return {
+            'name': self.name,
+            'in_flight': len(self._flights),
+            'executions': self.executions,
+            'coalesced': self.coalesced
+        }
+
+# 弹幕获取，键为上游请求参数
+danmaku_flight = SingleFlight('danmaku')
+
+# 弹幕时间索引构建，键为 (episode_id, with_related, ch_convert, checksum)
+index_flight = SingleFlight('danmaku_index')
+
+# 文件匹配，键为 file_hash
+match_flight = SingleFlight('match')
+
+# TMDB搜索，键为 (tmdb_id, episode)
+tmdb_flight = SingleFlight('tmdb')
+
+# 统计面板数据，键为统计的小时数
+stats_flight = SingleFlight('stats')
+
+# 关键词搜索作品，键为 (规范化的关键词, 作品类型)
+search_flight = SingleFlight('search')
@@ -0,0 +1,337 @@
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta, UTC
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence
+from sqlalchemy import select, delete, func
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.routing import BaseRoute, Match
+from ..config import settings
+from app.models.api_stats import ApiStats, ApiStatsRollup, ApiLatencyHistogram, ApiEpisodeRollup
+from app.utils.histogram import latency_bin, percentiles
+
+# 配置日志记录器
+logger = logging.getLogger(__name__)
+
+# 预聚合的时间粒度
+RESOLUTIONS = ('minute', 'hour')
+
+# 获取弹幕的路由模板，按节目统计请求次数
+DANMAKU_ROUTE = '/api/v1/{episode_id}'
+_DANMAKU_PREFIX = DANMAKU_ROUTE[:DANMAKU_ROUTE.index('{')]
+
+# 补充预聚合数据时每批读取的原始记录数
+BACKFILL_BATCH_SIZE = 5000
+
+def utcnow() -> datetime:
+    """当前UTC时间（不带时区，与数据库中的时间一致）"""
+    return datetime.now(UTC).replace(tzinfo=None)
+
+def truncate(timestamp: datetime, resolution: str) -> datetime:
+    """
+    将时间截断到聚合时间段的起点
+    
+    Args:
+        timestamp: 调用时间，带时区时先转换为UTC
+        resolution: 聚合粒度，minute 或 hour
+        
+    Returns:
+        datetime: 时间段起点（UTC，不带时区）
+    """
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(UTC).replace(tzinfo=None)
+    if resolution == 'hour':
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    return timestamp.replace(second=0, microsecond=0)
+
+async def apply_rollups(session: AsyncSession, records: Iterable[Dict[str, Any]]):
+    """
+    将一批API调用记录累加到预聚合表中，使用 UPSERT 原子累加，不需要先读取旧值
+    
+    获取弹幕的请求另外按小时累加各节目的请求次数。
+    
+    Args:
+        session: 数据库会话，由调用方提交
+        records: API调用记录，字段与 ApiStats 一致，另外可包含路由模板 route
+    """
+    rollups = defaultdict(lambda: [0, 0, 0, 0])
+    histogram = defaultdict(int)
+    episodes = defaultdict(int)
+    for record in records:
+        endpoint = (record.get('route') or record['endpoint'])[:100]
+        status_code = record['status_code']
+        response_time = record['response_time']
+        is_error = status_code >= 400 or record.get('error') is not None
+        for resolution in RESOLUTIONS:
+            bucket = truncate(record['timestamp'], resolution)
+            values = rollups[(resolution, bucket, endpoint, status_code)]
+            values[0] += 1
+            values[1] += 1 if is_error else 0
+            values[2] += response_time
+            values[3] = max(values[3], response_time)
+            histogram[(resolution, bucket, endpoint, latency_bin(response_time))] += 1
+        if record.get('route') == DANMAKU_ROUTE and record.get('method') == 'GET':
+            episode = record['endpoint'][len(_DANMAKU_PREFIX):]
+            if episode.isascii() and episode.isdigit():
+                episodes[(truncate(record['timestamp'], 'hour'), int(episode))] += 1
+
+    if not rollups:
+        return
+
+    stmt = sqlite_insert(ApiStatsRollup)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['resolution', 'bucket', 'endpoint', 'status_code'],
+        set_={
+            'count': ApiStatsRollup.count + stmt.excluded.count,
+            'error_count': ApiStatsRollup.error_count + stmt.excluded.error_count,
+            'total_time': ApiStatsRollup.total_time + stmt.excluded.total_time,
+            'max_time': func.max(ApiStatsRollup.max_time, stmt.excluded.max_time)
+        }
+    )
+    await session.execute(stmt, [
+        {
+            'resolution': resolution,
+            'bucket': bucket,
+            'endpoint': endpoint,
+            'status_code': status_code,
+            'count': count,
+            'error_count': error_count,
+            'total_time': total_time,
+            'max_time': max_time
+        }
+        for (resolution, bucket, endpoint, status_code), (count, error_count, total_time, max_time)
+        in rollups.items()
+    ])
+
+    stmt = sqlite_insert(ApiLatencyHistogram)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['resolution', 'bucket', 'endpoint', 'bin'],
+        set_={'count': ApiLatencyHistogram.count + stmt.excluded.count}
+    )
+    await session.execute(stmt, [
+        {'resolution': resolution, 'bucket': bucket, 'endpoint': endpoint, 'bin': index, 'count': count}
+        for (resolution, bucket, endpoint, index), count in histogram.items()
+    ])
+
+    if episodes:
+        stmt = sqlite_insert(ApiEpisodeRollup)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['bucket', 'episode_id'],
+            set_={'count': ApiEpisodeRollup.count + stmt.excluded.count}
+        )
+        await session.execute(stmt, [
+            {'bucket': bucket, 'episode_id': episode_id, 'count': count}
+            for (bucket, episode_id), count in episodes.items()
+        ])
+
+def route_resolver(routes: Sequence[BaseRoute]) -> Callable[[str, str], Optional[str]]:
+    """
+    按应用的路由表将请求路径转换为路由模板，与请求时中间件记录的路由一致
+    
+    Args:
+        routes: 应用的路由列表
+        
+    Returns:
+        Callable[[str, str], Optional[str]]: 接收请求路径和HTTP方法，没有匹配的路由时返回 None
+    """
+    def resolve(path: str, method: str) -> Optional[str]:
+        scope = {'type': 'http', 'path': path, 'method': method or 'GET'}
+        for route in routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return getattr(route, 'path', None)
+        return None
+    return resolve
+
+async def backfill_rollups(
+    session: AsyncSession,
+    route_of: Optional[Callable[[str, str], Optional[str]]] = None
+) -> int:
+    """
+    将启用预聚合之前保存的原始记录累加到预聚合表中
+    
+    只处理最早的小时级预聚合数据所在小时之前的记录，这些记录从未累加过，因此重复执行不会重复累加。
+    多个工作进程同时启动时应在写事务中执行，由写锁保证只有一个进程补充。
+    
+    Args:
+        session: 数据库会话，由调用方提交
+        route_of: 将请求路径和HTTP方法转换为路由模板的函数，未提供或无法转换时使用请求路径
+        
+    Returns:
+        int: 补充的原始记录数
+    """
+    cutoff = (await session.execute(
+        select(func.min(ApiStatsRollup.bucket)).where(ApiStatsRollup.resolution == 'hour')
+    )).scalar()
+    conditions = [
+        ApiStats.timestamp.is_not(None),
+        ApiStats.status_code.is_not(None),
+        ApiStats.response_time.is_not(None)
+    ]
+    if cutoff is not None:
+        conditions.append(ApiStats.timestamp < cutoff)
+
+    total = 0
+    last_id = 0
+    while True:
+        rows = (await session.execute(
+            select(
+                ApiStats.id, ApiStats.endpoint, ApiStats.method, ApiStats.status_code,
+                ApiStats.response_time, ApiStats.timestamp, ApiStats.error
+            )
+            .where(ApiStats.id > last_id, *conditions)
+            .order_by(ApiStats.id)
+            .limit(BACKFILL_BATCH_SIZE)
+        )).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        await apply_rollups(session, [
+            {
+                'route': route_of(row.endpoint, row.method) if route_of and row.endpoint else None,
+                'endpoint': row.endpoint or '',
+                'method': row.method,
+                'status_code': row.status_code,
+                'response_time': row.response_time,
+                'timestamp': row.timestamp,
+                'error': row.error
+            }
+            for row in rows
+        ])
+        total += len(rows)
+    return total
+
+async def purge_expired(session: AsyncSession) -> Dict[str, int]:
+    """
+    按保留策略清理原始记录和过期的预聚合数据：原始记录和分钟级数据只保留较短时间，
+    之后只保留小时级数据
+    
+    Args:
+        session: 数据库会话，由调用方提交
+        
+    Returns:
+        Dict[str, int]: 各类数据删除的行数
+    """
+    now = utcnow()
+    deleted = {}
+    result = await session.execute(
+        delete(ApiStats).where(
+            ApiStats.timestamp < now - timedelta(hours=settings.API_STATS_RAW_RETENTION_HOURS)
+        )
+    )
+    deleted['raw'] = result.rowcount
+    retention = {
+        'minute': timedelta(hours=settings.API_STATS_MINUTE_RETENTION_HOURS),
+        'hour': timedelta(days=settings.API_STATS_HOUR_RETENTION_DAYS)
+    }
+    for resolution, keep in retention.items():
+        count = 0
+        for model in (ApiStatsRollup, ApiLatencyHistogram):
+            result = await session.execute(
+                delete(model).where(model.resolution == resolution, model.bucket < now - keep)
+            )
+            count += result.rowcount
+        deleted[resolution] = count
+    result = await session.execute(
+        delete(ApiEpisodeRollup).where(ApiEpisodeRollup.bucket < now - retention['hour'])
+    )
+    deleted['hour'] += result.rowcount
+    return deleted
+
+async def load_dashboard(session: AsyncSession, hours: int = 24) -> Dict[str, Any]:
+    """
+    从小时级预聚合数据读取统计面板所需的数据，查询量只与时间段和端点数量有关
+    
+    Args:
+        session: 数据库会话
+        hours: 统计最近多少小时
+        
+    Returns:
+        Dict[str, Any]: 包含 endpoints、hourly、status、summary 的统计数据
+    """
+    start = truncate(utcnow(), 'hour') - timedelta(hours=hours - 1)
+    in_window = (ApiStatsRollup.resolution == 'hour', ApiStatsRollup.bucket >= start)
+
+    rows = (await session.execute(
+        select(
+            ApiStatsRollup.endpoint,
+            ApiStatsRollup.status_code,
+            func.sum(ApiStatsRollup.count),
+            func.sum(ApiStatsRollup.error_count),
+            func.sum(ApiStatsRollup.total_time),
+            func.max(ApiStatsRollup.max_time)
+        )
+        .where(*in_window)
+        .group_by(ApiStatsRollup.endpoint, ApiStatsRollup.status_code)
+    )).all()
+
+    hourly_rows = (await session.execute(
+        select(ApiStatsRollup.bucket, func.sum(ApiStatsRollup.count))
+        .where(*in_window)
+        .group_by(ApiStatsRollup.bucket)
+        .order_by(ApiStatsRollup.bucket)
+    )).all()
+
+    histogram_rows = (await session.execute(
+        select(ApiLatencyHistogram.endpoint, ApiLatencyHistogram.bin, func.sum(ApiLatencyHistogram.count))
+        .where(ApiLatencyHistogram.resolution == 'hour', ApiLatencyHistogram.bucket >= start)
+        .group_by(ApiLatencyHistogram.endpoint, ApiLatencyHistogram.bin)
+    )).all()
+
+    endpoints: Dict[str, Dict[str, Any]] = {}
+    status: Dict[int, int] = defaultdict(int)
+    for endpoint, status_code, count, error_count, total_time, max_time in rows:
+        item = endpoints.setdefault(endpoint, {
+            'endpoint': endpoint, 'count': 0, 'error_count': 0, 'total_time': 0, 'max_time': 0
+        })
+        item['count'] += count
+        item['error_count'] += error_count
+        item['total_time'] += total_time
+        item['max_time'] = max(item['max_time'], max_time)
+        status[status_code] += count
+
+    bins_by_endpoint: Dict[str, Dict[int, int]] = defaultdict(dict)
+    all_bins: Dict[int, int] = defaultdict(int)
+    for endpoint, index, count in histogram_rows:
+        bins_by_endpoint[endpoint][index] = count
+        all_bins[index] += count
+
+    quantiles = (0.5, 0.95, 0.99)
+    endpoint_list: List[Dict[str, Any]] = []
+    for endpoint, item in sorted(endpoints.items()):
+        p50, p95, p99 = percentiles(bins_by_endpoint.get(endpoint, {}), quantiles)
+        endpoint_list.append({
+            'endpoint': endpoint,
+            'count': item['count'],
+            'error_count': item['error_count'],
+            'avg_response_time': round(item['total_time'] / item['count'], 2) if item['count'] else 0,
+            'max_response_time': item['max_time'],
+            'p50': p50,
+            'p95': p95,
+            'p99': p99
+        })
+
+    total_requests = sum(item['count'] for item in endpoints.values())
+    total_time = sum(item['total_time'] for item in endpoints.values())
+    error_count = sum(item['error_count'] for item in endpoints.values())
+    p50, p95, p99 = percentiles(all_bins, quantiles)
+    return {
+        'endpoints': endpoint_list,
+        'hourly': [
+            {'hour': bucket.strftime('%Y-%m-%d %H:00:00'), 'count': count}
+            for bucket, count in hourly_rows
+        ],
+        'status': [
+            {'status_code': status_code, 'count': count}
+            for status_code, count in sorted(status.items())
+        ],
+        'summary': {
+            'total_requests': total_requests,
+            'avg_response_time': round(total_time / total_requests, 2) if total_requests else 0,
+            'error_count': error_count,
+            'error_rate': round(error_count / (total_requests or 1) * 100, 2),
+            'p50': p50,
+            'p95': p95,
+            'p99': p99
+        }
+    }
@@ -0,0 +1,156 @@
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Sequence
+from sqlalchemy import insert
+from starlette.routing import BaseRoute
+from ..config import settings
+from app.database import AsyncSessionLocal, WriteSessionLocal
+from app.models.api_stats import ApiStats
+from .stats_rollup import apply_rollups, backfill_rollups, purge_expired, route_resolver
+
+# 配置日志记录器
+logger = logging.getLogger(__name__)
+
+# 通知后台任务写入剩余记录并退出的标记
+_STOP = object()
+
+class ApiStatsWriter:
+    """
+    API调用统计的后台批量写入器
+    
+    请求只把记录放入有界内存队列，由后台任务按数量或时间批量写入数据库，
+    队列已满时丢弃记录并计数，不会阻塞请求。
+    """
+
+    def __init__(self, max_queue_size: int, batch_size: int, flush_interval: float):
+        self.max_queue_size = max_queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._purge_task: Optional[asyncio.Task] = None
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def record(self, item: Dict[str, Any]):
+        """
+        记录一次API调用，写入器未启动或队列已满时丢弃
+        
+        Args:
+            item: ApiStats 的列值
+        """
+        if self._queue is None:
+            self.dropped += 1
+            return
+        try:
+            self._queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    async def start(self):
+        """启动后台写入任务"""
+        if self._task is not None:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._task = asyncio.create_task(self._run(), name="api-stats-writer")
+        self._purge_task = asyncio.create_task(self._purge_loop(), name="api-stats-purge")
+        logger.info("API统计写入器已启动")
+
+    async def stop(self):
+        """停止后台写入任务，队列中剩余的记录会在退出前写入"""
+        if self._task is None:
+            return
+        self._purge_task.cancel()
+        try:
+            await self._purge_task
+        except asyncio.CancelledError:
+            pass
+        self._purge_task = None
+        queue, self._queue = self._queue, None
+        await queue.put(_STOP)
+        await self._task
+        self._task = None
+        logger.info("API统计写入器已停止")
+
+    async def _run(self):
+        """按批量大小或刷新间隔写入记录，收到停止标记时写入剩余记录后退出"""
+        queue = self._queue
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+
+    async def backfill(self, routes: Sequence[BaseRoute]):
+        """将启用预聚合之前的原始记录补充到预聚合表中，统计面板只读取预聚合数据"""
+        try:
+            async with WriteSessionLocal() as session:
+                count = await backfill_rollups(session, route_resolver(routes))
+                await session.commit()
+            if count:
+                logger.info(f"已将 {count} 条API调用原始记录补充到预聚合数据")
+        except Exception as e:
+            logger.error(f"补充API统计预聚合数据时出错: {e}")
+
+    async def _purge_loop(self):
+        """定期按保留策略清理过期的统计数据"""
+        while True:
+            await asyncio.sleep(settings.API_STATS_PURGE_INTERVAL_MINUTES * 60)
+            try:
+                async with AsyncSessionLocal() as session:
+                    deleted = await purge_expired(session)
+                    await session.commit()
+                if any(deleted.values()):
+                    logger.info(f"已清理过期的API统计数据: {deleted}")
+            except Exception as e:
+                logger.error(f"清理过期的API统计数据时出错: {e}")
+
+    async def _flush(self, batch: List[Dict[str, Any]]):
+        """在一个事务中批量写入原始记录并累加预聚合数据"""
+        if not batch:
+            return
+        try:
+            async with AsyncSessionLocal() as session:
+                if settings.API_STATS_KEEP_RAW:
+                    rows = [{k: v for k, v in item.items() if k != 'route'} for item in batch]
+                    await session.execute(insert(ApiStats), rows)
+                await apply_rollups(session, batch)
+                await session.commit()
+            self.written += len(batch)
+        except Exception as e:
+            self.failed += len(batch)
+            logger.error(f"批量写入API统计时出错: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        """获取写入器统计信息"""
+        return {
+            'queued': self._queue.qsize() if self._queue is not None else 0,
+            'max_queue_size': self.max_queue_size,
+            'written': self.written,
+            'dropped': self.dropped,
+            'failed': self.failed
+        }
+
+# 全局API统计写入器，由应用生命周期启动和停止
+stats_writer = ApiStatsWriter(
+    settings.API_STATS_QUEUE_SIZE,
+    settings.API_STATS_BATCH_SIZE,
+    settings.API_STATS_FLUSH_INTERVAL
+)
@@ -0,0 +1,250 @@
+import gzip
+import json
+import zlib
+import hashlib
+import logging
+from datetime import datetime
+from typing import Any, Iterator, List, Optional
+from ..config import settings
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# 配置日志记录器
+logger = logging.getLogger(__name__)
+
+# 支持的缓存存储格式
+SUPPORTED_FORMATS = ('json', 'gzip', 'zstd')
+
+def serialize(data: Any) -> bytes:
+    """将数据序列化为紧凑的UTF-8 JSON字节串"""
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+def resolve_format(fmt: Optional[str] = None) -> str:
+    """
+    确定实际使用的存储格式，zstd 不可用时退回 gzip
+    
+    Args:
+        fmt: 期望的存储格式，如果为None则使用配置
+        
+    Returns:
+        str: 实际使用的存储格式
+    """
+    fmt = (fmt or settings.CACHE_STORAGE_FORMAT).lower()
+    if fmt not in SUPPORTED_FORMATS:
+        raise ValueError(f"不支持的缓存存储格式: {fmt}")
+    if fmt == 'zstd' and zstandard is None:
+        logger.warning("未安装 zstandard，缓存存储格式退回 gzip")
+        return 'gzip'
+    return fmt
+
+def compress(raw: bytes, encoding: str) -> bytes:
+    """按存储格式压缩序列化数据"""
+    level = settings.CACHE_COMPRESSION_LEVEL
+    if encoding == 'gzip':
+        return gzip.compress(raw, compresslevel=level if level is not None else 6)
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=level if level is not None else 3).compress(raw)
+    raise ValueError(f"不支持的压缩格式: {encoding}")
+
+def decompress(payload: bytes, encoding: str) -> bytes:
+    """按存储格式解压数据"""
+    if encoding == 'gzip':
+        return gzip.decompress(payload)
+    if encoding == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("缓存数据使用 zstd 压缩，但未安装 zstandard")
+        return zstandard.ZstdDecompressor().decompress(payload)
+    raise ValueError(f"不支持的压缩格式: {encoding}")
+
+class CachedPayload:
+    """
+    缓存中序列化后的JSON数据，可以不经解码直接作为响应体返回
+    """
+    __slots__ = ('body', 'checksum', 'updated_at')
+
+    def __init__(
+        self,
+        body: bytes,
+        checksum: Optional[str] = None,
+        updated_at: Optional[datetime] = None
+    ):
+        self.body = body
+        self.checksum = checksum or hashlib.sha256(body).hexdigest()
+        self.updated_at = updated_at or datetime.now()
+
+    @classmethod
+    def from_data(cls, data: Any) -> "CachedPayload":
+        """由已解码的数据构造"""
+        return cls(serialize(data))
+
+    def decode(self) -> Any:
+        """解码为Python对象"""
+        return json.loads(self.body)
+
+    def __len__(self) -> int:
+        return len(self.body)
+
+def store_raw(
+    row: Any,
+    raw: bytes,
+    fmt: Optional[str] = None,
+    data: Any = None,
+    checksum: Optional[str] = None
+) -> int:
+    """
+    将序列化后的JSON数据写入缓存记录（DanmakuCache 或 TmdbCache）
+    
+    Args:
+        row: 缓存记录
+        raw: 序列化后的JSON字节串
+        fmt: 存储格式，如果为None则使用配置
+        data: 已解码的数据，json 格式存储时使用，为None时从 raw 解码
+        checksum: 已计算的校验和，为None时重新计算
+        
+    Returns:
+        int: 序列化后未压缩的字节数
+    """
+    encoding = resolve_format(fmt)
+    if encoding == 'json':
+        row.data = data if data is not None else json.loads(raw)
+        row.payload = None
+    else:
+        row.data = None
+        row.payload = compress(raw, encoding)
+    row.encoding = encoding
+    row.payload_size = len(raw)
+    row.checksum = checksum or hashlib.sha256(raw).hexdigest()
+    return len(raw)
+
+def store_payload(row: Any, data: Any, fmt: Optional[str] = None) -> int:
+    """
+    将数据序列化后写入缓存记录
+    
+    Args:
+        row: 缓存记录
+        data: 需要存储的数据
+        fmt: 存储格式，如果为None则使用配置
+        
+    Returns:
+        int: 序列化后未压缩的字节数
+    """
+    return store_raw(row, serialize(data), fmt, data)
+
+class PayloadWriter:
+    """
+    分块写入的缓存数据：边接收边压缩并计算校验和，不需要在内存中保留完整的序列化数据
+    
+    json 格式需要解码后写入 JSON 列，只能在结束时一次性处理，因此仍会保留完整数据。
+    """
+
+    def __init__(self, fmt: Optional[str] = None):
+        self.encoding = resolve_format(fmt)
+        self.size = 0
+        self._hash = hashlib.sha256()
+        self._parts: List[bytes] = []
+        level = settings.CACHE_COMPRESSION_LEVEL
+        if self.encoding == 'gzip':
+            # wbits=31 生成 gzip 格式，与 gzip.decompress 兼容
+            self._compressor = zlib.compressobj(level if level is not None else 6, zlib.DEFLATED, 31)
+        elif self.encoding == 'zstd':
+            self._compressor = zstandard.ZstdCompressor(level=level if level is not None else 3).compressobj()
+        else:
+            self._compressor = None
+
+    def write(self, chunk: bytes):
+        """写入一块序列化数据"""
+        self.size += len(chunk)
+        self._hash.update(chunk)
+        if self._compressor is None:
+            self._parts.append(chunk)
+        else:
+            compressed = self._compressor.compress(chunk)
+            if compressed:
+                self._parts.append(compressed)
+
+    @property
+    def checksum(self) -> str:
+        """已写入数据的校验和"""
+        return self._hash.hexdigest()
+
+    def store(self, row: Any) -> int:
+        """
+        结束写入并保存到缓存记录（DanmakuCache 或 TmdbCache）
+        
+        Args:
+            row: 缓存记录
+            
+        Returns:
+            int: 序列化后未压缩的字节数
+        """
+        if self._compressor is None:
+            return store_raw(row, b''.join(self._parts), self.encoding, checksum=self.checksum)
+        self._parts.append(self._compressor.flush())
+        self._compressor = None
+        row.data = None
+        row.payload = b''.join(self._parts)
+        row.encoding = self.encoding
+        row.payload_size = self.size
+        row.checksum = self.checksum
+        return self.size
+
+def iter_raw(row: Any, chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+    """
+    分块解压缓存记录中的序列化数据，内存中只保留压缩数据和当前块
+    
+    Args:
+        row: 缓存记录
+        chunk_size: 每次解压的压缩数据字节数
+        
+    Returns:
+        Iterator[bytes]: 序列化后的JSON字节串分块
+    """
+    if row.payload is None or row.encoding not in ('gzip', 'zstd'):
+        yield load_raw(row)
+        return
+    payload = row.payload
+    if row.encoding == 'gzip':
+        decompressor = zlib.decompressobj(31)
+    else:
+        if zstandard is None:
+            raise RuntimeError("缓存数据使用 zstd 压缩，但未安装 zstandard")
+        decompressor = zstandard.ZstdDecompressor().decompressobj()
+    for offset in range(0, len(payload), chunk_size):
+        chunk = decompressor.decompress(payload[offset:offset + chunk_size])
+        if chunk:
+            yield chunk
+    if row.encoding == 'gzip':
+        tail = decompressor.flush()
+        if tail:
+            yield tail
+
+def load_raw(row: Any) -> bytes:
+    """
+    读取缓存记录中序列化后的JSON字节串，压缩存储时只解压不解码
+    
+    Args:
+        row: 缓存记录
+        
+    Returns:
+        bytes: 序列化后的JSON字节串
+    """
+    if row.payload is not None and row.encoding in ('gzip', 'zstd'):
+        return decompress(row.payload, row.encoding)
+    return serialize(row.data)
+
+def load_payload(row: Any) -> Any:
+    """
+    读取缓存记录中的数据，兼容旧版只有 JSON 列的记录
+    
+    Args:
+        row: 缓存记录
+        
+    Returns:
+        Any: 缓存数据
+    """
+    if row.payload is not None and row.encoding in ('gzip', 'zstd'):
+        return json.loads(decompress(row.payload, row.encoding))
+    return row.data
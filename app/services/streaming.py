@@ -0,0 +1,96 @@
+import asyncio
+from collections import deque
+from datetime import datetime
+from typing import AsyncIterator, Deque, Iterable, Optional, Union
+
+# 上游数据结束的标记
+_END = object()
+
+# 客户端超过此时间（秒）没有读取时不再等待客户端
+RELAY_PUT_TIMEOUT = 10.0
+
+class PayloadStream:
+    """
+    分块返回的序列化数据，用于 StreamingResponse
+
+    从上游边读取边返回时校验和与更新时间还不确定，此时均为 None。
+    """
+    __slots__ = ('chunks', 'checksum', 'updated_at')
+
+    def __init__(
+        self,
+        chunks: Union[Iterable[bytes], AsyncIterator[bytes]],
+        checksum: Optional[str] = None,
+        updated_at: Optional[datetime] = None
+    ):
+        self.chunks = chunks
+        self.checksum = checksum
+        self.updated_at = updated_at
+
+class ChunkRelay:
+    """
+    将后台任务从上游读取的数据块转发给发起请求的客户端
+
+    队列有界，客户端读取较慢时上游读取也随之等待，内存占用与数据总大小无关。
+    客户端断开后后台任务继续读取并写入缓存，只是不再转发。
+    客户端超过 put_timeout 秒没有读取时（例如响应尚未开始发送客户端就已断开），
+    不再等待客户端，之后的数据缓存在内存中，保证后台任务能够读取完成并写入缓存。
+    """
+
+    def __init__(self, max_chunks: int = 16, put_timeout: float = RELAY_PUT_TIMEOUT):
+        self._chunks: Deque = deque()
+        self._max_chunks = max_chunks
+        self._put_timeout = put_timeout
+        self._available = asyncio.Event()
+        self._space = asyncio.Event()
+        # 上游返回响应头后完成，上游请求失败时设置异常，用于在发送响应前返回错误状态码
+        self.ready: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.detached = False
+        self.buffering = False
+
+    def _append(self, item):
+        if not self.detached:
+            self._chunks.append(item)
+            self._available.set()
+
+    async def put(self, chunk: bytes):
+        """转发一块数据，客户端已断开时丢弃"""
+        while not self.detached and not self.buffering and len(self._chunks) >= self._max_chunks:
+            self._space.clear()
+            try:
+                await asyncio.wait_for(self._space.wait(), self._put_timeout)
+            except asyncio.TimeoutError:
+                self.buffering = True
+        self._append(chunk)
+
+    async def close(self, error: Optional[BaseException] = None):
+        """数据结束或读取出错，通知客户端"""
+        if not self.ready.done():
+            if error is not None:
+                self.ready.set_exception(error)
+                return
+            self.ready.set_result(None)
+        self._append(error if error is not None else _END)
+
+    def detach(self):
+        """客户端不再读取，丢弃已转发的数据并释放等待写入的后台任务"""
+        self.detached = True
+        self._chunks.clear()
+        self._space.set()
+
+    async def iterate(self) -> AsyncIterator[bytes]:
+        """按顺序读取转发的数据块"""
+        try:
+            while True:
+                while not self._chunks:
+                    self._available.clear()
+                    await self._available.wait()
+                item = self._chunks.popleft()
+                self._space.set()
+                if item is _END:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            self.detach()
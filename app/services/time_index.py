@@ -0,0 +1,139 @@
+from bisect import bisect_left, bisect_right
+from typing import Any, Dict, List, Optional, Tuple
+from .comments import get_comments
+from .storage import CachedPayload, serialize
+
+def comment_time(comment: Dict[str, Any]) -> float:
+    """
+    获取弹幕出现的播放时间（秒），即 p 字段的第一项
+
+    Args:
+        comment: 弹幕，p 字段格式为 "时间,模式,颜色,用户"
+
+    Returns:
+        float: 播放时间，无法解析时返回 0
+    """
+    try:
+        return float(str(comment.get('p', '')).split(',', 1)[0])
+    except ValueError:
+        return 0.0
+
+class TimeWindow:
+    """
+    按播放时间截取和分页的参数
+
+    游标为上一页最后一条弹幕的 "时间:弹幕编号"，按 (时间, 弹幕编号) 排序分页，
+    缓存刷新后继续翻页也不会重复或遗漏。
+    """
+    __slots__ = ('start', 'end', 'after', 'limit')
+
+    def __init__(
+        self,
+        start: Optional[float] = None,
+        end: Optional[float] = None,
+        cursor: Optional[str] = None,
+        limit: Optional[int] = None
+    ):
+        self.start = start
+        self.end = end
+        self.after = decode_cursor(cursor) if cursor else None
+        self.limit = limit
+
+    def key(self) -> str:
+        """用于派生校验和的参数字符串"""
+        after = encode_cursor(self.after) if self.after else ''
+        return f"{self.start}:{self.end}:{after}:{self.limit}"
+
+def encode_cursor(key: Tuple[float, int]) -> str:
+    """将 (时间, 弹幕编号) 编码为游标"""
+    return f"{key[0]!r}:{key[1]}"
+
+def decode_cursor(cursor: str) -> Tuple[float, int]:
+    """
+    解析游标
+
+    Raises:
+        ValueError: 游标格式错误
+    """
+    time, _, cid = cursor.partition(':')
+    return float(time), int(cid)
+
+class TimeIndex:
+    """
+    按播放时间排序的弹幕索引，每条弹幕预先序列化，截取时只需二分查找和拼接字节串
+
+    索引与构建时的完整数据校验和绑定，缓存刷新后校验和变化，索引随之重建。
+    """
+    __slots__ = ('checksum', 'keys', 'comments', 'cids', 'size')
+
+    def __init__(self, checksum: str, entries: List[Tuple[float, int, bytes]]):
+        entries.sort(key=lambda entry: (entry[0], entry[1]))
+        self.checksum = checksum
+        self.keys = [(time, cid) for time, cid, _ in entries]
+        self.cids = [cid for _, cid, _ in entries]
+        self.comments = [body for _, _, body in entries]
+        # 估算内存占用：序列化数据加上每条索引的固定开销
+        self.size = sum(len(body) for body in self.comments) + 120 * len(entries)
+
+    def window(self, window: TimeWindow, from_id: int = 0) -> Tuple[List[bytes], Optional[str]]:
+        """
+        截取时间范围 [start, end) 内、游标之后的弹幕
+
+        Args:
+            window: 时间范围和分页参数
+            from_id: 起始弹幕编号，忽略此编号以前的弹幕
+
+        Returns:
+            Tuple[List[bytes], Optional[str]]: 序列化后的弹幕列表和下一页的游标，没有下一页时为 None
+        """
+        lo = 0 if window.start is None else bisect_left(self.keys, (window.start, float('-inf')))
+        hi = len(self.keys) if window.end is None else bisect_left(self.keys, (window.end, float('-inf')))
+        if window.after is not None:
+            lo = max(lo, bisect_right(self.keys, window.after))
+
+        if from_id > 0:
+            positions = [i for i in range(lo, hi) if self.cids[i] >= from_id]
+        else:
+            positions = range(lo, hi)
+
+        next_cursor = None
+        if window.limit is not None and len(positions) > window.limit:
+            positions = positions[:window.limit]
+            next_cursor = encode_cursor(self.keys[positions[-1]])
+        return [self.comments[i] for i in positions], next_cursor
+
+    def render(self, window: TimeWindow, from_id: int = 0) -> bytes:
+        """
+        截取弹幕并序列化为与上游相同的格式，有下一页时附加 nextCursor 字段
+
+        Args:
+            window: 时间范围和分页参数
+            from_id: 起始弹幕编号
+
+        Returns:
+            bytes: 序列化后的JSON字节串
+        """
+        comments, next_cursor = self.window(window, from_id)
+        body = b'{"count":%d,"comments":[' % len(comments) + b','.join(comments) + b']'
+        if next_cursor is not None:
+            body += b',"nextCursor":' + serialize(next_cursor)
+        return body + b'}'
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+def build_time_index(payload: CachedPayload) -> TimeIndex:
+    """
+    由完整的序列化弹幕数据构建时间索引
+
+    Args:
+        payload: 完整弹幕数据
+
+    Returns:
+        TimeIndex: 时间索引
+    """
+    entries = [
+        (comment_time(comment), comment.get('cid', 0), serialize(comment))
+        for comment in get_comments(payload.decode())
+    ]
+    return TimeIndex(payload.checksum, entries)
@@ -0,0 +1,390 @@
+import httpx
+import asyncio
+import random
+import time
+import logging
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional
+from fastapi import HTTPException
+from ..config import settings
+
+# 配置日志记录器
+logger = logging.getLogger(__name__)
+
+# 可以重试、并计为上游故障的状态码
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# 熔断器状态
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+class UpstreamUnavailable(HTTPException):
+    """上游熔断或排队超时，不发出请求直接失败"""
+
+    def __init__(self, detail: str, retry_after: float):
+        super().__init__(
+            status_code=503,
+            detail=detail,
+            headers={'Retry-After': str(max(int(retry_after + 0.5), 1))}
+        )
+
+class TokenBucket:
+    """
+    令牌桶限速：每秒补充 rate 个令牌，最多积累 burst 个
+
+    等待令牌的请求按先后顺序获取，rate 不大于0时不限速。
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.capacity = max(burst, 1)
+        self.tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        """获取一个令牌，令牌不足时等待"""
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            self._refill()
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+    def available(self) -> float:
+        """当前可用的令牌数"""
+        if self.rate <= 0:
+            return float(self.capacity)
+        self._refill()
+        return round(self.tokens, 2)
+
+class CircuitBreaker:
+    """
+    熔断器：连续失败达到阈值后打开，打开期间直接拒绝请求；
+    经过 reset_timeout 后进入半开状态，只放行一个探测请求，成功则关闭，失败则重新打开。
+    """
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        # 进入各状态的次数和各状态下放行的请求数
+        self.transitions = {CLOSED: 0, OPEN: 0, HALF_OPEN: 0}
+        self.allowed = {CLOSED: 0, HALF_OPEN: 0}
+        self.rejected = 0
+
+    def _transition(self, state: str):
+        if state != self.state:
+            logger.warning(f"上游熔断器状态变化: {self.name} {self.state} -> {state}")
+            self.state = state
+            self.transitions[state] += 1
+
+    def retry_after(self) -> float:
+        """熔断器打开时距离下一次探测的秒数"""
+        return max(self.opened_at + self.reset_timeout - time.monotonic(), 0.0)
+
+    def allow(self) -> bool:
+        """
+        判断是否放行请求，放行半开状态的探测请求后需调用 record_success 或 record_failure
+
+        半开状态只放行一个探测请求，所以放行后状态仍为半开即表示本次调用取得了探测名额。
+        """
+        if self.failure_threshold <= 0:
+            return True
+        if self.state == OPEN and self.retry_after() <= 0:
+            self._transition(HALF_OPEN)
+        if self.state == OPEN or (self.state == HALF_OPEN and self._probing):
+            self.rejected += 1
+            return False
+        if self.state == HALF_OPEN:
+            self._probing = True
+        self.allowed[self.state] += 1
+        return True
+
+    def record_success(self):
+        self.failures = 0
+        self._probing = False
+        self._transition(CLOSED)
+
+    def record_failure(self):
+        self.failures += 1
+        self._probing = False
+        if self.state == HALF_OPEN or (
+            self.failure_threshold > 0 and self.failures >= self.failure_threshold
+        ):
+            self.opened_at = time.monotonic()
+            self._transition(OPEN)
+
+    def release(self):
+        """探测请求被取消时释放半开状态的探测名额，只能由取得探测名额的调用方调用"""
+        self._probing = False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'state': self.state,
+            'consecutive_failures': self.failures,
+            'retry_after': round(self.retry_after(), 1) if self.state == OPEN else 0,
+            'transitions': dict(self.transitions),
+            'allowed': dict(self.allowed),
+            'rejected': self.rejected
+        }
+
+class UpstreamEndpoint:
+    """
+    一类上游接口的流量控制：令牌桶限速、同时进行的请求数上限、熔断器，以及幂等请求的退避重试
+    """
+
+    def __init__(self, name: str, rate: float, burst: int, max_in_flight: int):
+        self.name = name
+        self.bucket = TokenBucket(rate, burst)
+        self.max_in_flight = max_in_flight
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+        self.breaker = CircuitBreaker(
+            name,
+            settings.UPSTREAM_BREAKER_FAILURE_THRESHOLD,
+            settings.UPSTREAM_BREAKER_RESET_SECONDS
+        )
+        self.in_flight = 0
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self.queue_timeouts = 0
+
+    def _check_breaker(self) -> bool:
+        """检查熔断器，返回本次请求是否取得了半开状态的探测名额"""
+        if not self.breaker.allow():
+            raise UpstreamUnavailable(
+                f"上游服务暂时不可用: {self.name}", self.breaker.retry_after()
+            )
+        return self.breaker.state == HALF_OPEN
+
+    async def _admit(self):
+        """
+        等待并发名额和令牌，超过 UPSTREAM_QUEUE_TIMEOUT 时放弃
+
+        先占用并发名额再取令牌，令牌在等待结束后才扣除，排队超时或被取消时不会消耗令牌。
+        """
+        acquired = False
+
+        async def wait():
+            nonlocal acquired
+            await self._semaphore.acquire()
+            acquired = True
+            await self.bucket.acquire()
+        try:
+            await asyncio.wait_for(wait(), settings.UPSTREAM_QUEUE_TIMEOUT)
+        except BaseException as e:
+            if acquired:
+                self._semaphore.release()
+            if isinstance(e, asyncio.TimeoutError):
+                self.queue_timeouts += 1
+                raise UpstreamUnavailable(f"上游请求排队超时: {self.name}", settings.UPSTREAM_QUEUE_TIMEOUT)
+            raise
+        self.in_flight += 1
+
+    async def _enter(self) -> bool:
+        """检查熔断器后等待放行，返回是否为探测请求；排队超时或被取消时释放本次取得的探测名额"""
+        probe = self._check_breaker()
+        try:
+            await self._admit()
+        except BaseException:
+            if probe:
+                self.breaker.release()
+            raise
+        return probe
+
+    def _release(self):
+        self.in_flight -= 1
+        self._semaphore.release()
+
+    def _backoff(self, attempt: int, response: Optional[httpx.Response]) -> float:
+        """第 attempt 次重试前的等待时间：指数退避加全抖动，优先使用上游的 Retry-After"""
+        if response is not None:
+            retry_after = response.headers.get('Retry-After', '')
+            if retry_after.isdigit():
+                return min(float(retry_after), settings.UPSTREAM_RETRY_MAX_DELAY)
+        delay = min(settings.UPSTREAM_RETRY_BASE_DELAY * (2 ** attempt), settings.UPSTREAM_RETRY_MAX_DELAY)
+        return random.uniform(0, delay)
+
+    def _max_attempts(self, idempotent: bool) -> int:
+        """最多尝试次数，非幂等请求只尝试一次"""
+        return settings.UPSTREAM_MAX_RETRIES + 1 if idempotent else 1
+
+    async def _wait_retry(
+        self,
+        attempt: int,
+        url: str,
+        response: Optional[httpx.Response],
+        error: Optional[Exception]
+    ):
+        """记录重试并等待退避时间"""
+        self.retries += 1
+        delay = self._backoff(attempt, response)
+        logger.warning(
+            f"上游请求失败，{delay:.2f}秒后重试: {self.name} {url} "
+            f"{error if error is not None else response.status_code}"
+        )
+        await asyncio.sleep(delay)
+
+    def _record(self, response: Optional[httpx.Response], error: Optional[Exception]) -> bool:
+        """记录一次请求结果，返回是否为可重试的上游故障"""
+        if error is not None or response.status_code in RETRY_STATUS_CODES:
+            self.failures += 1
+            self.breaker.record_failure()
+            return True
+        self.breaker.record_success()
+        return False
+
+    async def request(
+        self,
+        client: httpx.AsyncClient,
+        method: str,
+        url: str,
+        idempotent: Optional[bool] = None,
+        **kwargs
+    ) -> httpx.Response:
+        """
+        发送上游请求，上游返回 429/5xx 或网络错误时按指数退避重试幂等请求
+
+        Args:
+            client: HTTP客户端
+            method: 请求方法
+            url: 请求地址
+            idempotent: 是否可以安全重试，默认 GET 请求可以重试
+            **kwargs: 传给 httpx 的其他参数
+
+        Returns:
+            httpx.Response: 最后一次请求的响应，状态码由调用方检查
+
+        Raises:
+            UpstreamUnavailable: 熔断器打开或排队超时
+        """
+        if idempotent is None:
+            idempotent = method.upper() == 'GET'
+        attempts = self._max_attempts(idempotent)
+        for attempt in range(attempts):
+            probe = await self._enter()
+            response, error = None, None
+            try:
+                self.requests += 1
+                response = await client.request(method, url, **kwargs)
+            except httpx.TransportError as e:
+                error = e
+            except BaseException:
+                if probe:
+                    self.breaker.release()
+                raise
+            finally:
+                self._release()
+            if not self._record(response, error) or attempt == attempts - 1:
+                if error is not None:
+                    raise error
+                return response
+            await self._wait_retry(attempt, url, response, error)
+
+    @asynccontextmanager
+    async def stream(
+        self,
+        client: httpx.AsyncClient,
+        method: str,
+        url: str,
+        idempotent: Optional[bool] = None,
+        **kwargs
+    ) -> AsyncIterator[httpx.Response]:
+        """
+        以流式方式发送上游请求，读取响应期间占用并发名额
+
+        只在收到响应头之前重试，开始读取响应体后的错误由调用方处理。
+        """
+        if idempotent is None:
+            idempotent = method.upper() == 'GET'
+        follow_redirects = kwargs.pop('follow_redirects', False)
+        attempts = self._max_attempts(idempotent)
+        for attempt in range(attempts):
+            probe = await self._enter()
+            response, error = None, None
+            try:
+                self.requests += 1
+                request = client.build_request(method, url, **kwargs)
+                response = await client.send(request, stream=True, follow_redirects=follow_redirects)
+            except httpx.TransportError as e:
+                error = e
+            except BaseException:
+                self._release()
+                if probe:
+                    self.breaker.release()
+                raise
+            retry = self._record(response, error) and attempt < attempts - 1
+            if not retry and error is None:
+                try:
+                    yield response
+                finally:
+                    await response.aclose()
+                    self._release()
+                return
+            if response is not None:
+                await response.aclose()
+            self._release()
+            if not retry:
+                raise error
+            await self._wait_retry(attempt, url, response, error)
+
+    def stats(self) -> Dict[str, Any]:
+        """获取流量控制统计信息"""
+        return {
+            'name': self.name,
+            'in_flight': self.in_flight,
+            'max_in_flight': self.max_in_flight,
+            'tokens': self.bucket.available(),
+            'requests': self.requests,
+            'retries': self.retries,
+            'failures': self.failures,
+            'queue_timeouts': self.queue_timeouts,
+            'breaker': self.breaker.stats()
+        }
+
+def _per_worker(name: str, rate: float, burst: int, max_in_flight: int) -> UpstreamEndpoint:
+    """配置的限速是整个服务的上限，多个工作进程时按进程数平分"""
+    workers = max(settings.WEB_CONCURRENCY, 1)
+    return UpstreamEndpoint(
+        name,
+        rate / workers,
+        max(burst // workers, 1),
+        max(max_in_flight // workers, 1)
+    )
+
+# 弹幕获取 /api/v2/comment
+comment_upstream = _per_worker(
+    'comment',
+    settings.UPSTREAM_COMMENT_RATE,
+    settings.UPSTREAM_COMMENT_BURST,
+    settings.UPSTREAM_COMMENT_MAX_IN_FLIGHT
+)
+
+# 文件匹配 /api/v2/match
+match_upstream = _per_worker(
+    'match',
+    settings.UPSTREAM_MATCH_RATE,
+    settings.UPSTREAM_MATCH_BURST,
+    settings.UPSTREAM_MATCH_MAX_IN_FLIGHT
+)
+
+# 搜索 /api/v2/search/*
+search_upstream = _per_worker(
+    'search',
+    settings.UPSTREAM_SEARCH_RATE,
+    settings.UPSTREAM_SEARCH_BURST,
+    settings.UPSTREAM_SEARCH_MAX_IN_FLIGHT
+)
@@ -0,0 +1,52 @@
+import math
+from typing import Dict, Iterable, List
+
+# 相邻区间上界的比例，对应约10%的相对误差（HDR直方图的对数分桶）
+GROWTH = 1.1
+_LOG_GROWTH = math.log(GROWTH)
+
+def latency_bin(value_ms: float) -> int:
+    """
+    计算响应时间所在的区间编号，区间0为小于1毫秒，区间i（i>=1）为 [GROWTH^(i-1), GROWTH^i)
+    
+    Args:
+        value_ms: 响应时间（毫秒）
+        
+    Returns:
+        int: 区间编号
+    """
+    if value_ms < 1:
+        return 0
+    return int(math.log(value_ms) / _LOG_GROWTH) + 1
+
+def bin_upper_bound(index: int) -> float:
+    """获取区间的上界（毫秒）"""
+    return GROWTH ** index
+
+def percentiles(bins: Dict[int, int], quantiles: Iterable[float]) -> List[float]:
+    """
+    根据合并后的直方图计算分位数
+    
+    Args:
+        bins: 区间编号到调用次数的映射
+        quantiles: 需要计算的分位数，例如 (0.5, 0.95, 0.99)
+        
+    Returns:
+        List[float]: 各分位数对应的响应时间（毫秒，取区间上界），没有数据时为0
+    """
+    total = sum(bins.values())
+    if total == 0:
+        return [0.0 for _ in quantiles]
+    ordered = sorted(bins.items())
+    results = []
+    for q in quantiles:
+        rank = q * total
+        seen = 0
+        value = bin_upper_bound(ordered[-1][0])
+        for index, count in ordered:
+            seen += count
+            if seen >= rank:
+                value = bin_upper_bound(index)
+                break
+        results.append(round(value, 2))
+    return results
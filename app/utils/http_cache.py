@@ -0,0 +1,76 @@
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Dict, Optional
+from fastapi import Request
+from fastapi.responses import Response
+
+def make_etag(checksum: str) -> str:
+    """由数据校验和生成强ETag"""
+    return f'"{checksum}"'
+
+def to_utc(value: datetime) -> datetime:
+    """将数据库中的时间（不带时区时视为本地时间）转换为UTC时间"""
+    return value.astimezone(timezone.utc)
+
+def cache_headers(
+    checksum: str,
+    updated_at: Optional[datetime],
+    max_age: Optional[int] = None
+) -> Dict[str, str]:
+    """
+    生成HTTP缓存相关的响应头
+    
+    Args:
+        checksum: 数据校验和
+        updated_at: 数据更新时间
+        max_age: Cache-Control 的 max-age（秒），为None时不发送 Cache-Control
+        
+    Returns:
+        Dict[str, str]: 响应头
+    """
+    headers = {'ETag': make_etag(checksum)}
+    if max_age is not None:
+        headers['Cache-Control'] = f'public, max-age={max_age}' if max_age > 0 else 'no-cache'
+    if updated_at is not None:
+        headers['Last-Modified'] = format_datetime(to_utc(updated_at), usegmt=True)
+    return headers
+
+def has_conditional_headers(request: Request) -> bool:
+    """请求是否带有条件请求头"""
+    return 'if-none-match' in request.headers or 'if-modified-since' in request.headers
+
+def is_not_modified(request: Request, checksum: str, updated_at: Optional[datetime]) -> bool:
+    """
+    根据 If-None-Match 和 If-Modified-Since 判断客户端缓存是否仍然有效
+    
+    存在 If-None-Match 时忽略 If-Modified-Since（RFC 9110）。
+    
+    Args:
+        request: 请求
+        checksum: 当前数据的校验和
+        updated_at: 当前数据的更新时间
+        
+    Returns:
+        bool: 客户端缓存有效时返回 True
+    """
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match is not None:
+        etag = make_etag(checksum)
+        candidates = [tag.strip() for tag in if_none_match.split(',')]
+        # 弱比较：忽略 W/ 前缀
+        return '*' in candidates or any(tag.removeprefix('W/') == etag for tag in candidates)
+
+    if_modified_since = request.headers.get('if-modified-since')
+    if if_modified_since and updated_at is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        return to_utc(updated_at).replace(microsecond=0) <= since
+    return False
+
+def not_modified_response(headers: Dict[str, str]) -> Response:
+    """生成 304 Not Modified 响应"""
+    return Response(status_code=304, headers=headers)
@@ -0,0 +1,83 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+from typing import Any, Dict, List
+from sqlalchemy import select
+from app.database import init_db, AsyncSessionLocal, close_db
+from app.models.file_match import FileMatch
+from app.services.local_match import LocalMatchIndex
+
+def load_corpus(path: str) -> List[Dict[str, Any]]:
+    """读取标注语料，每行一个JSON对象：file_name、episode_id，可选 video_duration、file_size"""
+    corpus = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                corpus.append(json.loads(line))
+    return corpus
+
+async def load_file_matches() -> List[Dict[str, Any]]:
+    """使用已保存的文件匹配记录作为标注语料"""
+    await init_db()
+    try:
+        async with AsyncSessionLocal() as session:
+            rows = (await session.execute(select(
+                FileMatch.file_name, FileMatch.episode_id, FileMatch.video_duration, FileMatch.file_size
+            ))).all()
+        return [row._asdict() for row in rows if row.file_name and row.episode_id]
+    finally:
+        await close_db()
+
+def benchmark(corpus: List[Dict[str, Any]], test_ratio: float, seed: int):
+    """将语料随机分为索引部分和测试部分，统计测试部分的匹配精确率和查找延迟"""
+    random.Random(seed).shuffle(corpus)
+    split = int(len(corpus) * (1 - test_ratio))
+    train, test = corpus[:split], corpus[split:]
+
+    started = time.perf_counter()
+    index = LocalMatchIndex()
+    for item in train:
+        index.add(item['file_name'], item['episode_id'], item.get('video_duration') or 0, item.get('file_size') or 0)
+    build_ms = (time.perf_counter() - started) * 1000
+
+    answered = correct = inferred = inferred_correct = 0
+    latencies: List[float] = []
+    for item in test:
+        started = time.perf_counter()
+        result = index.lookup(item['file_name'], item.get('video_duration') or 0, item.get('file_size') or 0)
+        latencies.append((time.perf_counter() - started) * 1000)
+        if result is None:
+            continue
+        answered += 1
+        hit = result.episode_id == item['episode_id']
+        correct += hit
+        if result.inferred:
+            inferred += 1
+            inferred_correct += hit
+
+    latencies.sort()
+    p50, p95, p99 = (latencies[min(int(q * len(latencies)), len(latencies) - 1)] if latencies else 0.0
+                     for q in (0.5, 0.95, 0.99))
+    print(f"语料: {len(corpus)} 条，索引: {len(train)} 条（{build_ms:.0f}ms），测试: {len(test)} 条")
+    print(f"已匹配: {answered} 条，覆盖率: {answered / len(test):.2%}" if test else "测试集为空")
+    if answered:
+        print(f"精确率: {correct / answered:.2%}（{correct}/{answered}）")
+    if inferred:
+        print(f"其中推算的集数: {inferred} 条，精确率: {inferred_correct / inferred:.2%}")
+    print(f"查找延迟: p50={p50:.3f}ms, p95={p95:.3f}ms, p99={p99:.3f}ms")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="评估本地文件名匹配的精确率和查找延迟")
+    parser.add_argument("--corpus", help="JSON Lines 格式的标注语料，默认使用数据库中的文件匹配记录")
+    parser.add_argument("--test-ratio", type=float, default=0.2, help="用于测试的语料比例（默认0.2）")
+    parser.add_argument("--seed", type=int, default=0, help="随机划分语料的种子")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus) if args.corpus else asyncio.run(load_file_matches())
+    if not corpus:
+        print("没有可用的标注语料")
+    else:
+        benchmark(corpus, args.test_ratio, args.seed)
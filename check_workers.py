@@ -0,0 +1,119 @@
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+def upstream(request) -> Any:
+    """模拟弹弹play接口，每个编号返回固定的数据"""
+    import httpx
+    path = request.url.path
+    if path.startswith('/api/v2/comment/'):
+        comments = [{'cid': i, 'p': f'{i}.00,1,16777215,u{i}', 'm': f'c{i}'} for i in range(1, 51)]
+        return httpx.Response(200, json={'count': len(comments), 'comments': comments})
+    if path == '/api/v2/search/episodes':
+        return httpx.Response(200, json={'success': True, 'errorCode': 0, 'animes': []})
+    if path == '/api/v2/search/anime':
+        anime_id = int(request.url.params['keyword'][2:])
+        return httpx.Response(200, json={'success': True, 'errorCode': 0, 'animes': [
+            {'animeId': anime_id, 'animeTitle': f'Anime {anime_id}', 'type': 'tvseries', 'episodeCount': 12}
+        ]})
+    if path == '/api/v2/match':
+        return httpx.Response(200, json={'success': True, 'errorCode': 0, 'isMatched': True, 'matches': [
+            {'episodeId': 10001, 'animeId': 1, 'animeTitle': 'Anime 1', 'episodeTitle': 'e1', 'type': 'tvseries'}
+        ]})
+    return httpx.Response(404)
+
+class _ErrorCounter(logging.Handler):
+    """收集写入数据库时记录的错误日志"""
+
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.messages: List[str] = []
+
+    def emit(self, record: logging.LogRecord):
+        self.messages.append(record.getMessage())
+
+def worker(args: Dict[str, Any]) -> List[str]:
+    """一个工作进程：同时写入与其他进程相同的缓存记录，返回出错信息"""
+    async def run() -> List[str]:
+        import httpx
+        from app.database import init_db, AsyncSessionLocal, close_db
+        from app.services.proxy import DanmakuProxy
+
+        errors = _ErrorCounter()
+        logging.getLogger().addHandler(errors)
+        await init_db()
+        client = httpx.AsyncClient(transport=httpx.MockTransport(upstream))
+
+        async def write(key: int):
+            try:
+                async with AsyncSessionLocal() as session:
+                    proxy = DanmakuProxy(session, client)
+                    await proxy._fetch_danmaku(key, False, 0)
+                    await proxy._fetch_tmdb(key, 1)
+                    await proxy._fetch_search(f'kw{key}', '')
+                    await proxy._fetch_match(f'{key}.mkv', f'{key:032d}', 1, 1, 'hashOnly')
+            except Exception as e:
+                errors.messages.append(f'{type(e).__name__}: {e}')
+
+        try:
+            for _ in range(args['rounds']):
+                await asyncio.gather(*(write(key) for key in range(1, args['keys'] + 1)))
+        finally:
+            await client.aclose()
+            await close_db()
+        return errors.messages
+
+    return asyncio.run(run())
+
+def check(database: str, workers: int, keys: int, rounds: int) -> bool:
+    """多个工作进程同时写入同一个数据库，检查是否出错以及记录数是否正确"""
+    started = time.perf_counter()
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(workers) as pool:
+        results = pool.map(worker, [{'keys': keys, 'rounds': rounds}] * workers)
+    elapsed = time.perf_counter() - started
+
+    errors = [message for messages in results for message in messages]
+    db = sqlite3.connect(database)
+    journal_mode = db.execute('PRAGMA journal_mode').fetchone()[0]
+    counts = {
+        table: db.execute(f'SELECT count(*) FROM {table}').fetchone()[0]
+        for table in ('danmaku_cache', 'tmdb_cache', 'anime_search_cache', 'file_matches')
+    }
+    db.close()
+
+    print(f"工作进程: {workers}，每个进程写入 {keys} 个编号 × {rounds} 轮，耗时 {elapsed:.1f}s")
+    print(f"日志模式: {journal_mode}")
+    print(f"记录数: {counts}（每张表应为 {keys}）")
+    print(f"错误: {len(errors)}")
+    for message in sorted(set(errors))[:10]:
+        print(f"   - {message.splitlines()[0][:200]}")
+    return not errors and journal_mode == 'wal' and all(count == keys for count in counts.values())
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="检查多个工作进程同时写入同一个SQLite数据库时是否出错（上游接口为模拟数据）")
+    parser.add_argument("--workers", type=int, default=4, help="工作进程数（默认4）")
+    parser.add_argument("--keys", type=int, default=50, help="每个进程写入的编号数，所有进程使用相同的编号（默认50）")
+    parser.add_argument("--rounds", type=int, default=3, help="写入轮数（默认3）")
+    parser.add_argument("--database", help="数据库文件，默认在临时目录中新建，不要使用正在运行的服务的数据库")
+    args = parser.parse_args()
+
+    database = args.database or os.path.join(tempfile.mkdtemp(), 'check_workers.db')
+    # 子进程继承环境变量，在导入应用配置之前设置
+    os.environ['DATABASE_URL'] = f'sqlite+aiosqlite:///{os.path.abspath(database)}'
+    os.environ.setdefault('DANDAN_APP_ID', 'check')
+    os.environ.setdefault('DANDAN_APP_SECRET', 'check')
+    for name in ('COMMENT', 'MATCH', 'SEARCH'):
+        os.environ[f'UPSTREAM_{name}_RATE'] = '0'
+    os.environ['WEB_CONCURRENCY'] = str(args.workers)
+
+    ok = check(database, args.workers, args.keys, args.rounds)
+    print("通过" if ok else "失败")
+    sys.exit(0 if ok else 1)
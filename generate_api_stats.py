@@ -1,8 +1,6 @@
 import asyncio
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
-from sqlalchemy import select, func, and_
-from app.models.api_stats import ApiStats
-from datetime import datetime, timedelta
+from app.services.stats_rollup import load_dashboard
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
@@ -25,40 +23,17 @@ async def generate_api_stats():
     # 创建会话
     async with async_session() as session:
         try:
-            # 获取最近24小时的数据
-            start_time = datetime.now() - timedelta(hours=24)
-            
-            # 按端点统计调用次数
-            endpoint_stats = await session.execute(
-                select(
-                    ApiStats.endpoint,
-                    func.count().label('count'),
-                    func.avg(ApiStats.response_time).label('avg_response_time')
-                )
-                .where(ApiStats.timestamp >= start_time)
-                .group_by(ApiStats.endpoint)
-            )
-            endpoint_stats = endpoint_stats.all()
-            
-            # 按小时统计调用次数
-            hourly_stats = await session.execute(
-                select(
-                    func.strftime('%Y-%m-%d %H:00:00', ApiStats.timestamp).label('hour'),
-                    func.count().label('count')
-                )
-                .where(ApiStats.timestamp >= start_time)
-                .group_by('hour')
-                .order_by('hour')
-            )
-            hourly_stats = hourly_stats.all()
+            # 从小时级预聚合数据读取最近24小时的统计
+            dashboard = await load_dashboard(session, hours=24)
             
             # 创建图表目录
             os.makedirs('stats', exist_ok=True)
             
             # 生成端点统计图表
-            df_endpoints = pd.DataFrame(endpoint_stats, columns=['endpoint', 'count', 'avg_response_time'])
+            df_endpoints = pd.DataFrame(dashboard['endpoints'],
+                                        columns=['endpoint', 'count', 'avg_response_time', 'p50', 'p95', 'p99'])
             fig_endpoints = make_subplots(rows=2, cols=1, 
-                                       subplot_titles=('API调用次数', '平均响应时间'))
+                                       subplot_titles=('API调用次数', '响应时间'))
             
             fig_endpoints.add_trace(
                 go.Bar(x=df_endpoints['endpoint'], y=df_endpoints['count'], name='调用次数'),
@@ -70,27 +45,22 @@ async def generate_api_stats():
                 row=2, col=1
             )
             
+            fig_endpoints.add_trace(
+                go.Bar(x=df_endpoints['endpoint'], y=df_endpoints['p95'], name='P95响应时间(ms)'),
+                row=2, col=1
+            )
+            
             fig_endpoints.update_layout(height=800, title_text="API端点统计")
             fig_endpoints.write_html('stats/endpoint_stats.html')
             
             # 生成时间趋势图表
-            df_hourly = pd.DataFrame(hourly_stats, columns=['hour', 'count'])
+            df_hourly = pd.DataFrame(dashboard['hourly'], columns=['hour', 'count'])
             fig_hourly = px.line(df_hourly, x='hour', y='count',
                                title='24小时API调用趋势')
             fig_hourly.write_html('stats/hourly_stats.html')
             
             # 生成状态码分布图表
-            status_stats = await session.execute(
-                select(
-                    ApiStats.status_code,
-                    func.count().label('count')
-                )
-                .where(ApiStats.timestamp >= start_time)
-                .group_by(ApiStats.status_code)
-            )
-            status_stats = status_stats.all()
-            
-            df_status = pd.DataFrame(status_stats, columns=['status_code', 'count'])
+            df_status = pd.DataFrame(dashboard['status'], columns=['status_code', 'count'])
             fig_status = px.pie(df_status, values='count', names='status_code',
                               title='API响应状态码分布')
             fig_status.write_html('stats/status_stats.html')
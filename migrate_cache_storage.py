@@ -0,0 +1,55 @@
+import sys
+import asyncio
+from sqlalchemy import select
+from app.database import init_db, AsyncSessionLocal, close_db
+from app.models.danmaku import AnimeSearchCache, DanmakuCache, TmdbCache
+from app.services.storage import SUPPORTED_FORMATS, resolve_format, load_payload, store_payload
+
+# 每批处理的记录数
+BATCH_SIZE = 100
+
+async def migrate_table(model, fmt: str):
+    """将指定缓存表中的记录转换为目标存储格式"""
+    converted = 0
+    stored_bytes = 0
+    last_id = 0
+    while True:
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                select(model).where(model.id > last_id).order_by(model.id).limit(BATCH_SIZE)
+            )
+            rows = result.scalars().all()
+            if not rows:
+                break
+            for row in rows:
+                last_id = row.id
+                if row.encoding == fmt and row.checksum:
+                    continue
+                data = load_payload(row)
+                size = store_payload(row, data, fmt)
+                stored_bytes += len(row.payload) if row.payload is not None else size
+                converted += 1
+            await session.commit()
+    return converted, stored_bytes
+
+async def migrate_cache_storage(fmt: str):
+    # 升级表结构（补充存储格式相关的列）
+    await init_db()
+    try:
+        for name, model in (("弹幕缓存", DanmakuCache), ("TMDB缓存", TmdbCache), ("搜索缓存", AnimeSearchCache)):
+            converted, stored_bytes = await migrate_table(model, fmt)
+            print(f"{name}: 已转换 {converted} 条记录为 {fmt} 格式")
+            if converted:
+                print(f"   - 转换后存储大小: {stored_bytes / 1024:.1f} KB")
+        print("缓存存储格式迁移完成！如需回收磁盘空间，请在停止服务后执行 VACUUM。")
+    except Exception as e:
+        print(f"迁移缓存存储格式时发生错误: {e}")
+    finally:
+        await close_db()
+
+if __name__ == "__main__":
+    target = sys.argv[1] if len(sys.argv) > 1 else None
+    if target and target not in SUPPORTED_FORMATS:
+        print(f"用法: python migrate_cache_storage.py [{'|'.join(SUPPORTED_FORMATS)}]")
+        sys.exit(1)
+    asyncio.run(migrate_cache_storage(resolve_format(target)))
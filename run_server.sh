@@ -1,5 +1,17 @@
 #!/bin/bash
 
+# 用法: ./run_server.sh [--workers N]
+# 多个工作进程共享同一个 SQLite 数据库（WAL 模式），上游限速按进程数平分
+WORKERS=${WORKERS:-1}
+while [ $# -gt 0 ]; do
+    case "$1" in
+        --workers) WORKERS="$2"; shift 2 ;;
+        --workers=*) WORKERS="${1#*=}"; shift ;;
+        *) echo "未知参数: $1"; exit 1 ;;
+    esac
+done
+export WEB_CONCURRENCY=$WORKERS
+
 source venv/bin/activate
 
-uvicorn app.main:app --host 127.0.0.1 --port 9001 --workers 1
+uvicorn app.main:app --host 127.0.0.1 --port 9001 --workers "$WORKERS"
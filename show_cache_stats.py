@@ -1,7 +1,7 @@
 import asyncio
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy import select, func
-from app.models.danmaku import DanmakuCache, TmdbCache
+from app.models.danmaku import AnimeSearchCache, DanmakuCache, NegativeCacheEntry, TmdbCache
 from app.models.file_match import FileMatch
 from datetime import datetime, timedelta
 
@@ -29,6 +29,8 @@ async def show_cache_stats():
             danmaku_newest = await session.scalar(
                 select(func.max(DanmakuCache.updated_at)).select_from(DanmakuCache)
             )
+            danmaku_raw_bytes = await session.scalar(select(func.sum(DanmakuCache.payload_size)))
+            danmaku_stored_bytes = await session.scalar(select(func.sum(func.length(DanmakuCache.payload))))
             
             # 获取TMDB缓存统计
             tmdb_count = await session.scalar(select(func.count()).select_from(TmdbCache))
@@ -39,6 +41,12 @@ async def show_cache_stats():
                 select(func.max(TmdbCache.updated_at)).select_from(TmdbCache)
             )
             
+            # 获取搜索结果缓存统计
+            search_count = await session.scalar(select(func.count()).select_from(AnimeSearchCache))
+            search_newest = await session.scalar(
+                select(func.max(AnimeSearchCache.updated_at)).select_from(AnimeSearchCache)
+            )
+            
             # 获取文件匹配记录统计
             file_match_count = await session.scalar(select(func.count()).select_from(FileMatch))
             file_match_oldest = await session.scalar(
@@ -48,6 +56,11 @@ async def show_cache_stats():
                 select(func.max(FileMatch.updated_at)).select_from(FileMatch)
             )
             
+            # 获取未命中结果缓存统计
+            negative_counts = dict((await session.execute(
+                select(NegativeCacheEntry.kind, func.count()).group_by(NegativeCacheEntry.kind)
+            )).all())
+            
             # 打印统计信息
             print("\n=== 数据库缓存统计信息 ===")
             print("\n1. 弹幕缓存 (DanmakuCache):")
@@ -56,6 +69,10 @@ async def show_cache_stats():
                 print(f"   - 最早记录: {danmaku_oldest}")
             if danmaku_newest:
                 print(f"   - 最新记录: {danmaku_newest}")
+            if danmaku_raw_bytes:
+                print(f"   - 数据大小: {danmaku_raw_bytes / (1024*1024):.2f} MB")
+            if danmaku_stored_bytes:
+                print(f"   - 压缩后大小: {danmaku_stored_bytes / (1024*1024):.2f} MB")
             
             print("\n2. TMDB缓存 (TmdbCache):")
             print(f"   - 总记录数: {tmdb_count or 0}")
@@ -64,15 +81,25 @@ async def show_cache_stats():
             if tmdb_newest:
                 print(f"   - 最新记录: {tmdb_newest}")
             
-            print("\n3. 文件匹配记录 (FileMatch):")
+            print("\n3. 搜索结果缓存 (AnimeSearchCache):")
+            print(f"   - 总记录数: {search_count or 0}")
+            if search_newest:
+                print(f"   - 最新记录: {search_newest}")
+            
+            print("\n4. 文件匹配记录 (FileMatch):")
             print(f"   - 总记录数: {file_match_count or 0}")
             if file_match_oldest:
                 print(f"   - 最早记录: {file_match_oldest}")
             if file_match_newest:
                 print(f"   - 最新记录: {file_match_newest}")
             
+            print("\n5. 未命中结果缓存 (NegativeCacheEntry):")
+            print(f"   - 总记录数: {sum(negative_counts.values())}")
+            for kind, count in sorted(negative_counts.items()):
+                print(f"   - {kind}: {count}")
+            
             # 计算总缓存大小（估算）
-            total_records = (danmaku_count or 0) + (tmdb_count or 0) + (file_match_count or 0)
+            total_records = (danmaku_count or 0) + (tmdb_count or 0) + (search_count or 0) + (file_match_count or 0) + sum(negative_counts.values())
             print(f"\n总缓存记录数: {total_records}")
             
         except Exception as e:
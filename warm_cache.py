@@ -0,0 +1,36 @@
+import argparse
+import asyncio
+from app.config import settings
+from app.database import init_db, AsyncSessionLocal, close_db
+from app.services.http_client import init_http_client, close_http_client
+from app.services.cache_warmer import cache_warmer, rank_from_api_stats
+
+async def warm_cache(hours: int, top: int, budget: int):
+    await init_db()
+    await init_http_client()
+    try:
+        # 命令行进程没有访问计数，根据API调用记录排序热门节目
+        async with AsyncSessionLocal() as session:
+            ranked = await rank_from_api_stats(session, hours, top)
+        if not ranked:
+            print(f"最近 {hours} 小时没有弹幕请求记录")
+            return
+        print(f"最近 {hours} 小时最热门的 {len(ranked)} 个节目：")
+        for episode_id, count in ranked[:10]:
+            print(f"   - {episode_id}: {count} 次")
+        result = await cache_warmer.warm([(episode_id, None, None) for episode_id, _ in ranked], budget)
+        print(f"即将过期的缓存: {result['candidates']} 条")
+        print(f"已刷新: {result['refreshed']} 条，失败: {result['failed']} 条")
+    except Exception as e:
+        print(f"预热缓存时发生错误: {e}")
+    finally:
+        await close_http_client()
+        await close_db()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="刷新热门节目中即将过期的弹幕缓存")
+    parser.add_argument("--hours", type=int, default=24, help="统计最近多少小时的请求（默认24）")
+    parser.add_argument("--top", type=int, default=settings.CACHE_WARM_TOP_N, help="考虑的热门节目数")
+    parser.add_argument("--budget", type=int, default=settings.CACHE_WARM_BUDGET, help="最多请求上游的次数")
+    args = parser.parse_args()
+    asyncio.run(warm_cache(args.hours, args.top, args.budget))